@@ -0,0 +1,178 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Set
+
+from metrics import AI_CACHE_REQUESTS, AI_CACHE_SECONDS_SAVED
+
+# A response cache for generic questions that reach the AI chat ("what commands do you have", "how do I deploy a token").
+#
+# Only how-to and FAQ phrasings (FAQ_PATTERN) that don't refer to the user themselves or to something said earlier are
+# cacheable, and only as the first message of a conversation (see aichat.py). Those are answered from a prompt
+# without chat history or expense context, so a cached answer never contains anything personal and makes sense
+# without the conversation. Lookups try the normalized text first and then, optionally, a character trigram
+# similarity index for near-duplicates.
+
+DEFAULT_TTL = 6 * 60 * 60 # generic answers only change when the system prompt does
+MAX_ENTRIES = 1000
+SIMILARITY_THRESHOLD = 0.75 # Jaccard similarity of trigram sets
+# a word or two changes a short question much more than it changes its trigrams, so short keys need to be closer
+SHORT_KEY_LENGTH = 30
+SHORT_SIMILARITY_THRESHOLD = 0.9
+MAX_CACHEABLE_LENGTH = 200
+
+FILLER_WORDS = {"please", "pls", "hey", "hi", "hello", "penny", "can", "could", "you", "tell", "me", "the", "a", "an", "um", "so"}
+# the questions that get the same answer whoever asks them: how to do something with the bot, what it can do, what a
+# term means
+FAQ_PATTERN = re.compile(
+    r"^(how (do|can|should|would) (i|you|we)\b|how to\b|where (do|can) i\b"
+    r"|what (commands|features)\b|what can you\b|what do you do\b|which commands\b|what is penny\b"
+    r"|what (is|are|does) (a|an)\s+\w+|(can|could) you help\b|help\b)"
+)
+# "hey penny, how do I ..." is the same question as "how do I ..."
+GREETING_PATTERN = re.compile(r"^((hey|hi|hello|penny|please|so)\b[\s,!]*)+")
+# "that", "it" or "the second one" refer to something said earlier, the answer depends on the conversation
+REFERENCE_PATTERN = re.compile(r"\b(it|its|that|this|these|those|they|them|one|ones|above|previous|again|else)\b")
+# first person references, numbers and amounts make an answer specific to whoever asked
+PERSONAL_PATTERN = re.compile(r"\b(i|i'm|im|i've|ive|me|my|mine|myself|we|our|us)\b|\d")
+# ...except in how-to phrasing like "how do I deploy a token", which asks about the bot rather than the user
+HOWTO_PATTERN = re.compile(r"^(how|where|what|when|can|should)\s+(do|can|should|would)?\s*i\b")
+# near-duplicates only match when they agree on these, "how do i not deploy a token" isn't "how do i deploy a token"
+# and "why ..." isn't "how ..."
+NEGATION_WORDS = {"not", "no", "never", "without", "nor", "cannot", "dont", "doesnt", "cant", "wont", "isnt", "stop"}
+QUESTION_WORDS = {"how", "what", "why", "when", "where", "who", "which", "whats"}
+
+class CachedResponse(NamedTuple):
+    text: str
+    created_at: float
+    generation_seconds: float # how long the model took, i.e. what a hit saves
+
+class ResponseCache:
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = MAX_ENTRIES,
+                 fuzzy: bool = True, similarity_threshold: float = SIMILARITY_THRESHOLD):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.fuzzy = fuzzy
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._trigrams: Dict[str, Set[str]] = {} # trigram -> keys containing it
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Lowercase, strip punctuation and filler words so trivially different phrasings share a key."""
+        words = re.sub(r"[^\w\s']", " ", message.lower()).split()
+        return " ".join(word for word in words if word not in FILLER_WORDS)
+
+    @staticmethod
+    def is_cacheable(message: str) -> bool:
+        """Whether a message is a generic question whose answer can be shared between users."""
+        text = message.strip().lower()
+        if not 0 < len(text) <= MAX_CACHEABLE_LENGTH:
+            return False
+        text = GREETING_PATTERN.sub("", text)
+        if not FAQ_PATTERN.match(text):
+            return False
+        rest = HOWTO_PATTERN.sub("", text)
+        return not PERSONAL_PATTERN.search(rest) and not REFERENCE_PATTERN.search(rest)
+
+    @staticmethod
+    def _meaning_words(key: str) -> Set[str]:
+        """The negations and question words of a key, which trigram similarity barely notices."""
+        words = key.split()
+        meaning = {word.replace("'", "") for word in words} & (NEGATION_WORDS | QUESTION_WORDS)
+        if any(word.endswith("n't") for word in words): # shouldn't, wouldn't, aren't...
+            meaning.add("not")
+        return meaning
+
+    @staticmethod
+    def _trigram_set(key: str) -> Set[str]:
+        padded = f"  {key} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def get(self, message: str) -> Optional[str]:
+        key = self.normalize(message)
+        entry = self._lookup(key)
+        if entry is None and self.fuzzy and key:
+            similar_key = self._most_similar(key)
+            entry = self._lookup(similar_key) if similar_key else None
+
+        if entry is None:
+            self.misses += 1
+            AI_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        self.hits += 1
+        self.seconds_saved += entry.generation_seconds
+        AI_CACHE_REQUESTS.labels("hit").inc()
+        AI_CACHE_SECONDS_SAVED.inc(entry.generation_seconds)
+        return entry.text
+
+    def put(self, message: str, response: str, generation_seconds: float) -> None:
+        key = self.normalize(message)
+        if not key:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CachedResponse(response, time.monotonic(), generation_seconds)
+        for trigram in self._trigram_set(key):
+            self._trigrams.setdefault(trigram, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._trigrams.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "seconds_saved": round(self.seconds_saved, 2),
+        }
+
+    def _lookup(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at > self.ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key) # least recently used entries are evicted first
+        return entry
+
+    def _most_similar(self, key: str) -> Optional[str]:
+        trigrams = self._trigram_set(key)
+        # count shared trigrams per candidate using the inverted index instead of comparing against every entry
+        shared: Dict[str, int] = {}
+        for trigram in trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        threshold = self.similarity_threshold
+        if len(key) < SHORT_KEY_LENGTH:
+            threshold = max(threshold, SHORT_SIMILARITY_THRESHOLD)
+        meaning = self._meaning_words(key)
+        best_key, best_score = None, threshold
+        for candidate, overlap in shared.items():
+            union = len(trigrams) + len(self._trigram_set(candidate)) - overlap
+            score = overlap / union
+            if score >= best_score and self._meaning_words(candidate) == meaning:
+                best_key, best_score = candidate, score
+        return best_key
+
+    def _remove(self, key: str) -> None:
+        self._entries.pop(key, None)
+        for trigram in self._trigram_set(key):
+            keys = self._trigrams.get(trigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._trigrams[trigram]
+
+# shared by every chat so one user's generic question warms the cache for everyone
+response_cache = ResponseCache()
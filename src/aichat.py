@@ -1,25 +1,27 @@
+import asyncio
 import logging
 import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
 
-# Configure logging
-logger = logging.getLogger(__name__)
-
-try:
-    import openai
-    from typing import List, Dict, Any
-    
-    # Configure OpenAI
-    CHATGPT_API_KEY = ""
-    openai.api_key = CHATGPT_API_KEY
-    OPENAI_AVAILABLE = True
-except ImportError:
-    logger.error("OpenAI module not found. AI chat functionality will not be available.")
-    OPENAI_AVAILABLE = False
-
-from telegram import Update
+from telegram import Update, Message
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes, MessageHandler, filters
 
-from database import get_user_expenses # Import the function to get expenses
+from database import get_user_categories, get_home_currency
+from metrics import AI_FIRST_TOKEN_LATENCY, AI_LOCAL_INTENTS
+from llm import LLM_AVAILABLE, LLMError, llm
+from aicache import response_cache
+from promptbuilder import ChatMemory, PromptBuilder
+from usercontext import user_context_cache
+from intents import Intent, parse_intent, ADD_EXPENSE, SPENDING_SUMMARY, BUDGET_STATUS, GOAL_STATUS, WALLET_BALANCE
+from expense import record_expenses
+from analytics import monthly_changes, budget_burn_rates, goal_projections, describe_goal
+from currency import format_money
+
+# Configure logging
+logger = logging.getLogger(__name__)
 
 # Define a system prompt that sets the AI's role and behavior
 SYSTEM_PROMPT = """
@@ -50,84 +52,179 @@ Keep responses brief and to the point. If users want to use specific bot command
 Always be helpful, friendly, and financially-focused in your responses.
 """
 
-# Maximum conversation history to keep per user
-MAX_HISTORY_LENGTH = 10
+prompt_builder = PromptBuilder(SYSTEM_PROMPT)
+
+# Streaming shows the reply as it is generated by editing a placeholder message. Telegram rate limits edits
+# (roughly one per second per chat), so chunks are coalesced and we edit at most every EDIT_INTERVAL seconds.
+STREAMING_ENABLED = os.getenv("AI_CHAT_STREAMING", "true").lower() != "false"
+EDIT_INTERVAL = 1.0
+MIN_EDIT_CHARS = 15 # don't spend an edit on a couple of characters
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAM_CURSOR = " ▌"
+
+async def _edit(message: Message, text: str) -> Optional[float]:
+    """Edit a message, returns None if it was edited or the seconds Telegram asked us to wait if it was rate limited."""
+    try:
+        await message.edit_text(text[:TELEGRAM_MESSAGE_LIMIT])
+        return None
+    except RetryAfter as e:
+        # we'll catch up on the next edit, the final text is always sent
+        retry_after = e.retry_after
+        return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return None
+        raise
+
+async def stream_completion(update: Update, messages) -> str:
+    """Stream a chat completion into a placeholder reply that is edited as tokens arrive, returns the full text."""
+    placeholder = await update.message.reply_text("…")
+    start = time.monotonic()
+    text = ""
+    sent = ""
+    next_edit = start # the first token goes out right away, after that edits are coalesced
+    retry_after = None
+
+    async for delta in llm.stream("chat", messages):
+        if not text:
+            AI_FIRST_TOKEN_LATENCY.observe(time.monotonic() - start)
+        text += delta
+
+        now = time.monotonic()
+        # whether or not the edit went through, the next one waits EDIT_INTERVAL, or as long as Telegram asked
+        if now >= next_edit and (not sent or len(text) - len(sent) >= MIN_EDIT_CHARS):
+            retry_after = await _edit(placeholder, text + STREAM_CURSOR)
+            if retry_after is None:
+                sent = text
+            next_edit = now + max(EDIT_INTERVAL, retry_after or 0.0)
+
+    if not text:
+        text = "I'm not sure what to say to that. Could you rephrase?"
+    # final edit drops the cursor, after the back-off if the last edit was rate limited, and retried once
+    if retry_after is not None:
+        await asyncio.sleep(max(0.0, next_edit - time.monotonic()))
+    retry_after = await _edit(placeholder, text)
+    if retry_after is not None:
+        await asyncio.sleep(max(EDIT_INTERVAL, retry_after))
+        await _edit(placeholder, text)
+    return text
+
+def answer_intent(user_id: int, intent: Intent) -> str:
+    """Act on a message the intent parser recognized and return the reply, without involving the model."""
+    if intent.name == SPENDING_SUMMARY:
+        month = datetime.now(timezone.utc).strftime("%Y-%m")
+        changes = [change for change in monthly_changes(user_id, months=1) if change.month == month]
+        if not changes:
+            return "You haven't recorded any expenses this month. Tell me something like \"I spent 12 on coffee\" to add one."
+        currency = get_home_currency(user_id)
+        lines = [f"📊 Your spending this month: {format_money(sum(change.total for change in changes), currency)}"]
+        lines += [f"• {change.category}: {format_money(change.total, currency)}" for change in changes]
+        return "\n".join(lines)
+
+    if intent.name == BUDGET_STATUS:
+        budgets = budget_burn_rates(user_id)
+        if not budgets:
+            return "You don't have any active budgets yet. Use /budget to set one up."
+        currency = get_home_currency(user_id)
+        lines = ["💰 Your budgets:"]
+        lines += [
+            f"• {budget.category}: {format_money(budget.spent, currency)} of {format_money(budget.amount, currency)} spent, "
+            f"{format_money(budget.amount - budget.spent, currency)} left"
+            for budget in budgets
+        ]
+        return "\n".join(lines)
+
+    if intent.name == GOAL_STATUS:
+        goals = goal_projections(user_id)
+        if not goals:
+            return "You don't have any active goals yet. Use /goal to create one."
+        currency = get_home_currency(user_id)
+        return "\n".join(["🎯 Your goals:"] + ["• " + describe_goal(goal, currency)[2:] for goal in goals])
+
+    raise ValueError(f"No local answer for intent {intent.name}")
 
 async def handle_ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle non-command messages by sending them to ChatGPT API."""
-    if not OPENAI_AVAILABLE:
+    """Handle non-command messages, locally when they are a recognizable intent and with the chat model otherwise."""
+    user_id = update.effective_user.id
+    user_message = update.message.text
+    # Recent turns and a rolling summary of older ones live in user_data, see promptbuilder.py
+    memory = ChatMemory.from_user_data(context.user_data)
+
+    # "I spent 12 on coffee" or "how are my goals" don't need the model, see intents.py
+    intent = parse_intent(user_message, get_user_categories(user_id))
+    if intent is not None:
+        AI_LOCAL_INTENTS.labels(intent.name).inc()
+        if intent.name == WALLET_BALANCE:
+            # checkbalance imports the 1Shot SDK, so only load it when someone asks
+            from checkbalance import check_balance
+            await check_balance(update, context)
+            return
+        if intent.name == ADD_EXPENSE:
+            # all items go in with one transaction and the reply gets an undo button
+            reply = await record_expenses(update, intent.expenses)
+        else:
+            reply = answer_intent(user_id, intent)
+            await update.message.reply_text(reply)
+        memory.add_turn("user", user_message)
+        memory.add_turn("assistant", reply)
+        return
+
+    if not LLM_AVAILABLE:
         await update.message.reply_text(
             "I'm sorry, but my AI capabilities are not available right now. "
             "Please use one of my commands like /hello or /help instead."
         )
         return
-        
-    user_id = update.effective_user.id
-    user_message = update.message.text
-    
-    # Initialize conversation history if it doesn't exist
-    if 'chat_history' not in context.user_data:
-        context.user_data['chat_history'] = []
-
-    # Fetch recent expenses for the user
-    recent_expenses = get_user_expenses(user_id, limit=5) # Fetch last 5 expenses
-    expense_summary = ""
-    if recent_expenses:
-        expense_summary = "\n\nHere are your recent expenses for context:\n"
-        for expense in recent_expenses:
-            # amount, category, description, date, payment_method
-            expense_summary += f"- Amount: ${expense[0]:.2f}, Category: {expense[1]}, Date: {expense[3].split(' ')[0]}\n"
-    
-    # Add user message to history (potentially with expense summary)
-    context.user_data['chat_history'].append({
-        "role": "user",
-        "content": user_message + expense_summary # Append expense summary to user's message
-    })
-    
-    # Create messages array with system prompt and conversation history
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT}
-    ]
-    
-    # Add conversation history (limited to prevent token limit issues)
-    history = context.user_data['chat_history'][-MAX_HISTORY_LENGTH:]
-    messages.extend(history)
+
+    # Generic questions ("what commands do you have?") are answered from a shared cache. They are generated
+    # without history or expense context, so the cached answer holds nothing specific to the user who asked first.
+    # Mid-conversation even a generic-looking question may build on what was said, so only an opening one is cached.
+    opening = not memory.turns and not memory.summary_lines
+    cacheable = opening and response_cache.is_cacheable(user_message)
+    if cacheable:
+        cached_response = response_cache.get(user_message)
+        if cached_response is not None:
+            memory.add_turn("user", user_message)
+            memory.add_turn("assistant", cached_response)
+            await update.message.reply_text(cached_response)
+            return
+        messages = prompt_builder.build(ChatMemory(), user_message)
+    else:
+        # the user's financial snapshot goes into the prompt once as a system message instead of being appended to
+        # every turn; it is cached and rebuilt after writes, see usercontext.py
+        messages = prompt_builder.build(memory, user_message, user_context_cache.get(user_id))
     
     try:
         # Send typing action to indicate the bot is processing
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
-        # Call OpenAI API
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=500, # Increased max_tokens slightly to accommodate potentially longer prompts with expenses
-            temperature=0.7,
-            top_p=0.95
-        )
-        
-        # Extract response text
-        ai_response = response.choices[0].message.content
-        
-        # Add assistant response to history
-        context.user_data['chat_history'].append({
-            "role": "assistant",
-            "content": ai_response
-        })
-        
-        # Trim history if it gets too long
-        if len(context.user_data['chat_history']) > MAX_HISTORY_LENGTH * 2:
-            context.user_data['chat_history'] = context.user_data['chat_history'][-MAX_HISTORY_LENGTH * 2:]
-        
-        # Send response to user
-        await update.message.reply_text(ai_response)
+        started = time.monotonic()
+        if STREAMING_ENABLED:
+            # the reply is sent and progressively edited while the completion streams in
+            ai_response = await stream_completion(update, messages)
+        else:
+            # the chat route uses the small, fast model, see llm.py
+            ai_response = await llm.complete("chat", messages)
+            await update.message.reply_text(ai_response)
+
+        if cacheable:
+            response_cache.put(user_message, ai_response, time.monotonic() - started)
+
+        # only store the exchange once it succeeded, the memory folds old turns into its summary by itself
+        memory.add_turn("user", user_message)
+        memory.add_turn("assistant", ai_response)
         
+    except LLMError as e:
+        logger.error("LLM error in AI chat: %s", e)
+        await update.message.reply_text(
+            "I'm having trouble connecting to my brain right now. Please try again later."
+        )
     except Exception as e:
-        logger.error(f"Error in AI chat: {e}")
+        logger.error("Error in AI chat: %s", e)
         await update.message.reply_text(
             "I'm having trouble connecting to my brain right now. Please try again later."
         )
 
 def get_ai_chat_handler():
-    """Return the handler for AI chat."""
-    return MessageHandler(filters.TEXT & ~filters.COMMAND, handle_ai_chat) 
\ No newline at end of file
+    """Return the handler for AI chat, private chats only: in a group "pizza 20" is chatter, not the sender's expense."""
+    return MessageHandler(filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE, handle_ai_chat)
\ No newline at end of file
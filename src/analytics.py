@@ -0,0 +1,369 @@
+import math
+from datetime import date, datetime
+from typing import List, NamedTuple, Optional
+
+from currency import DEFAULT_CURRENCY, format_money
+from database import FX_JOIN, HOME_AMOUNT, HOME_RATE, get_connection, get_budget_spend, get_home_currency
+from metrics import timed_query
+
+# Local spending analytics over a user's full history. The arithmetic (totals, budget burn, month over month
+# changes, goal projections, unusual expenses) is done here with SQL aggregates and window functions, so /report
+# hands the model finished numbers instead of raw rows, and can render a plain report when OpenAI is unavailable.
+# Amounts are converted into the user's home currency by the queries themselves (see HOME_AMOUNT in database.py) and
+# are integer minor units of it; rates and averages derived from them are fractional minor units.
+
+ANOMALY_LOOKBACK_DAYS = 30
+ANOMALY_MIN_SAMPLES = 5 # a category needs some history before an expense in it can look unusual
+ANOMALY_STDDEVS = 2.0
+MONTHS_OF_HISTORY = 6
+GOAL_VELOCITY_DAYS = 90 # goal ETAs follow the recent saving pace, not the average since the goal was created
+
+class CategoryTotal(NamedTuple):
+    category: str
+    total: int
+    count: int
+    share: float # of all-time spending, 0-1
+
+class MonthlyChange(NamedTuple):
+    month: str # YYYY-MM
+    category: str
+    total: int
+    previous: Optional[int] # the category's total the month before, None if there was no spending
+    change: Optional[float] # relative, 0.25 is +25%
+
+class BudgetBurn(NamedTuple):
+    category: str
+    amount: int
+    spent: int
+    days_elapsed: int
+    days_total: int
+    daily_burn: float
+    projected: float # spending at the end of the period if the current pace continues
+
+    @property
+    def used(self) -> float:
+        return self.spent / self.amount if self.amount else 0.0
+
+    @property
+    def on_track(self) -> bool:
+        return self.projected <= self.amount
+
+class GoalProjection(NamedTuple):
+    goal_id: int
+    name: str
+    target: int
+    current: int
+    daily_rate: float # average saved per day over the last GOAL_VELOCITY_DAYS (or since creation if younger)
+    previous_rate: Optional[float] # the same over the window before, None if the goal is younger than one window
+    eta_days: Optional[int] # None when nothing has been saved recently
+    deadline: Optional[str]
+    days_to_deadline: Optional[int] # None without a parseable deadline
+
+    @property
+    def on_track(self) -> Optional[bool]:
+        if self.days_to_deadline is None:
+            return None
+        return self.eta_days is not None and self.eta_days <= self.days_to_deadline
+
+    @property
+    def trend(self) -> Optional[float]:
+        """Relative change of the saving pace against the window before, 0.25 is +25%."""
+        if not self.previous_rate:
+            return None
+        return self.daily_rate / self.previous_rate - 1
+
+class Anomaly(NamedTuple):
+    date: str
+    category: str
+    amount: int
+    description: Optional[str]
+    category_average: float
+
+class FinancialFacts(NamedTuple):
+    categories: List[CategoryTotal]
+    monthly: List[MonthlyChange]
+    budgets: List[BudgetBurn]
+    goals: List[GoalProjection]
+    anomalies: List[Anomaly]
+    currency: str = DEFAULT_CURRENCY # the home currency every amount above is in
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.categories or self.budgets or self.goals)
+
+    @property
+    def total_spent(self) -> int:
+        return sum(category.total for category in self.categories)
+
+@timed_query
+def category_totals(user_id: int) -> List[CategoryTotal]:
+    """All-time spending per category, largest first, with each category's share of the total."""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        f"""
+        WITH {HOME_RATE},
+        converted AS (
+            SELECT e.category, {HOME_AMOUNT} AS amount
+            FROM expenses e {FX_JOIN}
+            WHERE e.user_id = ?
+        )
+        SELECT category, SUM(amount), COUNT(*),
+               SUM(amount) * 1.0 / SUM(SUM(amount)) OVER ()
+        FROM converted
+        GROUP BY category
+        ORDER BY SUM(amount) DESC
+        """,
+        (user_id, user_id)
+    )
+
+    rows = cursor.fetchall()
+    conn.close()
+    return [CategoryTotal(category, total, count, share or 0.0) for category, total, count, share in rows]
+
+@timed_query
+def monthly_changes(user_id: int, months: int = MONTHS_OF_HISTORY) -> List[MonthlyChange]:
+    """Per category totals for the last few months, each compared with the category's previous month."""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        f"""
+        WITH {HOME_RATE},
+        monthly AS (
+            SELECT strftime('%Y-%m', e.date) AS month, e.category, SUM({HOME_AMOUNT}) AS total
+            FROM expenses e {FX_JOIN}
+            WHERE e.user_id = ? AND e.date >= date('now', 'start of month', ?)
+            GROUP BY month, e.category
+        ),
+        with_previous AS (
+            SELECT month, category, total,
+                   LAG(total) OVER (PARTITION BY category ORDER BY month) AS previous,
+                   LAG(month) OVER (PARTITION BY category ORDER BY month) AS previous_month
+            FROM monthly
+        )
+        SELECT month, category, total,
+               -- only a directly preceding month counts as "previous", a gap means there was no spending
+               CASE WHEN previous_month = strftime('%Y-%m', month || '-01', '-1 month') THEN previous END
+        FROM with_previous
+        ORDER BY month DESC, total DESC
+        """,
+        (user_id, user_id, f"-{months} months")
+    )
+
+    rows = cursor.fetchall()
+    conn.close()
+    return [
+        MonthlyChange(month, category, total, previous, (total - previous) / previous if previous else None)
+        for month, category, total, previous in rows
+    ]
+
+def budget_burn_rates(user_id: int) -> List[BudgetBurn]:
+    """Spending against each active budget's current window so far, and where it ends up at the current pace."""
+    today = datetime.utcnow().date()
+    burns = []
+    for _, category, amount, _, start_date, end_date, spent in get_budget_spend(user_id):
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        days_total = max(1, (end - start).days + 1)
+        days_elapsed = min(days_total, max(1, (today - start).days + 1))
+        daily_burn = spent / days_elapsed
+        burns.append(BudgetBurn(category, amount, spent, days_elapsed, days_total, daily_burn, daily_burn * days_total))
+    burns.sort(key=lambda burn: burn.used, reverse=True)
+    return burns
+
+@timed_query
+def goal_projections(user_id: int, window_days: int = GOAL_VELOCITY_DAYS) -> List[GoalProjection]:
+    """When each active goal will be reached at the pace the user has recently saved towards it.
+
+    Only the last two windows of contributions are read, a range scan on idx_goal_contributions_goal_date per goal.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT g.id, g.name, g.target_amount, g.current_amount, g.deadline,
+               CAST(julianday(g.deadline) - julianday(date('now')) AS INTEGER),
+               julianday('now') - julianday(g.created_at) AS age_days,
+               COALESCE(SUM(CASE WHEN c.created_at >= datetime('now', ?) THEN c.amount END), 0) AS recent,
+               COALESCE(SUM(CASE WHEN c.created_at < datetime('now', ?) THEN c.amount END), 0) AS previous
+        FROM goals g
+        LEFT JOIN goal_contributions c ON c.goal_id = g.id AND c.created_at >= datetime('now', ?)
+        WHERE g.user_id = ? AND g.status = 'active'
+        GROUP BY g.id
+        ORDER BY g.deadline IS NULL, g.deadline
+        """,
+        (f"-{window_days} days", f"-{window_days} days", f"-{2 * window_days} days", user_id)
+    )
+
+    rows = cursor.fetchall()
+    conn.close()
+    projections = []
+    for goal_id, name, target, current, deadline, days_to_deadline, age_days, recent, previous in rows:
+        daily_rate = recent / max(1.0, min(window_days, age_days))
+        previous_rate = previous / min(window_days, age_days - window_days) if age_days >= window_days + 1 else None
+        remaining = max(0, target - current)
+        if remaining == 0:
+            eta_days = 0
+        elif daily_rate > 0:
+            eta_days = math.ceil(remaining / daily_rate)
+        else:
+            eta_days = None
+        projections.append(GoalProjection(
+            goal_id, name, target, current, daily_rate, previous_rate, eta_days, deadline, days_to_deadline
+        ))
+    return projections
+
+@timed_query
+def spending_anomalies(user_id: int, days: int = ANOMALY_LOOKBACK_DAYS) -> List[Anomaly]:
+    """Recent expenses more than a couple of standard deviations above their category's usual amount."""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    # SQLite has no STDDEV, the variance is derived from the windowed averages of x and x²
+    cursor.execute(
+        f"""
+        WITH {HOME_RATE},
+        converted AS (
+            SELECT e.date, e.category, {HOME_AMOUNT} AS amount, e.description
+            FROM expenses e {FX_JOIN}
+            WHERE e.user_id = ?
+        ),
+        stats AS (
+            SELECT date, category, amount, description,
+                   AVG(amount) OVER by_category AS mean,
+                   AVG(amount * amount) OVER by_category AS mean_sq,
+                   COUNT(*) OVER by_category AS samples
+            FROM converted
+            WINDOW by_category AS (PARTITION BY category)
+        )
+        SELECT date, category, amount, description, mean, mean_sq
+        FROM stats
+        WHERE date >= datetime('now', ?) AND samples >= ?
+        ORDER BY date DESC
+        """,
+        (user_id, user_id, f"-{days} days", ANOMALY_MIN_SAMPLES)
+    )
+
+    rows = cursor.fetchall()
+    conn.close()
+    anomalies = []
+    for date, category, amount, description, mean, mean_sq in rows:
+        stddev = math.sqrt(max(0.0, mean_sq - mean * mean))
+        if stddev > 0 and amount > mean + ANOMALY_STDDEVS * stddev:
+            anomalies.append(Anomaly(date, category, amount, description, mean))
+    return anomalies
+
+def compute_facts(user_id: int) -> FinancialFacts:
+    return FinancialFacts(
+        categories=category_totals(user_id),
+        monthly=monthly_changes(user_id),
+        budgets=budget_burn_rates(user_id),
+        goals=goal_projections(user_id),
+        anomalies=spending_anomalies(user_id),
+        currency=get_home_currency(user_id),
+    )
+
+def _percent(value: float) -> str:
+    return f"{value * 100:+.0f}%"
+
+def _current_month_lines(facts: FinancialFacts) -> List[str]:
+    if not facts.monthly:
+        return []
+    latest = facts.monthly[0].month
+    lines = []
+    for change in (change for change in facts.monthly if change.month == latest):
+        delta = f" ({_percent(change.change)} vs previous month)" if change.change is not None else " (new this month)"
+        lines.append(f"- {change.category}: {format_money(change.total, facts.currency)}{delta}")
+    return lines
+
+def format_facts(facts: FinancialFacts) -> str:
+    """Describe the computed facts for the model; every number in it is already final."""
+    currency = facts.currency
+    sections = [f"Total spending recorded: {format_money(facts.total_spent, currency)}"]
+
+    if facts.categories:
+        sections.append("Spending by category (all time):\n" + "\n".join(
+            f"- {c.category}: {format_money(c.total, currency)} over {c.count} expense{'s' if c.count != 1 else ''} "
+            f"({c.share * 100:.0f}% of total)"
+            for c in facts.categories
+        ))
+
+    month_lines = _current_month_lines(facts)
+    if month_lines:
+        sections.append(f"Spending in {facts.monthly[0].month} so far:\n" + "\n".join(month_lines))
+
+    if facts.budgets:
+        sections.append("Active budgets:\n" + "\n".join(
+            f"- {b.category}: {format_money(b.spent, currency)} of {format_money(b.amount, currency)} spent "
+            f"({b.used * 100:.0f}%), day {b.days_elapsed} of {b.days_total}, {format_money(b.daily_burn, currency)}/day, "
+            f"projected {format_money(b.projected, currency)} at period end "
+            f"({'on track' if b.on_track else 'over budget at this pace'})"
+            for b in facts.budgets
+        ))
+    else:
+        sections.append("No active budgets.")
+
+    if facts.goals:
+        sections.append("Active goals:\n" + "\n".join(describe_goal(g, currency) for g in facts.goals))
+    else:
+        sections.append("No active goals.")
+
+    if facts.anomalies:
+        sections.append("Unusually large recent expenses:\n" + "\n".join(
+            f"- {a.date.split(' ')[0]}: {format_money(a.amount, currency)} on {a.category}"
+            f"{f' ({a.description})' if a.description else ''}, usually {format_money(a.category_average, currency)}"
+            for a in facts.anomalies
+        ))
+
+    return "\n\n".join(sections)
+
+def describe_goal(goal: GoalProjection, currency: str = DEFAULT_CURRENCY) -> str:
+    """One "- name: progress, projection" line for a goal."""
+    line = f"- {goal.name}: {format_money(goal.current, currency)} of {format_money(goal.target, currency)}"
+    if goal.eta_days == 0:
+        return line + ", reached"
+    if goal.eta_days is None:
+        line += ", nothing saved recently so no projection" if goal.current else ", nothing saved yet so no projection"
+    else:
+        line += f", {format_money(goal.daily_rate, currency)}/day saved, reached in about {goal.eta_days} days at this pace"
+    if goal.trend is not None:
+        line += f" ({_percent(goal.trend)} pace vs the {GOAL_VELOCITY_DAYS} days before)"
+    if goal.deadline:
+        line += f", deadline {goal.deadline}"
+        if goal.on_track is not None:
+            line += " (on track)" if goal.on_track else " (behind schedule)"
+    return line
+
+def render_report(facts: FinancialFacts) -> str:
+    """A plain Markdown report built from the facts alone, used when the AI report isn't available."""
+    currency = facts.currency
+    lines = ["📊 *Your Financial Report*", "", f"Total spending recorded: {format_money(facts.total_spent, currency)}"]
+
+    if facts.categories:
+        lines += ["", "*Top categories*"]
+        lines += [f"• {c.category}: {format_money(c.total, currency)} ({c.share * 100:.0f}%)" for c in facts.categories[:5]]
+
+    month_lines = _current_month_lines(facts)
+    if month_lines:
+        lines += ["", f"*This month ({facts.monthly[0].month})*"]
+        lines += ["• " + line[2:] for line in month_lines]
+
+    if facts.budgets:
+        lines += ["", "*Budgets*"]
+        for b in facts.budgets:
+            status = "✅" if b.on_track else "⚠️"
+            lines.append(f"{status} {b.category}: {format_money(b.spent, currency)}/{format_money(b.amount, currency)} "
+                         f"({b.used * 100:.0f}%), projected {format_money(b.projected, currency)}")
+
+    if facts.goals:
+        lines += ["", "*Goals*"]
+        lines += ["• " + describe_goal(g, currency)[2:] for g in facts.goals]
+
+    if facts.anomalies:
+        lines += ["", "*Unusual expenses*"]
+        lines += [f"• {a.date.split(' ')[0]}: {format_money(a.amount, currency)} on {a.category} "
+                  f"(usually {format_money(a.category_average, currency)})" for a in facts.anomalies]
+
+    return "\n".join(lines)
@@ -1,23 +1,48 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from database import add_budget, get_user_budgets, update_budget, delete_budget, get_user_categories
+from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters
+from database import add_budget, get_user_budgets, update_budget, delete_budget, get_user_categories, get_budget_history, get_budget_page, get_home_currency
+from currency import format_money, parse_minor
 from objects import ConversationState
-from datetime import datetime, timedelta
+from budgetperiods import PERIODS, window_at
+from callbacks import callback_router, encode
+from keyboards import PaginatedKeyboard
+from datetime import datetime
 
 # States for the budget conversation
 BUDGET_CATEGORY, BUDGET_AMOUNT, BUDGET_PERIOD = range(3)
 
+# Callback actions of the budget buttons, see callbacks.py
+BUDGET_NEW = "bn"
+BUDGET_PICK_UPDATE, BUDGET_PICK_DELETE, BUDGET_PICK_HISTORY = "bpu", "bpd", "bph" # ask which budget
+BUDGET_UPDATE, BUDGET_DELETE, BUDGET_HISTORY = "bu", "bd", "bh" # with the budget id
+BUDGET_PAGE = "bpg"
+BUDGET_PERIOD_PICKED = "bpp" # with the index in PERIODS
+
+# the menu buttons that ask the user to pick a budget: (action of the budget buttons, prompt, reply without budgets)
+PICK_BUDGET = {
+    BUDGET_PICK_UPDATE: (BUDGET_UPDATE, "Select a budget to update:", "You don't have any budgets to update."),
+    BUDGET_PICK_DELETE: (BUDGET_DELETE, "Select a budget to delete:", "You don't have any budgets to delete."),
+    BUDGET_PICK_HISTORY: (BUDGET_HISTORY, "Select a budget to see its history:", "You don't have any budgets yet."),
+}
+
+budget_keyboard = PaginatedKeyboard(
+    BUDGET_PAGE, (BUDGET_UPDATE, BUDGET_DELETE, BUDGET_HISTORY), get_budget_page,
+    lambda budget: f"{budget[1]} ({format_money(budget[2], budget[4])} - {budget[3]})"
+)
+
 async def budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the budget tracking conversation."""
     # Get user's budgets
-    budgets = get_user_budgets(update.effective_user.id)
+    user_id = update.effective_user.id
+    budgets = get_user_budgets(user_id)
     
     if budgets:
         # Show existing budgets
+        currency = get_home_currency(user_id)
         text = "💰 Your current budgets:\n\n"
         for budget_id, category, amount, period, start_date, end_date in budgets:
             text += f"• {category}\n"
-            text += f"  Amount: ${amount:.2f}\n"
+            text += f"  Amount: {format_money(amount, currency)}\n"
             text += f"  Period: {period}\n"
             if start_date and end_date:
                 text += f"  Valid: {start_date} to {end_date}\n"
@@ -25,9 +50,10 @@ async def budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         
         # Add buttons for actions
         keyboard = [
-            [InlineKeyboardButton("➕ New Budget", callback_data="new_budget")],
-            [InlineKeyboardButton("📊 Update Budget", callback_data="update_budget")],
-            [InlineKeyboardButton("❌ Delete Budget", callback_data="delete_budget")]
+            [InlineKeyboardButton("➕ New Budget", callback_data=encode(user_id, BUDGET_NEW))],
+            [InlineKeyboardButton("📊 Update Budget", callback_data=encode(user_id, BUDGET_PICK_UPDATE))],
+            [InlineKeyboardButton("❌ Delete Budget", callback_data=encode(user_id, BUDGET_PICK_DELETE))],
+            [InlineKeyboardButton("📈 Budget History", callback_data=encode(user_id, BUDGET_PICK_HISTORY))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -42,114 +68,110 @@ async def budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return ConversationHandler.END
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle button callbacks for budget actions."""
+async def new_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Start creating a budget from the menu."""
     query = update.callback_query
     await query.answer()
-    
-    if query.data == "new_budget":
-        await query.edit_message_text(
-            "💰 Let's set up a new budget!\n\n"
-            "What category would you like to budget for? (e.g., Food, Transportation, Entertainment)"
-        )
-        return BUDGET_CATEGORY
-    
-    elif query.data == "update_budget":
-        budgets = get_user_budgets(update.effective_user.id)
-        if not budgets:
-            await query.edit_message_text("You don't have any budgets to update.")
-            return ConversationHandler.END
-        
-        keyboard = []
-        for budget_id, category, amount, period, _, _ in budgets:
-            keyboard.append([InlineKeyboardButton(
-                f"{category} (${amount:.2f} - {period})",
-                callback_data=f"update_{budget_id}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "Select a budget to update:",
-            reply_markup=reply_markup
-        )
-        return BUDGET_CATEGORY
-    
-    elif query.data == "delete_budget":
-        budgets = get_user_budgets(update.effective_user.id)
-        if not budgets:
-            await query.edit_message_text("You don't have any budgets to delete.")
+    await query.edit_message_text(
+        "💰 Let's set up a new budget!\n\n"
+        "What category would you like to budget for? (e.g., Food, Transportation, Entertainment)"
+    )
+    return BUDGET_CATEGORY
+
+def _pick_budget(menu_action: str):
+    async def pick_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Show the first page of budgets for the menu button that was pressed."""
+        query = update.callback_query
+        await query.answer()
+        action, prompt, empty = PICK_BUDGET[menu_action]
+        reply_markup = budget_keyboard.render(update.effective_user.id, action)
+        if reply_markup is None:
+            await query.edit_message_text(empty)
             return ConversationHandler.END
         
-        keyboard = []
-        for budget_id, category, amount, period, _, _ in budgets:
-            keyboard.append([InlineKeyboardButton(
-                f"{category} (${amount:.2f} - {period})",
-                callback_data=f"delete_{budget_id}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "Select a budget to delete:",
-            reply_markup=reply_markup
-        )
+        await query.edit_message_text(prompt, reply_markup=reply_markup)
         return BUDGET_CATEGORY
+    return pick_budget
+
+async def budget_page(update: Update, context: ContextTypes.DEFAULT_TYPE, action_index: int, direction: int, cursor: int) -> int:
+    """Show another page of budgets."""
+    if not await budget_keyboard.turn_page(update, action_index, direction, cursor):
+        return ConversationHandler.END
+    return BUDGET_CATEGORY
+
+async def budget_history(update: Update, context: ContextTypes.DEFAULT_TYPE, budget_id: int) -> int:
+    """Show how much was spent in a budget's current and past periods."""
+    query = update.callback_query
+    await query.answer()
+    history = get_budget_history(update.effective_user.id, budget_id)
+    if not history:
+        await query.edit_message_text("That budget doesn't exist anymore.")
+        return ConversationHandler.END
     
-    elif query.data.startswith("update_"):
-        budget_id = int(query.data.split("_")[1])
-        context.user_data['update_budget_id'] = budget_id
-        await query.edit_message_text(
-            "Enter the new budget amount:"
+    currency = get_home_currency(update.effective_user.id)
+    text = "📈 Budget history (newest first):\n\n"
+    for start_date, end_date, amount, spent in history:
+        status = "✅" if spent <= amount else "⚠️"
+        text += (
+            f"{status} {start_date} to {end_date}: {format_money(spent, currency)} of {format_money(amount, currency)} "
+            f"({spent / amount * 100:.0f}%)\n"
         )
-        return BUDGET_AMOUNT
-    
-    elif query.data.startswith("delete_"):
-        budget_id = int(query.data.split("_")[1])
-        delete_budget(budget_id)
+    await query.edit_message_text(text)
+    return ConversationHandler.END
+
+async def pick_budget_to_update(update: Update, context: ContextTypes.DEFAULT_TYPE, budget_id: int) -> int:
+    """Ask for the new amount of the picked budget."""
+    query = update.callback_query
+    await query.answer()
+    context.user_data['update_budget_id'] = budget_id
+    await query.edit_message_text(
+        "Enter the new budget amount:"
+    )
+    return BUDGET_AMOUNT
+
+async def delete_picked_budget(update: Update, context: ContextTypes.DEFAULT_TYPE, budget_id: int) -> int:
+    """Delete the picked budget."""
+    query = update.callback_query
+    await query.answer()
+    if delete_budget(update.effective_user.id, budget_id):
         await query.edit_message_text("🗑️ Budget deleted successfully!")
-        return ConversationHandler.END
-    
+    else:
+        await query.edit_message_text("❌ That budget doesn't exist anymore.")
     return ConversationHandler.END
 
 async def budget_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the budget category."""
-    if update.callback_query:
-        # Handle budget update amount
-        try:
-            amount = float(update.callback_query.message.text)
-            budget_id = context.user_data.get('update_budget_id')
-            if budget_id:
-                update_budget(budget_id, amount)
-                await update.callback_query.edit_message_text(
-                    f"✅ Budget updated to ${amount:.2f}!"
-                )
-                return ConversationHandler.END
-        except ValueError:
-            await update.callback_query.edit_message_text(
-                "❌ Please enter a valid number."
-            )
-            return BUDGET_AMOUNT
-    else:
-        context.user_data['budget_category'] = update.message.text
-        await update.message.reply_text(
-            "💰 What's your budget amount? (e.g., 500.00):"
-        )
-        return BUDGET_AMOUNT
+    context.user_data['budget_category'] = update.message.text
+    await update.message.reply_text(
+        "💰 What's your budget amount? (e.g., 500.00):"
+    )
+    return BUDGET_AMOUNT
 
 async def budget_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the budget amount."""
     try:
-        amount = float(update.message.text)
+        # budgets are kept in minor units of the home currency
+        currency = get_home_currency(update.effective_user.id)
+        amount = parse_minor(update.message.text, currency)
         if amount <= 0:
             await update.message.reply_text("❌ Please enter a positive amount.")
             return BUDGET_AMOUNT
         
+        # an amount entered after picking a budget to update replaces that budget's amount
+        budget_id = context.user_data.pop('update_budget_id', None)
+        if budget_id is not None:
+            if update_budget(update.effective_user.id, budget_id, amount):
+                await update.message.reply_text(f"✅ Budget updated to {format_money(amount, currency)}!")
+            else:
+                await update.message.reply_text("❌ That budget doesn't exist anymore.")
+            return ConversationHandler.END
+        
         context.user_data['budget_amount'] = amount
         
+        user_id = update.effective_user.id
         keyboard = [
-            [InlineKeyboardButton("Daily", callback_data="period_daily")],
-            [InlineKeyboardButton("Weekly", callback_data="period_weekly")],
-            [InlineKeyboardButton("Monthly", callback_data="period_monthly")],
-            [InlineKeyboardButton("Yearly", callback_data="period_yearly")]
+            [InlineKeyboardButton(period.capitalize(), callback_data=encode(user_id, BUDGET_PERIOD_PICKED, index))]
+            for index, period in enumerate(PERIODS)
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -159,37 +181,27 @@ async def budget_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         )
         return BUDGET_PERIOD
     except ValueError:
-        await update.message.reply_text("❌ Please enter a valid number.")
+        await update.message.reply_text("❌ Please enter a valid number, like 1000 or 25.50 (without thousands separators).")
         return BUDGET_AMOUNT
 
-async def budget_period(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def budget_period(update: Update, context: ContextTypes.DEFAULT_TYPE, period_index: int) -> int:
     """Handle the budget period and save the budget."""
     query = update.callback_query
     await query.answer()
     
-    period = query.data.split("_")[1]
+    if period_index >= len(PERIODS) or 'budget_amount' not in context.user_data:
+        await query.edit_message_text("❌ This budget wasn't started here, use /budget to create one.")
+        return ConversationHandler.END
+    period = PERIODS[period_index]
     
     # Store data before clearing
     budget_category = context.user_data['budget_category']
     budget_amount = context.user_data['budget_amount']
     
-    # Calculate start and end dates based on period
-    start_date = datetime.now().strftime("%Y-%m-%d")
-    end_date = None
-    
-    if period == "daily":
-        end_date = start_date
-    elif period == "weekly":
-        end_date = (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d")
-    elif period == "monthly":
-        # Add one month
-        current = datetime.now()
-        if current.month == 12:
-            end_date = datetime(current.year + 1, 1, current.day).strftime("%Y-%m-%d")
-        else:
-            end_date = datetime(current.year, current.month + 1, current.day).strftime("%Y-%m-%d")
-    elif period == "yearly":
-        end_date = (datetime.now() + timedelta(days=365)).strftime("%Y-%m-%d")
+    # Budgets repeat every period from today, the current window is computed when it is needed instead of
+    # storing an end date that would have to be recreated each period
+    today = datetime.utcnow().date()
+    window = window_at(period, today, today)
     
     # Add budget to database
     add_budget(
@@ -197,8 +209,8 @@ async def budget_period(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         category=budget_category,
         amount=budget_amount,
         period=period,
-        start_date=start_date,
-        end_date=end_date
+        start_date=today.isoformat(),
+        recurring=True
     )
     
     # Clear user data
@@ -207,9 +219,9 @@ async def budget_period(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     await query.edit_message_text(
         "✅ Budget created successfully!\n\n"
         f"Category: {budget_category}\n"
-        f"Amount: ${budget_amount:.2f}\n"
-        f"Period: {period.capitalize()}\n"
-        f"Valid until: {end_date}"
+        f"Amount: {format_money(budget_amount, get_home_currency(update.effective_user.id))}\n"
+        f"Period: {period.capitalize()}, repeats automatically\n"
+        f"Current period: {window.start} to {window.end}"
     )
     return ConversationHandler.END
 
@@ -219,22 +231,38 @@ async def cancel_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     await update.message.reply_text("❌ Budget creation cancelled.")
     return ConversationHandler.END
 
+callback_router.register(BUDGET_NEW, new_budget)
+for menu_action in PICK_BUDGET:
+    callback_router.register(menu_action, _pick_budget(menu_action))
+callback_router.register(BUDGET_PAGE, budget_page)
+callback_router.register(BUDGET_UPDATE, pick_budget_to_update)
+callback_router.register(BUDGET_DELETE, delete_picked_budget)
+callback_router.register(BUDGET_HISTORY, budget_history)
+callback_router.register(BUDGET_PERIOD_PICKED, budget_period)
+
 def get_budget_conversation_handler() -> ConversationHandler:
     """Get the budget conversation handler."""
+    menu_buttons = callback_router.handler(
+        BUDGET_NEW, *PICK_BUDGET, BUDGET_PAGE, BUDGET_UPDATE, BUDGET_DELETE, BUDGET_HISTORY
+    )
     return ConversationHandler(
-        entry_points=[CommandHandler("budget", budget)],
+        entry_points=[
+            CommandHandler("budget", budget),
+            # the menu /budget shows for existing budgets ends the conversation, so its buttons have to start it again
+            menu_buttons
+        ],
         states={
             BUDGET_CATEGORY: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, budget_category),
-                CallbackQueryHandler(button_callback)
+                menu_buttons
             ],
             BUDGET_AMOUNT: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, budget_amount),
-                CallbackQueryHandler(button_callback)
+                menu_buttons
             ],
             BUDGET_PERIOD: [
-                CallbackQueryHandler(budget_period)
+                callback_router.handler(BUDGET_PERIOD_PICKED)
             ]
         },
         fallbacks=[CommandHandler("cancel", cancel_budget)]
-    ) 
\ No newline at end of file
+    )
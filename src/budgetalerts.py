@@ -0,0 +1,52 @@
+import asyncio
+import logging
+
+from telegram.ext import Application
+
+from currency import format_money
+from database import BudgetAlert, add_budget_alert_listener
+from sender import message_scheduler, Priority
+
+logger = logging.getLogger(__name__)
+
+# Budget threshold alerts (50%, 80% and 100% of a budget, see BUDGET_ALERT_THRESHOLDS in database.py). database.py
+# works them out while it records an expense and tells us once the expense is committed; sending happens on the
+# event loop through the message scheduler, so the handler that added the expense answers the user first.
+# Alerts go to the user's private chat, whose id is the user id.
+
+_bot = None
+
+def format_budget_alert(alert: BudgetAlert) -> str:
+    """The alert message for a budget that crossed a threshold."""
+    if alert.threshold >= 1:
+        headline = f"🚨 You've gone over your {alert.category} budget!"
+    else:
+        headline = f"⚠️ You've used {alert.threshold:.0%} of your {alert.category} budget."
+    return (
+        f"{headline}\n\n"
+        f"Spent: {format_money(alert.spent, alert.currency)} of {format_money(alert.amount, alert.currency)}\n"
+        f"Remaining: {format_money(max(alert.amount - alert.spent, 0), alert.currency)} until {alert.end_date}"
+    )
+
+async def _send_alert(user_id: int, alert: BudgetAlert) -> None:
+    try:
+        await message_scheduler.send_message(_bot, Priority.NOTIFICATION, chat_id=user_id, text=format_budget_alert(alert))
+    except Exception as e:
+        logger.warning(f"Sending budget alert to user {user_id} failed: {e}")
+
+def _queue_alert(user_id: int, alert: BudgetAlert) -> None:
+    if _bot is None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # expenses written by scripts and tools outside the bot aren't announced
+        return
+    loop.create_task(_send_alert(user_id, alert))
+
+def setup_budget_alerts(application: Application) -> None:
+    """Send budget alerts through this application's bot."""
+    global _bot
+    _bot = application.bot
+
+add_budget_alert_listener(_queue_alert)
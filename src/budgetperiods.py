@@ -0,0 +1,66 @@
+import calendar
+from datetime import date, timedelta
+from typing import List, NamedTuple
+
+# Calendar maths for recurring budgets. A recurring budget only stores its period and an anchor date (the day it
+# was created); the window a given day falls in is computed from those two, so no row is written per period.
+# Months are stepped from the anchor's day of month and clamped to the month's length: a budget anchored on
+# Jan 31 runs Jan 31 - Feb 27, Feb 28 - Mar 30, Mar 31 - Apr 29, ... (Feb 29 in leap years).
+
+PERIODS = ("daily", "weekly", "monthly", "yearly")
+
+class Window(NamedTuple):
+    start: date
+    end: date # inclusive, the last day of the window
+
+    @property
+    def days(self) -> int:
+        return (self.end - self.start).days + 1
+
+def add_months(anchor: date, months: int) -> date:
+    """The anchor moved by a number of months, keeping its day of month where the target month is long enough."""
+    month_index = anchor.year * 12 + anchor.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return date(year, month, min(anchor.day, calendar.monthrange(year, month)[1]))
+
+def _step(period: str, anchor: date, n: int) -> date:
+    """Start of the n-th window after the one beginning at the anchor (n can be negative)."""
+    if period == "daily":
+        return anchor + timedelta(days=n)
+    if period == "weekly":
+        return anchor + timedelta(weeks=n)
+    if period == "monthly":
+        return add_months(anchor, n)
+    if period == "yearly":
+        return add_months(anchor, 12 * n)
+    raise ValueError(f"Unknown budget period: {period}")
+
+def _index_of(period: str, anchor: date, day: date) -> int:
+    """Which window (0 is the anchor's) a day falls in."""
+    if period == "daily":
+        return (day - anchor).days
+    if period == "weekly":
+        return (day - anchor).days // 7
+    months = (day.year - anchor.year) * 12 + day.month - anchor.month
+    if period == "yearly":
+        n = months // 12
+    else:
+        n = months
+    # the estimate can be one too high when the day is before the (clamped) anchor day in its month
+    if _step(period, anchor, n) > day:
+        n -= 1
+    return n
+
+def window_at(period: str, anchor: date, day: date) -> Window:
+    """The window of a recurring budget that contains the given day."""
+    n = _index_of(period, anchor, day)
+    return Window(_step(period, anchor, n), _step(period, anchor, n + 1) - timedelta(days=1))
+
+def past_windows(period: str, anchor: date, day: date, count: int) -> List[Window]:
+    """The window containing the day and up to count - 1 before it, newest first, never before the anchor."""
+    n = _index_of(period, anchor, day)
+    return [
+        Window(_step(period, anchor, i), _step(period, anchor, i + 1) - timedelta(days=1))
+        for i in range(n, max(n - count, -1), -1)
+    ]
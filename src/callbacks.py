@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, ContextTypes
+
+from metrics import CALLBACK_QUERIES, time_callback
+
+logger = logging.getLogger(__name__)
+
+# callback_data of every inline button the bot sends is "<action>:<ids>:<signature>", e.g. "bd:2s:Rk3u0vXa":
+#   - action is a short code that a feature module registered a route for on callback_router
+#   - ids are non-negative integers in base 36 joined with ".", buttons never carry free text (a category is sent
+#     as its index in a list, not its name), which keeps them well below Telegram's 64 byte limit
+#   - signature is a truncated HMAC over the user id, action and ids: a button only works for the user it was sent
+#     to, and editing an id in it makes it invalid
+# The router matches a callback query by looking its action up in a dict, no regex runs per update.
+
+# set CALLBACK_SECRET (or at least TELEGRAM_BOT_TOKEN) so buttons keep working across restarts
+_SECRET = os.getenv("CALLBACK_SECRET") or os.getenv("TELEGRAM_BOT_TOKEN") or secrets.token_hex(32)
+_KEY = hashlib.sha256(b"penny-callback-data:" + _SECRET.encode()).digest()
+SIGNATURE_BYTES = 6 # 8 characters of base64
+MAX_CALLBACK_DATA = 64 # bytes, Telegram's limit
+ACTION_PATTERN = re.compile(r"^[a-z][a-z0-9]{0,5}$")
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+class CallbackData(NamedTuple):
+    action: str
+    ids: Tuple[int, ...]
+
+def _base36(number: int) -> str:
+    if number < 0:
+        raise ValueError("Callback ids can't be negative")
+    digits = ""
+    while True:
+        number, digit = divmod(number, 36)
+        digits = DIGITS[digit] + digits
+        if not number:
+            return digits
+
+def _sign(user_id: int, payload: str) -> str:
+    digest = hmac.new(_KEY, f"{user_id}:{payload}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:SIGNATURE_BYTES]).decode()
+
+def encode(user_id: int, action: str, *ids: int) -> str:
+    """callback_data for a button that only the given user can press."""
+    payload = f"{action}:{'.'.join(_base36(i) for i in ids)}"
+    data = f"{payload}:{_sign(user_id, payload)}"
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"Callback data for {action} is longer than {MAX_CALLBACK_DATA} bytes")
+    return data
+
+def decode(user_id: int, data: str) -> Optional[CallbackData]:
+    """Unpack callback_data made by encode, None if it is malformed or wasn't signed for this user."""
+    payload, _, signature = data.rpartition(":")
+    if not payload or not hmac.compare_digest(signature, _sign(user_id, payload)):
+        return None
+    action, _, ids = payload.partition(":")
+    try:
+        return CallbackData(action, tuple(int(i, 36) for i in ids.split(".")) if ids else ())
+    except ValueError:
+        return None
+
+class CallbackRouter:
+    def __init__(self):
+        self._routes: Dict[str, Callable] = {}
+
+    def register(self, action: str, callback: Callable) -> None:
+        """Route buttons with this action to callback(update, context, *ids)."""
+        if not ACTION_PATTERN.match(action):
+            raise ValueError(f"Callback actions are 1-6 lowercase letters or digits: {action}")
+        if action in self._routes:
+            raise ValueError(f"Callback action {action} is already registered")
+        # timed under the route's own name, every button would be "dispatch" otherwise
+        self._routes[action] = time_callback(callback, callback.__name__)
+
+    def handler(self, *actions: str) -> CallbackQueryHandler:
+        """A handler for buttons with the given actions, e.g. for one state of a ConversationHandler."""
+        wanted = frozenset(actions)
+        return CallbackQueryHandler(
+            self.dispatch,
+            pattern=lambda data: isinstance(data, str) and data.partition(":")[0] in wanted
+        )
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Verify the button and call its route, returns whatever the route returns (a conversation state)."""
+        query = update.callback_query
+        data = decode(update.effective_user.id, query.data)
+        route = self._routes.get(data.action) if data else None
+        if route is None:
+            # the action of a rejected button is attacker controlled, so it isn't used as a label
+            CALLBACK_QUERIES.labels("", "rejected").inc()
+            logger.warning(f"Rejected callback data from user {update.effective_user.id}")
+            await query.answer("This button isn't valid anymore.")
+            return None
+        CALLBACK_QUERIES.labels(data.action, "ok").inc()
+        return await route(update, context, *data.ids)
+
+    dispatch.__penny_timed__ = True # so metrics.time_handlers leaves it to the routes
+
+# the router is a singleton, feature modules register their actions on it at import time
+callback_router = CallbackRouter()
@@ -11,6 +11,9 @@ from telegram.ext import ContextTypes
 
 import logging
 
+from database import deactivate_group, get_home_currency, save_group
+from groups import group_members
+
 logger = logging.getLogger(__name__)
 
 def extract_status_change(chat_member_update: ChatMemberUpdated) -> Optional[tuple[bool, bool]]:
@@ -63,12 +66,31 @@ async def track_chats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             logger.info("%s blocked the bot", cause_name)
     elif chat.type in [Chat.GROUP, Chat.SUPERGROUP]:
         if not was_member and is_member:
-            admins = await context.bot.get_chat_administrators(chat_id)
             logger.info("%s added the bot to the group %s - ID: %s", cause_name, chat.title, chat.id)
+            # the group's ledger is kept in the currency of whoever added the bot, see groups.py
+            save_group(chat_id, chat.title, get_home_currency(update.effective_user.id))
+            group_members.joined(chat_id, update.effective_user)
         elif was_member and not is_member:
             logger.info("%s removed the bot from the group %s", cause_name, chat.title)
+            deactivate_group(chat_id)
+            group_members.forget(chat_id)
     elif not was_member and is_member:
-        admins = await context.bot.get_chat_administrators(chat_id)
         logger.info("%s added the bot to the channel %s", cause_name, chat.title)
     elif was_member and not is_member:
         logger.info("%s removed the bot from the channel %s", cause_name, chat.title)
+
+async def track_members(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Tracks who joins and leaves the groups the bot is in, Telegram only sends these to administrator bots."""
+    chat = update.effective_chat
+    if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
+        return
+    result = extract_status_change(update.chat_member)
+    if result is None:
+        return
+    was_member, is_member = result
+
+    member = update.chat_member.new_chat_member.user
+    if not was_member and is_member:
+        group_members.joined(chat.id, member)
+    elif was_member and not is_member:
+        group_members.left(chat.id, member)
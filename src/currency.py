@@ -0,0 +1,133 @@
+import re
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import NamedTuple, Optional, Tuple, Union
+
+# Currencies expenses can be recorded in. Every user has a home currency (USD unless they pick another with
+# /currency); budgets and goals are kept in it and totals are converted into it with the rates in the fx_rates
+# table, see database.py. An expense keeps the currency it was paid in.
+#
+# Money is stored and passed around as an integer number of the currency's minor unit (cents, yen, satoshis), so
+# sums and budget comparisons are exact and SQLite adds them up as integers. What users type is read as a Decimal
+# and turned into minor units with to_minor, format_money turns them back into text. Floats only appear in derived
+# figures like averages and paces.
+
+DEFAULT_CURRENCY = "USD"
+MAX_MINOR = 2 ** 63 - 1 # the largest integer SQLite stores
+
+class Currency(NamedTuple):
+    symbol: str
+    decimals: int # digits of the minor unit amounts are kept in, 2 for cents, 8 for satoshis
+    prefix: bool = True # "$12.50" rather than "12.50 CHF"
+
+CURRENCIES = {
+    "USD": Currency("$", 2),
+    "EUR": Currency("€", 2),
+    "GBP": Currency("£", 2),
+    "JPY": Currency("¥", 0),
+    "CHF": Currency("CHF", 2, prefix=False),
+    "CAD": Currency("CA$", 2),
+    "AUD": Currency("A$", 2),
+    "INR": Currency("₹", 2),
+    "BRL": Currency("R$", 2),
+    "MXN": Currency("MX$", 2),
+    "BTC": Currency("BTC", 8, prefix=False),
+    "ETH": Currency("ETH", 6, prefix=False),
+    "USDC": Currency("USDC", 2, prefix=False),
+}
+
+# what people type instead of the code
+ALIASES = {
+    "$": "USD", "dollar": "USD", "dollars": "USD", "bucks": "USD",
+    "€": "EUR", "euro": "EUR", "euros": "EUR",
+    "£": "GBP", "pound": "GBP", "pounds": "GBP",
+    "¥": "JPY", "yen": "JPY",
+    "₹": "INR", "rupees": "INR",
+    "₿": "BTC", "bitcoin": "BTC",
+    "ether": "ETH",
+}
+
+AMOUNT_WITH_CURRENCY = re.compile(
+    r"^\s*(?P<before>[^\d\s.,]+)?\s*(?P<amount>\d+(?:[.,]\d+)?)\s*(?P<after>[^\d\s.,]+)?\s*$"
+)
+
+def parse_currency(text: str) -> Optional[str]:
+    """The currency code for "eur", "€" or "euros", None if it isn't a currency we know."""
+    text = text.strip()
+    if text.upper() in CURRENCIES:
+        return text.upper()
+    return ALIASES.get(text.lower())
+
+def _details(currency: str) -> Currency:
+    return CURRENCIES.get(currency, Currency(currency, 2, prefix=False))
+
+def minor_per_unit(currency: str) -> int:
+    """How many minor units make one unit of a currency, 100 for cents."""
+    return 10 ** _details(currency).decimals
+
+def to_minor(amount: Union[Decimal, str, int, float], currency: str = DEFAULT_CURRENCY) -> int:
+    """An amount in whole units, e.g. Decimal("12.345") dollars, as minor units rounded half up, 1235 cents.
+
+    A float is read as it prints, so 0.1 is exactly 10 cents. Raises ValueError for anything that isn't a finite
+    amount SQLite can store. Text typed by users should go through parse_minor instead, which also rejects "1e3".
+    """
+    try:
+        value = Decimal(str(amount) if isinstance(amount, float) else amount)
+        if not value.is_finite():
+            raise ValueError(f"Not an amount: {amount}")
+        minor = int(value.scaleb(_details(currency).decimals).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        # e.g. "1e400", too many digits to quantize
+        raise ValueError(f"Not an amount: {amount}")
+    if abs(minor) > MAX_MINOR:
+        raise ValueError(f"Amount too large: {amount}")
+    return minor
+
+def from_minor(minor: int, currency: str = DEFAULT_CURRENCY) -> Decimal:
+    """Minor units back as an exact amount in whole units, 1235 cents is Decimal("12.35")."""
+    return Decimal(minor).scaleb(-_details(currency).decimals)
+
+def parse_amount(text: str, default_currency: str = DEFAULT_CURRENCY) -> Tuple[Decimal, Optional[str]]:
+    """Read "25.50", "€25.50" or "25,50 eur" as (amount, currency code or None for the default currency).
+
+    The amount is a Decimal exactly as typed, see to_minor. Raises ValueError if it isn't an amount, names a currency
+    we don't know, or has more decimals than its currency (the typed one, else default_currency) has minor digits:
+    "1,000" is a thousand to some and one to others, and "12.345" dollars would have to be rounded.
+    """
+    match = AMOUNT_WITH_CURRENCY.match(text)
+    if not match or (match.group("before") and match.group("after")):
+        raise ValueError(f"Not an amount: {text}")
+    currency = None
+    marker = match.group("before") or match.group("after")
+    if marker:
+        currency = parse_currency(marker)
+        if currency is None:
+            raise ValueError(f"Unknown currency: {marker}")
+    amount = match.group("amount").replace(",", ".")
+    if len(amount.partition(".")[2]) > _details(currency or default_currency).decimals:
+        raise ValueError(f"Too many decimals: {text}")
+    return Decimal(amount), currency
+
+def parse_minor(text: str, currency: str = DEFAULT_CURRENCY) -> int:
+    """Read an amount a user typed for something kept in the given currency, like a budget, as its minor units.
+
+    Accepts "25.50", "25,50" or "$25.50" when $ is the currency. Raises ValueError for anything else, including an
+    amount in another currency.
+    """
+    amount, typed_currency = parse_amount(text, currency)
+    if typed_currency is not None and typed_currency != currency:
+        raise ValueError(f"Not in {currency}: {text}")
+    return to_minor(amount, currency)
+
+def format_money(minor: Union[int, float], currency: str = DEFAULT_CURRENCY) -> str:
+    """An amount in minor units with its currency, e.g. $12.50, €3.00, ¥1200 or 0.00150000 BTC.
+
+    Derived figures such as averages may be fractional and are rounded to the nearest minor unit.
+    """
+    details = _details(currency)
+    if not isinstance(minor, int):
+        minor = int(Decimal(minor).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    sign = "-" if minor < 0 else ""
+    number = str(from_minor(abs(minor), currency).quantize(Decimal(1).scaleb(-details.decimals)))
+    if details.prefix:
+        return f"{sign}{details.symbol}{number}"
+    return f"{sign}{number} {details.symbol}"
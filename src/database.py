@@ -2,10 +2,92 @@
 
 import sqlite3
 import os
-from datetime import datetime
+import re
+import threading
+from datetime import datetime, date, timedelta
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
-# Database file path
-DB_PATH = "penny.db"
+from metrics import timed_query
+from budgetperiods import window_at, past_windows
+from currency import CURRENCIES, DEFAULT_CURRENCY, minor_per_unit
+
+# Database file path, can be overridden so tests and tools don't touch the real database
+DB_PATH = os.getenv("PENNY_DB_PATH", "penny.db")
+
+# tables are created lazily the first time a connection is requested instead of at import time
+_initialized = False
+_init_lock = threading.Lock() # the first connection may come from a worker thread, see usercontext.py
+# whether SQLite was built with FTS5, expense search falls back to LIKE without it
+_fts_available = True
+
+# called with the user id whenever a user's finance data changes, caches use this to drop their copy
+_write_listeners: List[Callable[[int], None]] = []
+
+def add_write_listener(listener: Callable[[int], None]):
+    """Register a callback that is told the user id of every write to a user's expenses, budgets or goals."""
+    _write_listeners.append(listener)
+
+# share of a budget at which the user is told how much they've spent, each fires at most once per budget window
+BUDGET_ALERT_THRESHOLDS = (0.5, 0.8, 1.0)
+
+class BudgetAlert(NamedTuple):
+    budget_id: int
+    category: str
+    amount: int # minor units of the home currency, like every amount below
+    spent: int
+    threshold: float # the highest threshold the new expense crossed
+    end_date: str # last day of the budget window
+    currency: str = DEFAULT_CURRENCY # the user's home currency, which budgets are in
+
+# Every amount is an INTEGER number of minor units (cents, satoshis, see currency.py) of its currency: expenses of
+# the currency they were paid in, budgets, budget totals and goals of the user's home currency.
+#
+# Amounts in different currencies are converted into the user's home currency inside the queries that add them up.
+# fx_rates holds the value of one unit of each currency in US dollars and how many minor units make that unit, so a
+# minor unit is worth usd_rate / unit dollars. A currency without a rate counts as a dollar in cents rather than
+# dropping out of a total. HOME_RATE is a CTE bound to the user id, HOME_AMOUNT an expense's amount (expenses aliased
+# e, joined with FX_JOIN) in minor units of the home currency. Expenses already in the home currency are taken as
+# they are, converted ones are rounded to a whole minor unit, so sums stay integer and exact.
+HOME_RATE = """home (currency, rate) AS (
+    SELECT h.currency, COALESCE((SELECT usd_rate / unit FROM fx_rates WHERE currency = h.currency), 0.01)
+    FROM (SELECT COALESCE((SELECT home_currency FROM users WHERE id = ?), 'USD') AS currency) h
+)"""
+FX_JOIN = "LEFT JOIN fx_rates fx ON fx.currency = e.currency"
+HOME_AMOUNT = """CASE WHEN e.currency = (SELECT currency FROM home) THEN e.amount
+    ELSE CAST(ROUND(e.amount * COALESCE(fx.usd_rate / fx.unit, 0.01) / (SELECT rate FROM home)) AS INTEGER) END"""
+
+# Money columns of the tables from before amounts were kept in minor units, and the currency each row's amounts are
+# in, see _migrate_money_columns
+MONEY_COLUMNS = {
+    "expenses": (("amount",), "expenses.currency"),
+    "budgets": (("amount",), "(SELECT home_currency FROM users WHERE users.id = budgets.user_id)"),
+    "goals": (("target_amount", "current_amount"), "(SELECT home_currency FROM users WHERE users.id = goals.user_id)"),
+    "goal_contributions": (
+        ("amount",), "(SELECT home_currency FROM users WHERE users.id = goal_contributions.user_id)"
+    ),
+    "budget_totals": (
+        ("spent",),
+        "(SELECT u.home_currency FROM budgets b JOIN users u ON u.id = b.user_id WHERE b.id = budget_totals.budget_id)"
+    ),
+}
+
+# Category columns of group tables that compare case-insensitively, see _migrate_nocase_columns
+NOCASE_COLUMNS = {"group_budgets": "category", "group_expenses": "category"}
+
+# called with the user id and a BudgetAlert after an expense pushed one of the user's budgets past a threshold
+_budget_alert_listeners: List[Callable[[int, BudgetAlert], None]] = []
+
+def add_budget_alert_listener(listener: Callable[[int, BudgetAlert], None]):
+    """Register a callback for budget threshold alerts, it runs after the expense was committed."""
+    _budget_alert_listeners.append(listener)
+
+def get_connection() -> sqlite3.Connection:
+    """Open a connection to the bot database, creating the schema on first use."""
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                init_db()
+    return sqlite3.connect(DB_PATH)
 
 def init_db():
     """Initialize the database with required tables."""
@@ -28,7 +110,7 @@ def init_db():
         CREATE TABLE IF NOT EXISTS expenses (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
-            amount REAL,
+            amount INTEGER,
             category TEXT,
             description TEXT,
             date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -43,7 +125,7 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
             category TEXT,
-            amount REAL,
+            amount INTEGER,
             period TEXT,
             start_date TEXT,
             end_date TEXT,
@@ -57,8 +139,8 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
             name TEXT NOT NULL,
-            target_amount REAL NOT NULL,
-            current_amount REAL DEFAULT 0,
+            target_amount INTEGER NOT NULL,
+            current_amount INTEGER DEFAULT 0,
             deadline TEXT,
             category TEXT,
             status TEXT DEFAULT 'active',
@@ -67,12 +149,437 @@ def init_db():
         )
     ''')
     
+    # Every amount put towards a goal, goals.current_amount is kept as their running total so listing goals doesn't
+    # have to sum the ledger.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS goal_contributions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            goal_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (goal_id) REFERENCES goals (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_goal_contributions_goal_date ON goal_contributions (goal_id, created_at)
+    ''')
+    
+    # Recurring budgets keep their anchor in start_date and no end_date, the current window is computed from the
+    # period (see budgetperiods.py). Older databases get the column added here.
+    _add_column_if_missing(cursor, "budgets", "recurring", "INTEGER NOT NULL DEFAULT 0")
+    
+    # Budget spend is summed per user, category and date range
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_user_category_date ON expenses (user_id, category, date)
+    ''')
+    
+    # Expense history is browsed newest first per user, paginated on (date, id)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_user_date ON expenses (user_id, date)
+    ''')
+    
+    # Full-text index over expense descriptions for /expenses search, kept in sync with the expenses table by triggers
+    global _fts_available
+    try:
+        _create_expense_search_index(cursor)
+    except sqlite3.OperationalError:
+        _fts_available = False
+    
+    # Budgets an expense counts towards are looked up by user and category on every new expense
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_budgets_user_category ON budgets (user_id, category)
+    ''')
+    
+    # Running spend per budget window, kept up to date by every new expense so threshold alerts don't have to
+    # re-sum the window. alerted_threshold is the highest threshold already announced for the window.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS budget_totals (
+            budget_id INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            spent INTEGER NOT NULL DEFAULT 0,
+            alerted_threshold REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (budget_id, start_date),
+            FOREIGN KEY (budget_id) REFERENCES budgets (id)
+        )
+    ''')
+    
+    # Per-user counter bumped by every write to the user's finance data, caches key on it to know when they're stale
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    # Last generated /report per user and the data version it was generated from
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_cache (
+            user_id INTEGER PRIMARY KEY,
+            data_version INTEGER NOT NULL,
+            report TEXT NOT NULL,
+            last_expense_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Users who get their report delivered weekly, weekday uses SQLite's %w numbering (0 is Sunday)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_subscriptions (
+            user_id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            last_sent_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    # reports are personal, subscriptions made in a group chat go to the user's private chat instead
+    cursor.execute("UPDATE report_subscriptions SET chat_id = user_id WHERE chat_id != user_id")
+    
+    # Expenses keep the currency they were paid in, budgets and goals are in the user's home currency. Everything
+    # recorded before currencies existed was in dollars.
+    _add_column_if_missing(cursor, "expenses", "currency", "TEXT NOT NULL DEFAULT 'USD'")
+    _add_column_if_missing(cursor, "users", "home_currency", "TEXT NOT NULL DEFAULT 'USD'")
+    
+    # Latest exchange rates as the value of one unit in US dollars, refreshed by the job in fxrates.py, with the
+    # number of minor units in that unit
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            currency TEXT PRIMARY KEY,
+            usd_rate REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    _add_column_if_missing(cursor, "fx_rates", "unit", "INTEGER NOT NULL DEFAULT 100")
+    cursor.execute("INSERT OR IGNORE INTO fx_rates (currency, usd_rate, unit) VALUES ('USD', 1.0, 100)")
+    cursor.executemany(
+        "UPDATE fx_rates SET unit = ? WHERE currency = ?",
+        [(minor_per_unit(currency), currency) for currency in CURRENCIES]
+    )
+    
+    # Amounts used to be REAL, databases from then have their tables rebuilt with integer minor units
+    _migrate_money_columns(cursor)
+    
+    # Opening contributions for goals from before the ledger, seeded once goals.current_amount is in minor units
+    cursor.execute('''
+        INSERT INTO goal_contributions (goal_id, user_id, amount, created_at)
+        SELECT id, user_id, current_amount, created_at FROM goals
+        WHERE current_amount != 0 AND NOT EXISTS (SELECT 1 FROM goal_contributions c WHERE c.goal_id = goals.id)
+    ''')
+    
+    # Group chats the bot is in and who is in them, mirrored from chat member updates (see groups.py) so group
+    # features never ask Telegram for the member list. A group's ledger is kept in the group's currency.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_chats (
+            chat_id INTEGER PRIMARY KEY,
+            title TEXT,
+            currency TEXT NOT NULL DEFAULT 'USD',
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_members (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT,
+            active INTEGER NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        )
+    ''')
+    
+    # Expenses one member paid for the group, split into shares that add up to the amount exactly
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            payer_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            category TEXT COLLATE NOCASE,
+            description TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_group_expenses_chat_category_date ON group_expenses (chat_id, category, date)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_expense_shares (
+            expense_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (expense_id, user_id),
+            FOREIGN KEY (expense_id) REFERENCES group_expenses (id)
+        )
+    ''')
+    
+    # Money members paid each other to settle up
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            from_user INTEGER NOT NULL,
+            to_user INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_group_payments_chat ON group_payments (chat_id)
+    ''')
+    
+    # Shared budgets, one per group and category (in any case), recurring from start_date like personal ones
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_budgets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            category TEXT NOT NULL COLLATE NOCASE,
+            amount INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            UNIQUE (chat_id, category)
+        )
+    ''')
+    # Group categories used to be case-sensitive, "Restaurant" expenses didn't count towards a "restaurant" budget
+    _migrate_nocase_columns(cursor)
+    
     conn.commit()
     conn.close()
 
+    global _initialized
+    _initialized = True
+
+def _create_expense_search_index(cursor: sqlite3.Cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'expenses_fts'")
+    exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+            description, category, content='expenses', content_rowid='id'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO expenses_fts (rowid, description, category) VALUES (new.id, new.description, new.category);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_delete AFTER DELETE ON expenses BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, description, category)
+            VALUES ('delete', old.id, old.description, old.category);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_update AFTER UPDATE OF description, category ON expenses BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, description, category)
+            VALUES ('delete', old.id, old.description, old.category);
+            INSERT INTO expenses_fts (rowid, description, category) VALUES (new.id, new.description, new.category);
+        END
+    ''')
+    if not exists:
+        # index the expenses recorded before the search index existed
+        cursor.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
+def _add_column_if_missing(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _migrate_money_columns(cursor: sqlite3.Cursor):
+    """Convert the REAL amounts of tables in MONEY_COLUMNS into INTEGER minor units of their currency.
+
+    SQLite can't change the type of a column, so each such table is rebuilt with INTEGER money columns. Row ids are
+    kept, so the expense search index and goal ids stay valid. All tables are converted in one savepoint.
+    """
+    units = " ".join(f"WHEN '{currency}' THEN {minor_per_unit(currency)}" for currency in CURRENCIES)
+    cursor.execute("SAVEPOINT money_columns")
+    for table, (money_columns, currency) in MONEY_COLUMNS.items():
+        types = {row[1]: row[2] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        if types.get(money_columns[0]) != "REAL":
+            continue
+        create = _table_sql(cursor, table)
+        for column in money_columns:
+            create = re.sub(rf"\b{column} REAL\b", f"{column} INTEGER", create)
+        values = [
+            f"CAST(ROUND({column} * CASE {currency} {units} ELSE 100 END) AS INTEGER)" if column in money_columns
+            else column
+            for column in types
+        ]
+        _rebuild_table(cursor, table, create, list(types), values)
+    cursor.execute("RELEASE money_columns")
+
+def _migrate_nocase_columns(cursor: sqlite3.Cursor):
+    """Rebuild the tables in NOCASE_COLUMNS whose column was created with the default, case-sensitive collation.
+
+    A column's collation can't be changed either. Rows are copied in id order, so when a unique constraint now
+    treats two of them as the same, the newest one is kept.
+    """
+    for table, column in NOCASE_COLUMNS.items():
+        create = _table_sql(cursor, table)
+        if re.search(rf"\b{column} TEXT\b[^,]*COLLATE NOCASE", create):
+            continue
+        create = re.sub(rf"\b{column} TEXT\b", f"{column} TEXT COLLATE NOCASE", create)
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        _rebuild_table(cursor, table, create, columns, columns, "INSERT OR REPLACE")
+
+def _table_sql(cursor: sqlite3.Cursor, table: str) -> str:
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cursor.fetchone()[0]
+
+def _rebuild_table(cursor: sqlite3.Cursor, table: str, create: str, columns: List[str], values: List[str],
+                   insert: str = "INSERT"):
+    """Replace a table with one created from the given CREATE TABLE statement, copying its rows.
+
+    The new table is filled with the expressions in values for the columns, then takes the table's name; its indexes
+    and triggers are created again from their stored SQL. Row ids are kept.
+    """
+    cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+        (table,)
+    )
+    dependents = [row[0] for row in cursor.fetchall()]
+    
+    cursor.execute(re.sub(rf"^CREATE TABLE \"?{table}\"?", f"CREATE TABLE {table}_rebuilt", create))
+    cursor.execute(
+        f"{insert} INTO {table}_rebuilt ({', '.join(columns)}) "
+        f"SELECT {', '.join(values)} FROM {table} ORDER BY rowid"
+    )
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_rebuilt RENAME TO {table}")
+    for sql in dependents:
+        cursor.execute(sql)
+
+def _bump_data_version(cursor: sqlite3.Cursor, user_id: int):
+    """Mark the user's finance data as changed, call this in the same transaction as the write."""
+    cursor.execute(
+        """
+        INSERT INTO data_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+        """,
+        (user_id,)
+    )
+    # writes happen on the event loop thread, so nothing can re-read the old data between this notification and the
+    # commit that follows it, as long as listeners that read in another thread start it from the loop
+    # (see usercontext.py)
+    for listener in _write_listeners:
+        listener(user_id)
+
+def _track_budget_spend(cursor: sqlite3.Cursor, user_id: int, category: str, amount: int,
+                        expense_date: Optional[str] = None, currency: Optional[str] = None) -> List[BudgetAlert]:
+    """Add a new expense to the running totals of the budgets it counts towards, call this before inserting it.
+
+    Returns an alert for every budget whose current window the expense pushed past a threshold it hadn't reached yet.
+    A window's total is summed from the expenses table once, the first time an expense lands in it, and only
+    incremented after that. Totals are in the home currency, the expense's amount (minor units of its currency) is
+    converted at today's rate.
+    """
+    home_currency = _home_currency(cursor, user_id)
+    if currency is not None and currency != home_currency:
+        amount = _to_home_currency(cursor, user_id, amount, currency)
+    today = datetime.utcnow().date()
+    day = date.fromisoformat(expense_date[:10]) if expense_date else today
+    cursor.execute(
+        """
+        SELECT id, amount, period, start_date, end_date, recurring
+        FROM budgets
+        WHERE user_id = ? AND category = ? AND (recurring = 1 OR end_date >= ?)
+        """,
+        (user_id, category, day.isoformat())
+    )
+    alerts = []
+    for budget_id, budget_amount, period, start_date, end_date, recurring in cursor.fetchall():
+        if recurring:
+            window = window_at(period, date.fromisoformat(start_date), day)
+            start_date, end_date = window.start.isoformat(), window.end.isoformat()
+        if not start_date <= day.isoformat() <= end_date:
+            continue
+        is_current = start_date <= today.isoformat() <= end_date
+
+        cursor.execute(
+            "SELECT spent, alerted_threshold FROM budget_totals WHERE budget_id = ? AND start_date = ?",
+            (budget_id, start_date)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            if not is_current:
+                continue # nobody is alerted about a window that is already over, so its total isn't kept
+            spent = _spend_in_windows(cursor, user_id, [(budget_id, category, start_date, end_date)])[budget_id]
+            alerted = 0
+        else:
+            spent, alerted = row
+        spent += amount
+
+        crossed = _reached_threshold(spent, budget_amount)
+        if is_current and budget_amount > 0 and crossed > alerted:
+            alerts.append(BudgetAlert(budget_id, category, budget_amount, spent, crossed, end_date, home_currency))
+            alerted = crossed
+        cursor.execute(
+            """
+            INSERT INTO budget_totals (budget_id, start_date, end_date, spent, alerted_threshold) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(budget_id, start_date) DO UPDATE SET
+                spent = excluded.spent, alerted_threshold = excluded.alerted_threshold
+            """,
+            (budget_id, start_date, end_date, spent, alerted)
+        )
+    return alerts
+
+def _home_currency(cursor: sqlite3.Cursor, user_id: int) -> str:
+    cursor.execute("SELECT home_currency FROM users WHERE id = ?", (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else DEFAULT_CURRENCY
+
+def _to_home_currency(cursor: sqlite3.Cursor, user_id: int, amount: int, currency: str) -> int:
+    cursor.execute(
+        f"""
+        WITH {HOME_RATE}
+        SELECT CAST(ROUND(? * COALESCE((SELECT usd_rate / unit FROM fx_rates WHERE currency = ?), 0.01)
+            / (SELECT rate FROM home)) AS INTEGER)
+        """,
+        (user_id, amount, currency)
+    )
+    return cursor.fetchone()[0]
+
+def _reached_threshold(spent: int, amount: int) -> float:
+    """The highest alert threshold a budget window's spend is at, 0 if none."""
+    # compared in whole percent, so the integer amounts compare exactly
+    return max((t for t in BUDGET_ALERT_THRESHOLDS if spent * 100 >= round(t * 100) * amount), default=0)
+
+def _refresh_budget_totals(cursor: sqlite3.Cursor, user_id: int):
+    """Re-sum the user's kept budget totals after expenses were removed.
+
+    A threshold the window dropped back under can be announced again, one it is still past isn't.
+    """
+    cursor.execute(
+        """
+        SELECT t.budget_id, b.category, b.amount, t.start_date, t.end_date, t.alerted_threshold
+        FROM budget_totals t JOIN budgets b ON b.id = t.budget_id
+        WHERE b.user_id = ? AND t.end_date >= date('now')
+        """,
+        (user_id,)
+    )
+    rows = cursor.fetchall()
+    spent = _spend_in_windows(cursor, user_id, [(i, row[1], row[3], row[4]) for i, row in enumerate(rows)])
+    updates = []
+    for i, (budget_id, _, amount, start_date, _, alerted) in enumerate(rows):
+        window_spent = spent.get(i, 0)
+        updates.append((window_spent, min(alerted, _reached_threshold(window_spent, amount)), budget_id, start_date))
+    cursor.executemany(
+        "UPDATE budget_totals SET spent = ?, alerted_threshold = ? WHERE budget_id = ? AND start_date = ?",
+        updates
+    )
+
+def _notify_budget_alerts(user_id: int, alerts: List[BudgetAlert]):
+    for alert in alerts:
+        for listener in _budget_alert_listeners:
+            listener(user_id, alert)
+
+@timed_query
 def add_user(user_id: int, username: str = None):
     """Add a new user to the database."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
@@ -83,30 +590,180 @@ def add_user(user_id: int, username: str = None):
     conn.commit()
     conn.close()
 
-def add_expense(user_id: int, amount: float, category: str, description: str = None, payment_method: str = None):
-    """Add a new expense to the database."""
-    conn = sqlite3.connect(DB_PATH)
+@timed_query
+def get_home_currency(user_id: int) -> str:
+    """Get the currency code a user's budgets, goals and totals are in."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    currency = _home_currency(cursor, user_id)
+    
+    conn.close()
+    return currency
+
+@timed_query
+def set_home_currency(user_id: int, currency: str):
+    """Change a user's home currency, converting their budgets and goals into it at today's rate."""
+    conn = get_connection()
     cursor = conn.cursor()
     
+    # value of an old minor unit in new ones, every amount kept in the home currency is multiplied by it
+    cursor.execute(
+        f"""
+        WITH {HOME_RATE}
+        SELECT (SELECT rate FROM home) / COALESCE((SELECT usd_rate / unit FROM fx_rates WHERE currency = ?), 0.01)
+        """,
+        (user_id, currency)
+    )
+    factor = cursor.fetchone()[0]
+    cursor.execute(
+        "UPDATE budgets SET amount = CAST(ROUND(amount * ?) AS INTEGER) WHERE user_id = ?", (factor, user_id)
+    )
     cursor.execute(
         """
-        INSERT INTO expenses (user_id, amount, category, description, payment_method)
-        VALUES (?, ?, ?, ?, ?)
+        UPDATE budget_totals SET spent = CAST(ROUND(spent * ?) AS INTEGER)
+        WHERE budget_id IN (SELECT id FROM budgets WHERE user_id = ?)
         """,
-        (user_id, amount, category, description, payment_method)
+        (factor, user_id)
     )
+    cursor.execute(
+        "UPDATE goal_contributions SET amount = CAST(ROUND(amount * ?) AS INTEGER) WHERE user_id = ?", (factor, user_id)
+    )
+    # saved amounts are re-summed from the rounded contributions so they keep matching the ledger
+    cursor.execute(
+        """
+        UPDATE goals SET target_amount = CAST(ROUND(target_amount * ?) AS INTEGER),
+            current_amount = (SELECT COALESCE(SUM(c.amount), 0) FROM goal_contributions c WHERE c.goal_id = goals.id)
+        WHERE user_id = ?
+        """,
+        (factor, user_id)
+    )
+    cursor.execute(
+        """
+        INSERT INTO users (id, home_currency) VALUES (?, ?)
+        ON CONFLICT(id) DO UPDATE SET home_currency = excluded.home_currency
+        """,
+        (user_id, currency)
+    )
+    _bump_data_version(cursor, user_id)
     
     conn.commit()
     conn.close()
 
+@timed_query
+def get_fx_rates() -> Dict[str, float]:
+    """Get the stored exchange rates as {currency: value of one unit in US dollars}."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT currency, usd_rate FROM fx_rates")
+    
+    rates = dict(cursor.fetchall())
+    conn.close()
+    return rates
+
+@timed_query
+def save_fx_rates(rates: Dict[str, float]):
+    """Store the latest exchange rates, given as {currency: value of one unit in US dollars}."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.executemany(
+        """
+        INSERT INTO fx_rates (currency, usd_rate, unit, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(currency) DO UPDATE SET
+            usd_rate = excluded.usd_rate, unit = excluded.unit, updated_at = excluded.updated_at
+        """,
+        [(currency, rate, minor_per_unit(currency)) for currency, rate in rates.items() if rate > 0]
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed_query
+def add_expense(user_id: int, amount: int, category: str, description: str = None, payment_method: str = None,
+                currency: str = None):
+    """Add a new expense of amount minor units, in the user's home currency unless a currency code is given."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    currency = currency or _home_currency(cursor, user_id)
+    alerts = _track_budget_spend(cursor, user_id, category, amount, currency=currency)
+    cursor.execute(
+        """
+        INSERT INTO expenses (user_id, amount, category, description, payment_method, currency)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (user_id, amount, category, description, payment_method, currency)
+    )
+    _bump_data_version(cursor, user_id)
+    
+    conn.commit()
+    conn.close()
+    _notify_budget_alerts(user_id, alerts)
+
+@timed_query
+def add_expenses(user_id: int, expenses) -> Tuple[int, int]:
+    """Add several (amount, category, description, date, currency) expenses in one transaction.
+
+    Amounts are minor units of the expense's currency, a date of None means now, a currency of None the user's home
+    currency. Returns the first and last of the new ids, which are consecutive.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    home_currency = _home_currency(cursor, user_id)
+    ids = []
+    alerts = {}
+    for amount, category, description, date, currency in expenses:
+        currency = currency or home_currency
+        # a later item can push the same budget further, only its highest threshold is announced
+        for alert in _track_budget_spend(cursor, user_id, category, amount, date, currency):
+            alerts[alert.budget_id] = alert
+        cursor.execute(
+            """
+            INSERT INTO expenses (user_id, amount, category, description, date, currency)
+            VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+            """,
+            (user_id, amount, category, description, date, currency)
+        )
+        ids.append(cursor.lastrowid)
+    _bump_data_version(cursor, user_id)
+    
+    conn.commit()
+    conn.close()
+    _notify_budget_alerts(user_id, list(alerts.values()))
+    return ids[0], ids[-1]
+
+@timed_query
+def delete_expense_range(user_id: int, first_id: int, last_id: int) -> int:
+    """Delete a user's expenses with ids from first_id to last_id, returns how many were deleted."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    # the user_id condition makes sure nobody can delete someone else's expenses with a forged id range
+    cursor.execute(
+        "DELETE FROM expenses WHERE user_id = ? AND id BETWEEN ? AND ?",
+        (user_id, first_id, last_id)
+    )
+    deleted = cursor.rowcount
+    if deleted:
+        _refresh_budget_totals(cursor, user_id)
+        _bump_data_version(cursor, user_id)
+    
+    conn.commit()
+    conn.close()
+    return deleted
+
+@timed_query
 def get_user_expenses(user_id: int, limit: int = 10):
-    """Get recent expenses for a user."""
-    conn = sqlite3.connect(DB_PATH)
+    """Get recent expenses for a user as (amount, category, description, date, payment_method, currency)."""
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
         """
-        SELECT amount, category, description, date, payment_method
+        SELECT amount, category, description, date, payment_method, currency
         FROM expenses
         WHERE user_id = ?
         ORDER BY date DESC
@@ -119,13 +776,142 @@ def get_user_expenses(user_id: int, limit: int = 10):
     conn.close()
     return expenses
 
+def _fts_query(text: str) -> str:
+    """Turn what the user typed into an FTS5 query matching every word as a prefix, with no operators."""
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+@timed_query
+def search_expenses(user_id: int, start_date: str = None, end_date: str = None, category: str = None,
+                    min_amount: int = None, max_amount: int = None, text: str = None,
+                    after_id: int = None, before_id: int = None, limit: int = 10):
+    """Get a page of a user's expenses as (id, amount, category, description, date, currency), newest first.
+
+    Dates are inclusive YYYY-MM-DD strings, amounts are minor units compared in the user's home currency, text
+    matches words (or word prefixes) in the description or category.
+    Pages are keyed on (date, id): after_id returns the expenses older than that expense, before_id the ones newer
+    than it, so any page costs the same as the first. Fetches one row more than asked for so the caller can tell
+    whether there is a page beyond this one.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    conditions = ["user_id = ?"]
+    params = [user_id]
+    if start_date:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date < ?")
+        params.append((date.fromisoformat(end_date) + timedelta(days=1)).isoformat())
+    if category:
+        conditions.append("category = ? COLLATE NOCASE")
+        params.append(category)
+    home_amount = """CASE WHEN currency = (SELECT currency FROM home) THEN amount
+        ELSE amount * COALESCE((SELECT usd_rate / unit FROM fx_rates WHERE currency = expenses.currency), 0.01)
+            / (SELECT rate FROM home) END"""
+    if min_amount is not None:
+        conditions.append(f"{home_amount} >= ?")
+        params.append(min_amount)
+    if max_amount is not None:
+        conditions.append(f"{home_amount} <= ?")
+        params.append(max_amount)
+    if text and _fts_available and _fts_query(text):
+        conditions.append("id IN (SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH ?)")
+        params.append(_fts_query(text))
+    elif text:
+        conditions.append("(description LIKE ? OR category LIKE ?)")
+        params += [f"%{text}%"] * 2
+    
+    if before_id is not None:
+        conditions.append("(date, id) > (SELECT date, id FROM expenses WHERE id = ?)")
+        params.append(before_id)
+        order = "ASC"
+    else:
+        if after_id is not None:
+            conditions.append("(date, id) < (SELECT date, id FROM expenses WHERE id = ?)")
+            params.append(after_id)
+        order = "DESC"
+    
+    cursor.execute(
+        f"""
+        WITH {HOME_RATE}
+        SELECT id, amount, category, description, date, currency
+        FROM expenses
+        WHERE {' AND '.join(conditions)}
+        ORDER BY date {order}, id {order}
+        LIMIT ?
+        """,
+        [user_id] + params + [limit + 1]
+    )
+    
+    expenses = cursor.fetchall()
+    conn.close()
+    if order == "ASC":
+        expenses.reverse()
+    return expenses
+
+# What /export writes of each table: its columns and the key its rows are read in order of. Expenses are keyed on
+# (date, id) so the chunks walk idx_expenses_user_date instead of every user's rows after an id.
+EXPORT_TABLES = {
+    "expenses": (("id", "date", "amount", "currency", "category", "description", "payment_method"), ("date", "id")),
+    "budgets": (("id", "category", "amount", "period", "start_date", "end_date"), ("id",)),
+    "goals": (("id", "name", "target_amount", "current_amount", "deadline", "category", "status", "created_at"), ("id",)),
+    "goal_contributions": (("id", "goal_id", "amount", "created_at"), ("id",)),
+}
+
+@timed_query
+def get_export_chunk(user_id: int, table: str, after: tuple = None, limit: int = 500):
+    """Get up to limit of a user's rows of one of the EXPORT_TABLES, in key order after the given key."""
+    columns, key = EXPORT_TABLES[table]
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    condition = ""
+    params = [user_id]
+    if after is not None:
+        condition = f"AND ({', '.join(key)}) > ({', '.join('?' * len(key))})"
+        params += list(after)
+    cursor.execute(
+        f"""
+        SELECT {', '.join(columns)}
+        FROM {table}
+        WHERE user_id = ? {condition}
+        ORDER BY {', '.join(key)}
+        LIMIT ?
+        """,
+        params + [limit]
+    )
+    
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def iter_export_rows(user_id: int, table: str, chunk_size: int = 500) -> Iterator[list]:
+    """Yield all of a user's rows of one of the EXPORT_TABLES a chunk at a time.
+
+    Every chunk is its own short query, so a long export never keeps the database locked against writes.
+    """
+    columns, key = EXPORT_TABLES[table]
+    positions = [columns.index(column) for column in key]
+    after = None
+    while True:
+        rows = get_export_chunk(user_id, table, after, chunk_size)
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        after = tuple(rows[-1][position] for position in positions)
+
+@timed_query
 def get_user_categories(user_id: int):
-    """Get all categories for a user."""
-    conn = sqlite3.connect(DB_PATH)
+    """Get the categories a user has recorded expenses under, in alphabetical order."""
+    conn = get_connection()
     cursor = conn.cursor()
     
+    # there is no categories table, a user's categories are the ones their expenses use
     cursor.execute(
-        "SELECT name FROM categories WHERE user_id = ?",
+        "SELECT DISTINCT category FROM expenses WHERE user_id = ? AND category IS NOT NULL ORDER BY category",
         (user_id,)
     )
     
@@ -133,9 +919,10 @@ def get_user_categories(user_id: int):
     conn.close()
     return categories
 
-def add_goal(user_id: int, name: str, target_amount: float, deadline: str = None, category: str = None):
-    """Add a new financial goal."""
-    conn = sqlite3.connect(DB_PATH)
+@timed_query
+def add_goal(user_id: int, name: str, target_amount: int, deadline: str = None, category: str = None):
+    """Add a new financial goal, the target in minor units of the user's home currency."""
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
@@ -145,13 +932,15 @@ def add_goal(user_id: int, name: str, target_amount: float, deadline: str = None
         """,
         (user_id, name, target_amount, deadline, category)
     )
+    _bump_data_version(cursor, user_id)
     
     conn.commit()
     conn.close()
 
+@timed_query
 def get_user_goals(user_id: int, status: str = 'active'):
     """Get all goals for a user."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
@@ -168,141 +957,689 @@ def get_user_goals(user_id: int, status: str = 'active'):
     conn.close()
     return goals
 
-def update_goal_progress(goal_id: int, amount: float):
-    """Update the progress of a goal."""
-    conn = sqlite3.connect(DB_PATH)
+def _page(cursor: sqlite3.Cursor, query: str, params: tuple, after_id: int = None, before_id: int = None,
+          limit: int = 8):
+    """Run a keyset-paginated query over rows whose first column is the id.
+
+    The query has to end in a WHERE clause that the id condition can be appended to. Fetches one row more than
+    asked for so the caller can tell whether there is a page beyond this one; the rows come back in id order either way.
+    """
+    if before_id is not None:
+        cursor.execute(f"{query} AND id < ? ORDER BY id DESC LIMIT ?", params + (before_id, limit + 1))
+        return list(reversed(cursor.fetchall()))
+    cursor.execute(f"{query} AND id > ? ORDER BY id ASC LIMIT ?", params + (after_id or 0, limit + 1))
+    return cursor.fetchall()
+
+@timed_query
+def get_goal_page(user_id: int, after_id: int = None, before_id: int = None, limit: int = 8):
+    """Get up to limit + 1 of a user's active goals after or before an id.
+
+    Rows are (id, name, target_amount, current_amount, currency), the currency being the user's home currency.
+    """
+    conn = get_connection()
     cursor = conn.cursor()
     
+    goals = _page(
+        cursor,
+        "SELECT id, name, target_amount, current_amount, ? FROM goals WHERE user_id = ? AND status = 'active'",
+        (_home_currency(cursor, user_id), user_id), after_id, before_id, limit
+    )
+    
+    conn.close()
+    return goals
+
+@timed_query
+def add_goal_contribution(user_id: int, goal_id: int, amount: int) -> bool:
+    """Put an amount towards one of the user's active goals, returns False if they have no such goal."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    # the user_id condition makes sure a forged goal id can't touch someone else's goal
     cursor.execute(
-        """
-        UPDATE goals
-        SET current_amount = current_amount + ?
-        WHERE id = ?
-        """,
-        (amount, goal_id)
+        "UPDATE goals SET current_amount = current_amount + ? WHERE id = ? AND user_id = ? AND status = 'active'",
+        (amount, goal_id, user_id)
     )
+    updated = cursor.rowcount > 0
+    if updated:
+        cursor.execute(
+            "INSERT INTO goal_contributions (goal_id, user_id, amount) VALUES (?, ?, ?)",
+            (goal_id, user_id, amount)
+        )
+        _bump_data_version(cursor, user_id)
     
     conn.commit()
     conn.close()
+    return updated
 
-def complete_goal(goal_id: int):
-    """Mark a goal as completed."""
-    conn = sqlite3.connect(DB_PATH)
+@timed_query
+def complete_goal(user_id: int, goal_id: int) -> bool:
+    """Mark one of the user's goals as completed, returns False if they have no such goal."""
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
-        "UPDATE goals SET status = 'completed' WHERE id = ?",
-        (goal_id,)
+        "UPDATE goals SET status = 'completed' WHERE id = ? AND user_id = ?",
+        (goal_id, user_id)
     )
+    updated = cursor.rowcount > 0
+    if updated:
+        _bump_data_version(cursor, user_id)
     
     conn.commit()
     conn.close()
+    return updated
 
-def delete_goal(goal_id: int):
-    """Delete a goal."""
-    conn = sqlite3.connect(DB_PATH)
+@timed_query
+def delete_goal(user_id: int, goal_id: int) -> bool:
+    """Delete one of the user's goals and its contributions, returns False if they have no such goal."""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    cursor.execute("DELETE FROM goals WHERE id = ?", (goal_id,))
+    cursor.execute("DELETE FROM goals WHERE id = ? AND user_id = ?", (goal_id, user_id))
+    deleted = cursor.rowcount > 0
+    if deleted:
+        cursor.execute("DELETE FROM goal_contributions WHERE goal_id = ?", (goal_id,))
+        _bump_data_version(cursor, user_id)
     
     conn.commit()
     conn.close()
+    return deleted
 
-def add_budget(user_id: int, category: str, amount: float, period: str, start_date: str, end_date: str):
-    """Add a new budget."""
-    conn = sqlite3.connect(DB_PATH)
+@timed_query
+def add_budget(user_id: int, category: str, amount: int, period: str, start_date: str, end_date: str = None,
+               recurring: bool = False):
+    """Add a new budget of amount minor units of the user's home currency.
+
+    A recurring budget repeats every period from start_date and has no end_date.
+    """
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
         """
-        INSERT INTO budgets (user_id, category, amount, period, start_date, end_date)
-        VALUES (?, ?, ?, ?, ?, ?)
+        INSERT INTO budgets (user_id, category, amount, period, start_date, end_date, recurring)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
         """,
-        (user_id, category, amount, period, start_date, end_date)
+        (user_id, category, amount, period, start_date, None if recurring else end_date, int(recurring))
     )
+    _bump_data_version(cursor, user_id)
     
     conn.commit()
     conn.close()
 
+@timed_query
 def get_user_budgets(user_id: int):
-    """Get all budgets for a user."""
-    conn = sqlite3.connect(DB_PATH)
+    """Get a user's active budgets, with the start and end date of the current window for recurring ones."""
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
         """
-        SELECT id, category, amount, period, start_date, end_date
+        SELECT id, category, amount, period, start_date, end_date, recurring
         FROM budgets
-        WHERE user_id = ? AND end_date >= date('now')
+        WHERE user_id = ? AND (recurring = 1 OR end_date >= date('now'))
         ORDER BY start_date DESC
         """,
         (user_id,)
     )
     
-    budgets = cursor.fetchall()
+    rows = cursor.fetchall()
+    conn.close()
+    
+    today = datetime.utcnow().date()
+    budgets = []
+    for budget_id, category, amount, period, start_date, end_date, recurring in rows:
+        if recurring:
+            window = window_at(period, date.fromisoformat(start_date), today)
+            start_date, end_date = window.start.isoformat(), window.end.isoformat()
+        budgets.append((budget_id, category, amount, period, start_date, end_date))
+    return budgets
+
+@timed_query
+def get_budget_page(user_id: int, after_id: int = None, before_id: int = None, limit: int = 8):
+    """Get up to limit + 1 of a user's active budgets after or before an id.
+
+    Rows are (id, category, amount, period, currency), the currency being the user's home currency.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    budgets = _page(
+        cursor,
+        "SELECT id, category, amount, period, ? FROM budgets WHERE user_id = ? AND (recurring = 1 OR end_date >= date('now'))",
+        (_home_currency(cursor, user_id), user_id), after_id, before_id, limit
+    )
+    
     conn.close()
     return budgets
 
-def update_budget(budget_id: int, amount: float):
-    """Update a budget's amount."""
-    conn = sqlite3.connect(DB_PATH)
+def _spend_in_windows(cursor: sqlite3.Cursor, user_id: int, windows) -> Dict:
+    """Sum a user's spending for several (key, category, start_date, end_date) windows with one query.
+
+    Dates are inclusive YYYY-MM-DD strings, sums are in the user's home currency. Each window is a range scan on
+    idx_expenses_user_category_date.
+    """
+    if not windows:
+        return {}
+    values = ", ".join("(?, ?, ?, ?)" for _ in windows)
+    params = []
+    for key, category, start_date, end_date in windows:
+        # expense dates carry a time, so the end is compared against the start of the following day
+        next_day = (date.fromisoformat(end_date) + timedelta(days=1)).isoformat()
+        params += [key, category, start_date, next_day]
+    cursor.execute(
+        f"""
+        WITH {HOME_RATE}, windows (key, category, start_date, before_date) AS (VALUES {values})
+        SELECT w.key, COALESCE(SUM({HOME_AMOUNT}), 0)
+        FROM windows w
+        LEFT JOIN expenses e ON e.user_id = ? AND e.category = w.category
+            AND e.date >= w.start_date AND e.date < w.before_date
+        {FX_JOIN}
+        GROUP BY w.key
+        """,
+        [user_id] + params + [user_id]
+    )
+    return dict(cursor.fetchall())
+
+@timed_query
+def get_budget_spend(user_id: int):
+    """Get the user's active budgets as (id, category, amount, period, start_date, end_date, spent) for the current window."""
+    budgets = get_user_budgets(user_id)
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    spent = _spend_in_windows(cursor, user_id, [(b[0], b[1], b[4], b[5]) for b in budgets])
+    
+    conn.close()
+    return [budget + (spent.get(budget[0], 0),) for budget in budgets]
+
+@timed_query
+def get_budget_history(user_id: int, budget_id: int, periods: int = 6):
+    """Get (start_date, end_date, amount, spent) for a budget's current and past windows, newest first.
+
+    Returns an empty list if the budget doesn't exist or belongs to someone else.
+    """
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
-        "UPDATE budgets SET amount = ? WHERE id = ?",
-        (amount, budget_id)
+        "SELECT category, amount, period, start_date, end_date, recurring FROM budgets WHERE id = ? AND user_id = ?",
+        (budget_id, user_id)
     )
+    row = cursor.fetchone()
+    if row is None:
+        conn.close()
+        return []
+    
+    category, amount, period, start_date, end_date, recurring = row
+    if recurring:
+        windows = [
+            (window.start.isoformat(), window.end.isoformat())
+            for window in past_windows(period, date.fromisoformat(start_date), datetime.utcnow().date(), periods)
+        ]
+    else:
+        windows = [(start_date, end_date)]
+    spent = _spend_in_windows(cursor, user_id, [(start, category, start, end) for start, end in windows])
+    
+    conn.close()
+    return [(start, end, amount, spent.get(start, 0)) for start, end in windows]
+
+@timed_query
+def update_budget(user_id: int, budget_id: int, amount: int) -> bool:
+    """Update the amount of one of the user's budgets, in minor units, returns False if they have no such budget."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "UPDATE budgets SET amount = ? WHERE id = ? AND user_id = ?",
+        (amount, budget_id, user_id)
+    )
+    updated = cursor.rowcount > 0
+    if updated:
+        # thresholds the window is already past under the new amount count as announced, the next alert is for the
+        # next one up
+        cursor.execute("SELECT start_date, spent FROM budget_totals WHERE budget_id = ?", (budget_id,))
+        cursor.executemany(
+            "UPDATE budget_totals SET alerted_threshold = ? WHERE budget_id = ? AND start_date = ?",
+            [(_reached_threshold(spent, amount), budget_id, start_date) for start_date, spent in cursor.fetchall()]
+        )
+        _bump_data_version(cursor, user_id)
     
     conn.commit()
     conn.close()
+    return updated
 
-def delete_budget(budget_id: int):
-    """Delete a budget."""
-    conn = sqlite3.connect(DB_PATH)
+@timed_query
+def delete_budget(user_id: int, budget_id: int) -> bool:
+    """Delete one of the user's budgets and its running totals, returns False if they have no such budget."""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    cursor.execute("DELETE FROM budgets WHERE id = ?", (budget_id,))
+    cursor.execute("DELETE FROM budgets WHERE id = ? AND user_id = ?", (budget_id, user_id))
+    deleted = cursor.rowcount > 0
+    if deleted:
+        cursor.execute("DELETE FROM budget_totals WHERE budget_id = ?", (budget_id,))
+        _bump_data_version(cursor, user_id)
     
     conn.commit()
     conn.close()
+    return deleted
 
+@timed_query
 def get_budget_progress(user_id: int, category: str = None):
-    """Get budget progress for a user."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    """Get budget progress for a user's current budget windows.
+
+    With a category returns (amount, period, start_date, end_date, spent) of that category's budget, None if there
+    is none; without one returns (total_budget, total_spent) over all active budgets.
+    """
+    budgets = get_budget_spend(user_id)
     
     if category:
-        # Get budget and expenses for specific category
+        for _, budget_category, amount, period, start_date, end_date, spent in budgets:
+            if budget_category == category:
+                return amount, period, start_date, end_date, spent
+        return None
+    
+    if not budgets:
+        return None, 0
+    return sum(budget[2] for budget in budgets), sum(budget[6] for budget in budgets)
+
+@timed_query
+def get_data_version(user_id: int) -> int:
+    """Get the current version of a user's finance data, 0 if they never wrote anything."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT version FROM data_versions WHERE user_id = ?", (user_id,))
+    
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+@timed_query
+def get_cached_report(user_id: int):
+    """Get the last generated report for a user as (data_version, report, last_expense_id, created_at)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "SELECT data_version, report, last_expense_id, created_at FROM report_cache WHERE user_id = ?",
+        (user_id,)
+    )
+    
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+@timed_query
+def save_report(user_id: int, data_version: int, report: str, last_expense_id: int = None):
+    """Store the latest report for a user, replacing the previous one."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        INSERT OR REPLACE INTO report_cache (user_id, data_version, report, last_expense_id, created_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """,
+        (user_id, data_version, report, last_expense_id)
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed_query
+def get_latest_expense_id(user_id: int):
+    """Get the id of the user's most recently added expense, None if they have none."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT MAX(id) FROM expenses WHERE user_id = ?", (user_id,))
+    
+    row = cursor.fetchone()
+    conn.close()
+    return row[0]
+
+@timed_query
+def get_expenses_since(user_id: int, after_id: int, limit: int = 50):
+    """Get expenses added after a given expense id, oldest first, as get_user_expenses returns them."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        SELECT amount, category, description, date, payment_method, currency
+        FROM expenses
+        WHERE user_id = ? AND id > ?
+        ORDER BY id ASC
+        LIMIT ?
+        """,
+        (user_id, after_id, limit)
+    )
+    
+    expenses = cursor.fetchall()
+    conn.close()
+    return expenses
+
+@timed_query
+def subscribe_report(user_id: int, chat_id: int, weekday: int):
+    """Subscribe a user to a weekly report, or change the day of an existing subscription."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        INSERT INTO report_subscriptions (user_id, chat_id, weekday) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET chat_id = excluded.chat_id, weekday = excluded.weekday
+        """,
+        (user_id, chat_id, weekday)
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed_query
+def unsubscribe_report(user_id: int) -> bool:
+    """Remove a user's report subscription, returns whether they had one."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("DELETE FROM report_subscriptions WHERE user_id = ?", (user_id,))
+    removed = cursor.rowcount > 0
+    
+    conn.commit()
+    conn.close()
+    return removed
+
+@timed_query
+def get_due_report_subscriptions(limit: int = 50):
+    """Get (user_id, chat_id) of subscriptions for today's weekday that haven't been sent today yet."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        SELECT user_id, chat_id
+        FROM report_subscriptions
+        WHERE weekday = CAST(strftime('%w', 'now') AS INTEGER)
+            AND (last_sent_at IS NULL OR date(last_sent_at) < date('now'))
+        ORDER BY user_id
+        LIMIT ?
+        """,
+        (limit,)
+    )
+    
+    subscriptions = cursor.fetchall()
+    conn.close()
+    return subscriptions
+
+@timed_query
+def mark_report_sent(user_id: int):
+    """Record that today's scheduled report was delivered."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "UPDATE report_subscriptions SET last_sent_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+        (user_id,)
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed_query
+def save_group(chat_id: int, title: str, currency: str = DEFAULT_CURRENCY):
+    """Record a group chat the bot is in. The currency only applies to a group seen for the first time."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        INSERT INTO group_chats (chat_id, title, currency) VALUES (?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET title = excluded.title, active = 1
+        """,
+        (chat_id, title, currency)
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed_query
+def deactivate_group(chat_id: int):
+    """Mark a group the bot was removed from, its ledger is kept for when it comes back."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("UPDATE group_chats SET active = 0 WHERE chat_id = ?", (chat_id,))
+    
+    conn.commit()
+    conn.close()
+
+@timed_query
+def get_group(chat_id: int):
+    """Get (title, currency) of a group chat, None if the bot never saw it."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT title, currency FROM group_chats WHERE chat_id = ?", (chat_id,))
+    
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+@timed_query
+def save_group_member(chat_id: int, user_id: int, name: str, active: bool = True):
+    """Record that a user joined (or left, with active=False) a group chat."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        INSERT INTO group_members (chat_id, user_id, name, active) VALUES (?, ?, ?, ?)
+        ON CONFLICT(chat_id, user_id) DO UPDATE SET
+            name = excluded.name, active = excluded.active, updated_at = CURRENT_TIMESTAMP
+        """,
+        (chat_id, user_id, name, int(active))
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed_query
+def get_group_members(chat_id: int, include_inactive: bool = False) -> Dict[int, str]:
+    """Get {user_id: name} of a group's members, with include_inactive also the ones who left."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        f"SELECT user_id, name FROM group_members WHERE chat_id = ? {'' if include_inactive else 'AND active = 1'}",
+        (chat_id,)
+    )
+    
+    members = dict(cursor.fetchall())
+    conn.close()
+    return members
+
+def _split_evenly(amount: int, user_ids) -> Dict[int, int]:
+    """Shares of an amount in minor units that add up to it exactly, the leftover units go one each to the first ids."""
+    user_ids = sorted(set(user_ids))
+    share, leftover = divmod(amount, len(user_ids))
+    return {user_id: share + (1 if i < leftover else 0) for i, user_id in enumerate(user_ids)}
+
+@timed_query
+def add_group_expense(chat_id: int, payer_id: int, amount: int, category: str, description: str, member_ids,
+                      currency: str = None, expense_date: str = None) -> Tuple[int, int]:
+    """Record an expense a member paid for the group, split evenly between member_ids.
+
+    member_ids needn't include the payer. The amount is in minor units of the given currency, converted into the
+    group's currency at today's rate. Returns the expense id and the amount in the group's currency.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT currency FROM group_chats WHERE chat_id = ?", (chat_id,))
+    row = cursor.fetchone()
+    group_currency = row[0] if row else DEFAULT_CURRENCY
+    if currency is not None and currency != group_currency:
         cursor.execute(
             """
-            SELECT b.amount, b.period, b.start_date, b.end_date,
-                   COALESCE(SUM(e.amount), 0) as spent
-            FROM budgets b
-            LEFT JOIN expenses e ON e.user_id = b.user_id 
-                AND e.category = b.category
-                AND e.date BETWEEN b.start_date AND b.end_date
-            WHERE b.user_id = ? AND b.category = ?
-            GROUP BY b.id
+            SELECT CAST(ROUND(? * COALESCE((SELECT usd_rate / unit FROM fx_rates WHERE currency = ?), 0.01)
+                / COALESCE((SELECT usd_rate / unit FROM fx_rates WHERE currency = ?), 0.01)) AS INTEGER)
             """,
-            (user_id, category)
+            (amount, currency, group_currency)
         )
-    else:
-        # Get total budget and expenses
+        amount = cursor.fetchone()[0]
+    cursor.execute(
+        """
+        INSERT INTO group_expenses (chat_id, payer_id, amount, category, description, date)
+        VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """,
+        (chat_id, payer_id, amount, category, description, expense_date)
+    )
+    expense_id = cursor.lastrowid
+    cursor.executemany(
+        "INSERT INTO group_expense_shares (expense_id, user_id, amount) VALUES (?, ?, ?)",
+        [(expense_id, user_id, share) for user_id, share in _split_evenly(amount, member_ids).items()]
+    )
+    
+    conn.commit()
+    conn.close()
+    return expense_id, amount
+
+@timed_query
+def get_group_balances(chat_id: int) -> Tuple[Dict[int, int], Tuple[int, int]]:
+    """Get what each member of a group is owed (positive) or owes (negative), in minor units of its currency.
+
+    Members who are even are left out. Also returns the ids of the group's last expense and payment, which
+    add_group_payments uses to tell whether the balances changed in the meantime.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    # paid for the group minus own shares, plus what was paid to others minus what others paid to them
+    cursor.execute(
+        """
+        SELECT user_id, SUM(amount) FROM (
+            SELECT payer_id AS user_id, amount FROM group_expenses WHERE chat_id = ?
+            UNION ALL
+            SELECT s.user_id, -s.amount
+            FROM group_expense_shares s JOIN group_expenses e ON e.id = s.expense_id
+            WHERE e.chat_id = ?
+            UNION ALL
+            SELECT from_user, amount FROM group_payments WHERE chat_id = ?
+            UNION ALL
+            SELECT to_user, -amount FROM group_payments WHERE chat_id = ?
+        )
+        GROUP BY user_id
+        HAVING SUM(amount) != 0
+        """,
+        (chat_id,) * 4
+    )
+    balances = dict(cursor.fetchall())
+    cursor.execute(
+        """
+        SELECT (SELECT COALESCE(MAX(id), 0) FROM group_expenses WHERE chat_id = ?),
+               (SELECT COALESCE(MAX(id), 0) FROM group_payments WHERE chat_id = ?)
+        """,
+        (chat_id, chat_id)
+    )
+    
+    version = cursor.fetchone()
+    conn.close()
+    return balances, version
+
+@timed_query
+def add_group_payments(chat_id: int, payments, version: Tuple[int, int]) -> bool:
+    """Record (from_user, to_user, amount) payments between members in one transaction.
+
+    Nothing is recorded and False is returned if an expense or payment was added to the group after
+    get_group_balances returned the given version, so a settlement is never applied to balances it wasn't
+    computed from.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    # BEGIN IMMEDIATE takes the write lock before the check, so nothing can be added between check and insert
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        """
+        SELECT (SELECT COALESCE(MAX(id), 0) FROM group_expenses WHERE chat_id = ?),
+               (SELECT COALESCE(MAX(id), 0) FROM group_payments WHERE chat_id = ?)
+        """,
+        (chat_id, chat_id)
+    )
+    unchanged = cursor.fetchone() == tuple(version)
+    if unchanged:
+        cursor.executemany(
+            "INSERT INTO group_payments (chat_id, from_user, to_user, amount) VALUES (?, ?, ?, ?)",
+            [(chat_id, from_user, to_user, amount) for from_user, to_user, amount in payments]
+        )
+    
+    conn.commit()
+    conn.close()
+    return unchanged
+
+@timed_query
+def set_group_budget(chat_id: int, category: str, amount: int, period: str, start_date: str):
+    """Set a group's shared budget for a category, replacing the one it had, in minor units of the group's currency.
+
+    Categories are matched case-insensitively, a budget keeps the spelling it was created with.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """
+        INSERT INTO group_budgets (chat_id, category, amount, period, start_date) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(chat_id, category) DO UPDATE SET
+            amount = excluded.amount, period = excluded.period, start_date = excluded.start_date
+        """,
+        (chat_id, category, amount, period, start_date)
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed_query
+def delete_group_budget(chat_id: int, category: str) -> bool:
+    """Remove a group's budget for a category, returns False if it had none."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("DELETE FROM group_budgets WHERE chat_id = ? AND category = ?", (chat_id, category))
+    deleted = cursor.rowcount > 0
+    
+    conn.commit()
+    conn.close()
+    return deleted
+
+@timed_query
+def get_group_budget_spend(chat_id: int):
+    """Get a group's budgets as (category, amount, period, start_date, end_date, spent) for their current window.
+
+    Each window is summed with a range scan on idx_group_expenses_chat_category_date.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "SELECT category, amount, period, start_date FROM group_budgets WHERE chat_id = ? ORDER BY category",
+        (chat_id,)
+    )
+    today = datetime.utcnow().date()
+    budgets = []
+    for category, amount, period, start_date in cursor.fetchall():
+        window = window_at(period, date.fromisoformat(start_date), today)
+        start_date, end_date = window.start.isoformat(), window.end.isoformat()
+        # expense dates carry a time, so the end is compared against the start of the following day
         cursor.execute(
             """
-            SELECT SUM(b.amount) as total_budget,
-                   COALESCE(SUM(e.amount), 0) as total_spent
-            FROM budgets b
-            LEFT JOIN expenses e ON e.user_id = b.user_id 
-                AND e.date BETWEEN b.start_date AND b.end_date
-            WHERE b.user_id = ?
+            SELECT COALESCE(SUM(amount), 0) FROM group_expenses
+            WHERE chat_id = ? AND category = ? AND date >= ? AND date < ?
             """,
-            (user_id,)
+            (chat_id, category, start_date, (window.end + timedelta(days=1)).isoformat())
         )
+        budgets.append((category, amount, period, start_date, end_date, cursor.fetchone()[0]))
     
-    result = cursor.fetchone()
     conn.close()
-    return result
-
-# Initialize database when module is imported
-init_db()  # Always run init_db to ensure tables exist 
\ No newline at end of file
+    return budgets
@@ -35,6 +35,7 @@ from objects import (
     TokenInfo,
     ConversationState, 
 )
+from sender import message_scheduler
 
 async def deploy_token_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the token deployment conversation when /deploytoken is called."""
@@ -203,7 +204,8 @@ async def successful_token_deployment(token_address: str, memo: TransactionMemo,
     # Send message with photo if available, otherwise just text
     if token_info.image_file_id:
         try:
-            await context.bot.send_photo(
+            await message_scheduler.send_photo(
+                context.bot,
                 chat_id=memo.associated_user_id, 
                 photo=token_info.image_file_id, 
                 caption=success_message, 
@@ -211,13 +213,15 @@ async def successful_token_deployment(token_address: str, memo: TransactionMemo,
             )
         except Exception as e:
             logger.error(f"Error sending photo for token deployment for user {memo.associated_user_id}: {e}. Sending text message instead.")
-            await context.bot.send_message(
+            await message_scheduler.send_message(
+                context.bot,
                 chat_id=memo.associated_user_id, 
                 text=success_message, 
                 parse_mode=ParseMode.HTML
             )
     else:
-        await context.bot.send_message(
+        await message_scheduler.send_message(
+            context.bot,
             chat_id=memo.associated_user_id, 
             text=success_message, 
             parse_mode=ParseMode.HTML
@@ -6,13 +6,14 @@ from telegram.constants import ParseMode
 
 from oneshot import oneshot_client, BUSINESS_ID
 from helpers import get_chain_id_from_network_name # To translate network name to chain_id
+from sender import message_scheduler, Priority
 
 logger = logging.getLogger(__name__)
 
 async def show_escrow_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays information about the primary escrow wallet."""
     chat_id = update.effective_chat.id
-    await context.bot.send_message(chat_id=chat_id, text="Fetching your escrow wallet information...")
+    await message_scheduler.send_message(context.bot, Priority.INTERACTIVE, chat_id=chat_id, text="Fetching your escrow wallet information...")
 
     try:
         # Determine the chain_id to query for.
@@ -21,7 +22,9 @@ async def show_escrow_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         chain_id_to_query = get_chain_id_from_network_name(network_name)
 
         if not chain_id_to_query:
-            await context.bot.send_message(
+            await message_scheduler.send_message(
+                context.bot,
+                Priority.INTERACTIVE,
                 chat_id=chat_id,
                 text=f"Could not determine a valid chain ID for network: {network_name}. Please check bot configuration or ONESHOT_NETWORK environment variable."
             )
@@ -50,16 +53,16 @@ async def show_escrow_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 f"**Address:** `{wallet_address}`\n"
                 f"**Balance:** {balance_str}\n"
             )
-            await context.bot.send_message(chat_id=chat_id, text=info_message, parse_mode=ParseMode.MARKDOWN)
+            await message_scheduler.send_message(context.bot, Priority.INTERACTIVE, chat_id=chat_id, text=info_message, parse_mode=ParseMode.MARKDOWN)
         elif wallets_response and wallets_response.error:
             logger.error(f"Error fetching escrow wallets: {wallets_response.error.message}")
-            await context.bot.send_message(chat_id=chat_id, text=f"Could not retrieve escrow wallet info: {wallets_response.error.message}")
+            await message_scheduler.send_message(context.bot, Priority.INTERACTIVE, chat_id=chat_id, text=f"Could not retrieve escrow wallet info: {wallets_response.error.message}")
         else:
-            await context.bot.send_message(chat_id=chat_id, text=f"No escrow wallet found configured for your business on network '{network_name}' (Chain ID: {chain_id_to_query}).")
+            await message_scheduler.send_message(context.bot, Priority.INTERACTIVE, chat_id=chat_id, text=f"No escrow wallet found configured for your business on network '{network_name}' (Chain ID: {chain_id_to_query}).")
 
     except Exception as e:
         logger.error(f"Exception in show_escrow_info: {e}", exc_info=True)
-        await context.bot.send_message(chat_id=chat_id, text=f"An unexpected error occurred while fetching escrow info: {e}")
+        await message_scheduler.send_message(context.bot, Priority.INTERACTIVE, chat_id=chat_id, text=f"An unexpected error occurred while fetching escrow info: {e}")
 
 def get_escrow_info_handler() -> CommandHandler:
     """Returns a CommandHandler for the /myescrowinfo command."""
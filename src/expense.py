@@ -1,11 +1,24 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from database import add_expense, get_user_expenses, get_user_categories
+from database import add_expense, add_expenses, delete_expense_range, get_user_expenses, get_user_categories, get_home_currency
+from currency import DEFAULT_CURRENCY, format_money, parse_amount, to_minor
 from objects import ConversationState
+from intents import parse_expenses
+from callbacks import callback_router, encode
 
 # States for the expense conversation
 EXPENSE_AMOUNT, EXPENSE_CATEGORY, EXPENSE_DESCRIPTION = range(3)
 
+# Callback actions of the expense buttons, see callbacks.py. Categories are sent as indexes: main categories and
+# their subcategories index DEFAULT_CATEGORIES, the user's own categories index the list they were shown.
+EXPENSE_UNDO = "eu" # with the first and last expense id
+EXPENSE_MAIN_CATEGORY = "em" # with the main category's index
+EXPENSE_SUBCATEGORY = "es" # with the main category's and the subcategory's index
+EXPENSE_USER_CATEGORIES = "el"
+EXPENSE_USER_CATEGORY = "ec" # with the index in the listed user categories
+EXPENSE_NEW_CATEGORY = "en"
+EXPENSE_BACK = "eb"
+
 # Default categories with emojis
 DEFAULT_CATEGORIES = {
     "🍔 Food & Dining": ["Restaurant", "Groceries", "Coffee", "Takeout"],
@@ -20,39 +33,89 @@ DEFAULT_CATEGORIES = {
     "📱 Bills": ["Phone", "Internet", "Streaming", "Other"]
 }
 
+def _to_rows(expenses, home_currency: str):
+    """Parsed expenses as add_expenses takes them, amounts in minor units of the currency they were typed in."""
+    rows = []
+    for amount, category, description, date, currency in expenses:
+        currency = currency or home_currency
+        rows.append((to_minor(amount, currency), category, description, date, currency))
+    return rows
+
+def format_added_expenses(expenses, home_currency: str = DEFAULT_CURRENCY) -> str:
+    rows = _to_rows(expenses, home_currency)
+    if len(rows) == 1:
+        amount, category, description, date, currency = rows[0]
+        text = f"✅ Added {format_money(amount, currency)} to {category} ({description})"
+        return text + (f" on {date.split(' ')[0]}." if date else ".")
+    currencies = {row[4] for row in rows}
+    if len(currencies) == 1:
+        total = format_money(sum(row[0] for row in rows), currencies.pop())
+        lines = [f"✅ Added {len(rows)} expenses, {total} in total:"]
+    else:
+        lines = [f"✅ Added {len(rows)} expenses:"]
+    for amount, category, description, date, currency in rows:
+        lines.append(
+            f"• {format_money(amount, currency)} {category} ({description})"
+            + (f", {date.split(' ')[0]}" if date else "")
+        )
+    return "\n".join(lines)
+
+async def record_expenses(update: Update, expenses) -> str:
+    """Insert parsed expenses in one transaction and confirm them with an undo button, returns the confirmation."""
+    home_currency = get_home_currency(update.effective_user.id)
+    first_id, last_id = add_expenses(update.effective_user.id, _to_rows(expenses, home_currency))
+    text = format_added_expenses(expenses, home_currency)
+    keyboard = [[InlineKeyboardButton("↩️ Undo", callback_data=encode(update.effective_user.id, EXPENSE_UNDO, first_id, last_id))]]
+    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    return text
+
+async def undo_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE, first_id: int, last_id: int) -> None:
+    """Delete the expenses added by one message when its undo button is pressed."""
+    query = update.callback_query
+    await query.answer()
+    
+    deleted = delete_expense_range(update.effective_user.id, first_id, last_id)
+    if deleted:
+        await query.edit_message_text(f"↩️ Removed {deleted} expense{'s' if deleted != 1 else ''}.")
+    else:
+        await query.edit_message_text("These expenses were already removed.")
+
 async def expense(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Start the expense tracking conversation."""
+    """Start the expense tracking conversation, or add expenses right away when given like /expense lunch 14.50, uber 22."""
+    if context.args:
+        user_categories = get_user_categories(update.effective_user.id)
+        expenses = parse_expenses(" ".join(context.args), user_categories, require_known_category=False)
+        if expenses:
+            await record_expenses(update, expenses)
+            return ConversationHandler.END
+        await update.message.reply_text(
+            "I couldn't read that, try something like /expense lunch 14.50, uber 22, groceries 63 yesterday"
+        )
+        return ConversationHandler.END
+
     await update.message.reply_text(
         "💰 Let's add a new expense!\n\n"
-        "Please enter the amount (e.g., 25.50):"
+        "Please enter the amount (e.g., 25.50, or 25.50 EUR in another currency):"
     )
     return EXPENSE_AMOUNT
 
 async def expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle the expense amount."""
+    """Handle the expense amount, optionally with a currency."""
     try:
-        amount = float(update.message.text)
+        home_currency = get_home_currency(update.effective_user.id)
+        amount, currency = parse_amount(update.message.text, home_currency)
+        currency = currency or home_currency
+        amount = to_minor(amount, currency)
         if amount <= 0:
             await update.message.reply_text("❌ Please enter a positive amount.")
             return EXPENSE_AMOUNT
         
         context.user_data['expense_amount'] = amount
+        context.user_data['expense_currency'] = currency
         
         # Get existing categories
         user_categories = get_user_categories(update.effective_user.id)
-        
-        # Create keyboard with main categories
-        keyboard = []
-        for main_category in DEFAULT_CATEGORIES.keys():
-            keyboard.append([InlineKeyboardButton(main_category, callback_data=f"main_{main_category}")])
-        
-        # Add user's custom categories if any
-        if user_categories:
-            keyboard.append([InlineKeyboardButton("📋 Your Categories", callback_data="user_categories")])
-        
-        keyboard.append([InlineKeyboardButton("➕ New Category", callback_data="new_category")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _main_category_keyboard(update.effective_user.id, bool(user_categories))
         
         await update.message.reply_text(
             "📝 Select a category:",
@@ -60,79 +123,113 @@ async def expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return EXPENSE_CATEGORY
     except ValueError:
-        await update.message.reply_text("❌ Please enter a valid number.")
+        await update.message.reply_text("❌ Please enter a valid amount, like 25.50 or 25.50 EUR (without thousands separators).")
         return EXPENSE_AMOUNT
 
-async def expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle the expense category selection."""
-    query = update.callback_query
-    await query.answer()
+def _main_category_keyboard(user_id: int, with_user_categories: bool = True) -> InlineKeyboardMarkup:
+    keyboard = []
+    for index, main_category in enumerate(DEFAULT_CATEGORIES):
+        keyboard.append([InlineKeyboardButton(main_category, callback_data=encode(user_id, EXPENSE_MAIN_CATEGORY, index))])
     
-    if query.data == "new_category":
-        await query.edit_message_text(
-            "📝 Please enter a new category name:"
-        )
-        return EXPENSE_CATEGORY
+    # Add user's custom categories if any
+    if with_user_categories:
+        keyboard.append([InlineKeyboardButton("📋 Your Categories", callback_data=encode(user_id, EXPENSE_USER_CATEGORIES))])
     
-    if query.data == "user_categories":
-        # Show user's custom categories
-        user_categories = get_user_categories(update.effective_user.id)
-        keyboard = []
-        for category in user_categories:
-            keyboard.append([InlineKeyboardButton(category, callback_data=f"category_{category}")])
-        keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "📋 Your custom categories:",
-            reply_markup=reply_markup
-        )
-        return EXPENSE_CATEGORY
-    
-    if query.data == "back_to_main":
-        # Return to main categories
-        keyboard = []
-        for main_category in DEFAULT_CATEGORIES.keys():
-            keyboard.append([InlineKeyboardButton(main_category, callback_data=f"main_{main_category}")])
-        keyboard.append([InlineKeyboardButton("📋 Your Categories", callback_data="user_categories")])
-        keyboard.append([InlineKeyboardButton("➕ New Category", callback_data="new_category")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "📝 Select a category:",
-            reply_markup=reply_markup
-        )
-        return EXPENSE_CATEGORY
+    keyboard.append([InlineKeyboardButton("➕ New Category", callback_data=encode(user_id, EXPENSE_NEW_CATEGORY))])
+    return InlineKeyboardMarkup(keyboard)
+
+def _back_button(user_id: int) -> list:
+    return [InlineKeyboardButton("⬅️ Back", callback_data=encode(user_id, EXPENSE_BACK))]
+
+async def _choose_category(update: Update, context: ContextTypes.DEFAULT_TYPE, category: str) -> int:
+    """Remember the chosen category and ask for a description."""
+    context.user_data['expense_category'] = category
     
-    if query.data.startswith("main_"):
-        # Show subcategories for the selected main category
-        main_category = query.data.replace("main_", "")
-        keyboard = []
-        for subcategory in DEFAULT_CATEGORIES[main_category]:
-            keyboard.append([InlineKeyboardButton(subcategory, callback_data=f"category_{subcategory}")])
-        keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            f"📝 Select a subcategory for {main_category}:",
-            reply_markup=reply_markup
-        )
+    text = f"💬 Add a description for your {category} expense (or send /skip to leave it empty):"
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text)
+    else:
+        await update.message.reply_text(text)
+    return EXPENSE_DESCRIPTION
+
+async def new_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Ask for the name of a new category."""
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        "📝 Please enter a new category name:"
+    )
+    return EXPENSE_CATEGORY
+
+async def expense_new_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle a category name typed instead of picked."""
+    return await _choose_category(update, context, update.message.text)
+
+async def show_user_categories(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Show user's custom categories."""
+    query = update.callback_query
+    await query.answer()
+    user_id = update.effective_user.id
+    # the buttons carry indexes into this list, so a category added meanwhile can't shift what they point to
+    user_categories = context.user_data['category_choices'] = get_user_categories(user_id)
+    keyboard = []
+    for index, category in enumerate(user_categories):
+        keyboard.append([InlineKeyboardButton(category, callback_data=encode(user_id, EXPENSE_USER_CATEGORY, index))])
+    keyboard.append(_back_button(user_id))
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "📋 Your custom categories:",
+        reply_markup=reply_markup
+    )
+    return EXPENSE_CATEGORY
+
+async def back_to_main_categories(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Return to main categories."""
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        "📝 Select a category:",
+        reply_markup=_main_category_keyboard(update.effective_user.id)
+    )
+    return EXPENSE_CATEGORY
+
+async def show_subcategories(update: Update, context: ContextTypes.DEFAULT_TYPE, main_index: int) -> int:
+    """Show subcategories for the selected main category."""
+    query = update.callback_query
+    await query.answer()
+    main_categories = list(DEFAULT_CATEGORIES)
+    if main_index >= len(main_categories):
         return EXPENSE_CATEGORY
-    
-    if query.data.startswith("category_"):
-        # Handle final category selection
-        category = query.data.replace("category_", "")
-        context.user_data['expense_category'] = category
-        
-        await query.edit_message_text(
-            f"💬 Add a description for your {category} expense (or send /skip to leave it empty):"
-        )
-        return EXPENSE_DESCRIPTION
-    
-    # If we get here, it's a new category name
-    context.user_data['expense_category'] = query.data
-    
+    main_category = main_categories[main_index]
+    user_id = update.effective_user.id
+    keyboard = []
+    for index, subcategory in enumerate(DEFAULT_CATEGORIES[main_category]):
+        keyboard.append([InlineKeyboardButton(
+            subcategory, callback_data=encode(user_id, EXPENSE_SUBCATEGORY, main_index, index)
+        )])
+    keyboard.append(_back_button(user_id))
+    reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(
-        f"💬 Add a description for your {query.data} expense (or send /skip to leave it empty):"
+        f"📝 Select a subcategory for {main_category}:",
+        reply_markup=reply_markup
     )
-    return EXPENSE_DESCRIPTION
+    return EXPENSE_CATEGORY
+
+async def choose_subcategory(update: Update, context: ContextTypes.DEFAULT_TYPE, main_index: int, index: int) -> int:
+    """Handle final category selection of a default subcategory."""
+    await update.callback_query.answer()
+    subcategories = list(DEFAULT_CATEGORIES.values())
+    if main_index >= len(subcategories) or index >= len(subcategories[main_index]):
+        return EXPENSE_CATEGORY
+    return await _choose_category(update, context, subcategories[main_index][index])
+
+async def choose_user_category(update: Update, context: ContextTypes.DEFAULT_TYPE, index: int) -> int:
+    """Handle final category selection of one of the user's categories."""
+    await update.callback_query.answer()
+    choices = context.user_data.get('category_choices', [])
+    if index >= len(choices):
+        return EXPENSE_CATEGORY
+    return await _choose_category(update, context, choices[index])
 
 async def expense_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the expense description."""
@@ -146,19 +243,21 @@ async def expense_description(update: Update, context: ContextTypes.DEFAULT_TYPE
         user_id=update.effective_user.id,
         amount=context.user_data['expense_amount'],
         category=context.user_data['expense_category'],
-        description=description
+        description=description,
+        currency=context.user_data['expense_currency']
     )
     
     # Store values before clearing context
     amount = context.user_data['expense_amount']
     category = context.user_data['expense_category']
+    currency = context.user_data['expense_currency']
     
     # Clear user data
     context.user_data.clear()
     
     await update.message.reply_text(
         f"✅ Expense added successfully!\n\n"
-        f"Amount: ${amount:.2f}\n"
+        f"Amount: {format_money(amount, currency)}\n"
         f"Category: {category}\n"
         f"Description: {description if description else 'None'}"
     )
@@ -170,6 +269,18 @@ async def cancel_expense(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text("❌ Expense tracking cancelled.")
     return ConversationHandler.END
 
+callback_router.register(EXPENSE_UNDO, undo_expenses)
+callback_router.register(EXPENSE_MAIN_CATEGORY, show_subcategories)
+callback_router.register(EXPENSE_SUBCATEGORY, choose_subcategory)
+callback_router.register(EXPENSE_USER_CATEGORIES, show_user_categories)
+callback_router.register(EXPENSE_USER_CATEGORY, choose_user_category)
+callback_router.register(EXPENSE_NEW_CATEGORY, new_category)
+callback_router.register(EXPENSE_BACK, back_to_main_categories)
+
+def get_undo_expenses_handler() -> CallbackQueryHandler:
+    """Get the handler for the undo button on quickly added expenses."""
+    return callback_router.handler(EXPENSE_UNDO)
+
 def get_expense_conversation_handler() -> ConversationHandler:
     """Get the expense conversation handler."""
     return ConversationHandler(
@@ -179,8 +290,11 @@ def get_expense_conversation_handler() -> ConversationHandler:
                 MessageHandler(filters.TEXT & ~filters.COMMAND, expense_amount)
             ],
             EXPENSE_CATEGORY: [
-                CallbackQueryHandler(expense_category),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, expense_category)
+                callback_router.handler(
+                    EXPENSE_MAIN_CATEGORY, EXPENSE_SUBCATEGORY, EXPENSE_USER_CATEGORIES, EXPENSE_USER_CATEGORY,
+                    EXPENSE_NEW_CATEGORY, EXPENSE_BACK
+                ),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, expense_new_category)
             ],
             EXPENSE_DESCRIPTION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, expense_description),
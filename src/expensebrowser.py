@@ -0,0 +1,175 @@
+import shlex
+from datetime import date
+from decimal import Decimal
+from typing import List, NamedTuple, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import CommandHandler, ContextTypes
+
+from callbacks import callback_router, encode
+from currency import DEFAULT_CURRENCY, format_money, parse_amount, to_minor
+from database import get_home_currency, search_expenses
+
+# /expenses pages through a user's whole expense history, newest first, optionally filtered:
+#   /expenses coffee from:2024-01-01 to:2024-03-31 category:Coffee min:3 max:20
+# Free words are searched in descriptions and categories (FTS5, see database.search_expenses). Pages are keyed on
+# (date, id) of the last expense shown, so "Older" on page 500 runs the same index range scan as page 1.
+# Buttons can't carry the filter text, so each search is kept in user_data under a small number that the page
+# buttons refer to.
+
+PAGE_SIZE = 10
+MAX_SAVED_SEARCHES = 5
+EXPENSE_BROWSER_PAGE = "xp" # with the search number, the direction (OLDER or NEWER) and the expense id of the edge
+OLDER, NEWER = 0, 1
+
+USAGE = (
+    "Browse your expenses, newest first. Filters can be combined:\n"
+    "/expenses coffee - search descriptions\n"
+    "/expenses from:2024-01-01 to:2024-01-31 - a date range\n"
+    "/expenses category:Groceries - one category (use quotes for spaces: category:\"Public Transit\")\n"
+    "/expenses min:20 max:100 - an amount range"
+)
+
+class ExpenseFilter(NamedTuple):
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    category: Optional[str] = None
+    min_amount: Optional[Decimal] = None # as typed, in the home currency
+    max_amount: Optional[Decimal] = None
+    text: Optional[str] = None
+
+    def in_minor_units(self, currency: str) -> "ExpenseFilter":
+        """The filter with its amounts in minor units of the currency, as search_expenses compares them."""
+        return self._replace(**{
+            field: to_minor(getattr(self, field), currency)
+            for field in ("min_amount", "max_amount") if getattr(self, field) is not None
+        })
+
+    def describe(self, currency: str = DEFAULT_CURRENCY) -> str:
+        parts = []
+        if self.text:
+            parts.append(f'matching "{self.text}"')
+        if self.category:
+            parts.append(f"in {self.category}")
+        if self.start_date or self.end_date:
+            parts.append(f"from {self.start_date or 'the start'} to {self.end_date or 'today'}")
+        if self.min_amount is not None:
+            parts.append(f"at least {format_money(to_minor(self.min_amount, currency), currency)}")
+        if self.max_amount is not None:
+            parts.append(f"at most {format_money(to_minor(self.max_amount, currency), currency)}")
+        return ", ".join(parts)
+
+def parse_filter(args: List[str], currency: str = DEFAULT_CURRENCY) -> ExpenseFilter:
+    """Parse /expenses arguments with amounts in the given currency, raises ValueError with a message for the user."""
+    try:
+        tokens = shlex.split(" ".join(args))
+    except ValueError:
+        raise ValueError("There's an unmatched quote in your filters.")
+    values = {}
+    words = []
+    for token in tokens:
+        key, separator, value = token.partition(":")
+        key = key.lower()
+        if not separator or key not in ("from", "to", "category", "cat", "min", "max"):
+            words.append(token)
+            continue
+        if key in ("from", "to"):
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"{key}: needs a date like 2024-01-31.")
+            values["start_date" if key == "from" else "end_date"] = value
+        elif key in ("category", "cat"):
+            values["category"] = value
+        else:
+            try:
+                values["min_amount" if key == "min" else "max_amount"], _ = parse_amount(value, currency)
+            except ValueError:
+                raise ValueError(f"{key}: needs an amount like 12.50.")
+    if words:
+        values["text"] = " ".join(words)
+    return ExpenseFilter(**values)
+
+def _save_search(context: ContextTypes.DEFAULT_TYPE, expense_filter: ExpenseFilter) -> int:
+    searches = context.user_data.setdefault("expense_searches", {})
+    number = context.user_data["expense_search_count"] = context.user_data.get("expense_search_count", 0) + 1
+    searches[number] = expense_filter
+    for old in sorted(searches)[:-MAX_SAVED_SEARCHES]:
+        del searches[old]
+    return number
+
+def _render_page(user_id: int, search: int, expense_filter: ExpenseFilter, direction: int = OLDER,
+                 cursor: Optional[int] = None):
+    """The text and buttons of one page of expenses."""
+    home_currency = get_home_currency(user_id)
+    query = expense_filter.in_minor_units(home_currency)
+    if direction == NEWER:
+        rows = search_expenses(user_id, *query, before_id=cursor, limit=PAGE_SIZE)
+        has_newer = len(rows) > PAGE_SIZE
+        rows = rows[-PAGE_SIZE:]
+        has_older = True
+    else:
+        rows = search_expenses(user_id, *query, after_id=cursor, limit=PAGE_SIZE)
+        has_older = len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
+        has_newer = cursor is not None
+
+    title = "🧾 Your expenses"
+    description = expense_filter.describe(home_currency)
+    if description:
+        title += f" {description}"
+    if not rows:
+        return f"{title}\n\nNo expenses found.", None
+
+    lines = [title, ""]
+    for _, amount, category, description, expense_date, currency in rows:
+        line = f"{expense_date.split(' ')[0]}  {format_money(amount, currency)}  {category}"
+        if description:
+            line += f" - {description}"
+        lines.append(line)
+
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton(
+            "◀️ Newer", callback_data=encode(user_id, EXPENSE_BROWSER_PAGE, search, NEWER, rows[0][0])
+        ))
+    if has_older:
+        navigation.append(InlineKeyboardButton(
+            "Older ▶️", callback_data=encode(user_id, EXPENSE_BROWSER_PAGE, search, OLDER, rows[-1][0])
+        ))
+    return "\n".join(lines), InlineKeyboardMarkup([navigation]) if navigation else None
+
+async def expenses_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the first page of the user's expenses that match the filters in the arguments."""
+    if context.args and context.args[0].lower() == "help":
+        await update.message.reply_text(USAGE)
+        return
+    try:
+        expense_filter = parse_filter(context.args or [], get_home_currency(update.effective_user.id))
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}\n\n{USAGE}")
+        return
+
+    search = _save_search(context, expense_filter)
+    text, reply_markup = _render_page(update.effective_user.id, search, expense_filter)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def expenses_page(update: Update, context: ContextTypes.DEFAULT_TYPE, search: int, direction: int, cursor: int) -> None:
+    """Show the next older or newer page of a search."""
+    query = update.callback_query
+    await query.answer()
+    expense_filter = context.user_data.get("expense_searches", {}).get(search)
+    if expense_filter is None:
+        await query.edit_message_text("This search has expired, run /expenses again.")
+        return
+    text, reply_markup = _render_page(update.effective_user.id, search, expense_filter, direction, cursor)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+callback_router.register(EXPENSE_BROWSER_PAGE, expenses_page)
+
+def get_expense_browser_handlers():
+    """Get the /expenses command and its page buttons."""
+    return [
+        CommandHandler("expenses", expenses_command),
+        callback_router.handler(EXPENSE_BROWSER_PAGE),
+    ]
@@ -0,0 +1,152 @@
+import asyncio
+import csv
+import io
+import logging
+import tempfile
+import zipfile
+from datetime import datetime
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Dict
+
+from telegram import Update
+from telegram.ext import CommandHandler, ContextTypes
+
+from currency import CURRENCIES, from_minor
+from database import EXPORT_TABLES, get_home_currency, iter_export_rows
+
+logger = logging.getLogger(__name__)
+
+# /export [csv|parquet] sends the user everything the bot stores about their money as one zip archive: expenses,
+# budgets, goals and the ledger of goal contributions, one file per table.
+#   - tables are read EXPORT_CHUNK_SIZE rows at a time (database.iter_export_rows) and every chunk is written and
+#     compressed before the next is read, so memory stays flat however many years of history there are
+#   - CSV files are deflated into the archive as they're written, Parquet files get one zstd compressed row group
+#     per chunk and are stored in the archive as they are
+#   - reading and compressing run in a worker thread, at most MAX_CONCURRENT_EXPORTS at once
+#   - amounts are written as exact decimals in whole units (12.50, not the 1250 cents they're stored as), expenses in
+#     their own currency, budgets and goals in the user's home currency
+# The archive is uploaded as a reply rather than through the message scheduler, whose single worker would otherwise
+# hold every other outgoing message back for the length of the upload.
+
+EXPORT_CHUNK_SIZE = 1000
+MAX_CONCURRENT_EXPORTS = 2
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024 # Telegram's limit for documents sent by bots
+FORMATS = ("csv", "parquet")
+
+# pyarrow is only needed for Parquet, checked without importing it
+PARQUET_AVAILABLE = find_spec("pyarrow") is not None
+
+# enough decimal places for the currency with the smallest minor unit
+AMOUNT_SCALE = max(currency.decimals for currency in CURRENCIES.values())
+
+_exports = asyncio.Semaphore(MAX_CONCURRENT_EXPORTS)
+
+def _iter_rows(user_id: int, table: str, home_currency: str):
+    """The table's rows a chunk at a time, with amounts turned from minor units into Decimals in whole units."""
+    columns, _ = EXPORT_TABLES[table]
+    money = [i for i, column in enumerate(columns) if "amount" in column]
+    currency = columns.index("currency") if "currency" in columns else None
+    for rows in iter_export_rows(user_id, table, EXPORT_CHUNK_SIZE):
+        chunk = []
+        for row in rows:
+            row = list(row)
+            row_currency = home_currency if currency is None else row[currency]
+            for i in money:
+                if row[i] is not None:
+                    row[i] = from_minor(row[i], row_currency)
+            chunk.append(row)
+        yield chunk
+
+def _write_csv(archive: zipfile.ZipFile, user_id: int, table: str, home_currency: str) -> int:
+    columns, _ = EXPORT_TABLES[table]
+    count = 0
+    with io.TextIOWrapper(archive.open(f"{table}.csv", "w"), encoding="utf-8", newline="") as member:
+        writer = csv.writer(member)
+        writer.writerow(columns)
+        for rows in _iter_rows(user_id, table, home_currency):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+def _write_parquet(archive: zipfile.ZipFile, directory: Path, user_id: int, table: str, home_currency: str) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns, _ = EXPORT_TABLES[table]
+    types = {"id": pa.int64(), "goal_id": pa.int64()}
+    schema = pa.schema([
+        (column, types.get(column, pa.decimal128(38, AMOUNT_SCALE) if "amount" in column else pa.string()))
+        for column in columns
+    ])
+    path = directory / f"{table}.parquet"
+    count = 0
+    with pq.ParquetWriter(str(path), schema, compression="zstd") as writer:
+        for rows in _iter_rows(user_id, table, home_currency):
+            values = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values[i], type=field.type) for i, field in enumerate(schema)], schema=schema
+            ))
+            count += len(rows)
+    # Parquet pages are compressed already
+    archive.write(path, path.name, compress_type=zipfile.ZIP_STORED)
+    path.unlink()
+    return count
+
+def write_export(user_id: int, export_format: str, path: Path) -> Dict[str, int]:
+    """Write a user's export archive to path, returns the number of rows of each table. Blocks, run it in a thread."""
+    counts = {}
+    home_currency = get_home_currency(user_id)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for table in EXPORT_TABLES:
+            if export_format == "parquet":
+                counts[table] = _write_parquet(archive, path.parent, user_id, table, home_currency)
+            else:
+                counts[table] = _write_csv(archive, user_id, table, home_currency)
+    return counts
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send the user an archive of all their finance data."""
+    export_format = context.args[0].lower() if context.args else "csv"
+    if export_format not in FORMATS:
+        await update.message.reply_text("Usage: /export [csv|parquet], CSV if you leave it out.")
+        return
+    if export_format == "parquet" and not PARQUET_AVAILABLE:
+        await update.message.reply_text("❌ Parquet exports aren't available on this server, try /export csv.")
+        return
+    if context.user_data.get("export_running"):
+        await update.message.reply_text("⏳ Your previous export is still being prepared.")
+        return
+
+    user_id = update.effective_user.id
+    context.user_data["export_running"] = True
+    await update.message.reply_text("📦 Preparing your export, this can take a moment...")
+    try:
+        with tempfile.TemporaryDirectory(prefix="penny-export-") as directory:
+            path = Path(directory) / f"penny-{export_format}-export-{datetime.utcnow():%Y-%m-%d}.zip"
+            async with _exports:
+                counts = await asyncio.to_thread(write_export, user_id, export_format, path)
+
+            if path.stat().st_size > MAX_UPLOAD_BYTES:
+                await update.message.reply_text(
+                    "❌ Your export is larger than the 50 MB Telegram lets bots send."
+                    + ("" if export_format == "parquet" or not PARQUET_AVAILABLE else " Try /export parquet, it is smaller.")
+                )
+                return
+            await update.message.reply_document(
+                document=path,
+                filename=path.name,
+                caption=(
+                    f"🗂️ Your Penny data: {counts['expenses']} expenses, {counts['budgets']} budgets, "
+                    f"{counts['goals']} goals and {counts['goal_contributions']} goal contributions."
+                )
+            )
+    except Exception as e:
+        logger.error(f"Export for user {user_id} failed: {e}")
+        await update.message.reply_text("❌ Sorry, your export couldn't be created. Please try again later.")
+    finally:
+        context.user_data.pop("export_running", None)
+
+def get_export_handler() -> CommandHandler:
+    """Create and return the export command handler."""
+    return CommandHandler("export", export_command)
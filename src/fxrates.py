@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+from typing import Dict
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ContextTypes
+
+from currency import CURRENCIES, format_money, minor_per_unit, parse_currency, to_minor
+from database import get_fx_rates, get_home_currency, save_fx_rates, set_home_currency
+from metrics import track_call
+
+logger = logging.getLogger(__name__)
+
+# Exchange rates for converting expenses into a user's home currency. They are stored in the fx_rates table (value of
+# one unit in US dollars) so the totals in /hello, /budget and /report are converted by SQLite without a network call,
+# and refreshed by a JobQueue job at start-up and every FX_REFRESH_HOURS:
+#   - FX_PROVIDER=http reads fiat and crypto rates against USD from FX_RATES_URL (Coinbase's public exchange rates)
+#   - FX_PROVIDER=fixture uses the rates in the JSON file FX_FIXTURE_PATH, or FIXTURE_RATES, for tests and offline
+#     development
+# A failed refresh keeps the rates already stored. Only the currencies in currency.py are kept.
+
+FX_PROVIDER = os.getenv("FX_PROVIDER", "http").lower()
+FX_RATES_URL = os.getenv("FX_RATES_URL", "https://api.coinbase.com/v2/exchange-rates?currency=USD")
+FX_FIXTURE_PATH = os.getenv("FX_FIXTURE_PATH")
+FX_REFRESH_HOURS = float(os.getenv("FX_REFRESH_HOURS", "6"))
+FX_TIMEOUT = 10.0 # seconds
+
+# value of one unit in US dollars, roughly right so offline conversions are plausible
+FIXTURE_RATES = {
+    "USD": 1.0, "EUR": 1.08, "GBP": 1.27, "JPY": 0.0067, "CHF": 1.12, "CAD": 0.73, "AUD": 0.66, "INR": 0.012,
+    "BRL": 0.18, "MXN": 0.055, "BTC": 65000.0, "ETH": 3200.0, "USDC": 1.0,
+}
+
+class FixtureRateProvider:
+    name = "fixture"
+
+    def __init__(self, path: str = None):
+        self.path = path
+
+    async def fetch(self) -> Dict[str, float]:
+        if not self.path:
+            return dict(FIXTURE_RATES)
+        with open(self.path) as f:
+            return {currency.upper(): float(rate) for currency, rate in json.load(f).items()}
+
+class HttpRateProvider:
+    name = "http"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    async def fetch(self) -> Dict[str, float]:
+        # httpx comes with python-telegram-bot
+        import httpx
+
+        async with track_call("fx", "exchange_rates"):
+            async with httpx.AsyncClient(timeout=FX_TIMEOUT) as client:
+                response = await client.get(self.url)
+                response.raise_for_status()
+        # {"data": {"currency": "USD", "rates": {"EUR": "0.92", "BTC": "0.0000154", ...}}}, units per dollar
+        rates = response.json()["data"]["rates"]
+        return {currency: 1 / float(per_dollar) for currency, per_dollar in rates.items() if float(per_dollar) > 0}
+
+def _make_provider():
+    if FX_PROVIDER == "fixture":
+        return FixtureRateProvider(FX_FIXTURE_PATH)
+    if FX_PROVIDER != "http":
+        logger.warning(f"Unknown FX_PROVIDER {FX_PROVIDER}, using http")
+    return HttpRateProvider(FX_RATES_URL)
+
+rate_provider = _make_provider()
+
+async def refresh_fx_rates(context: ContextTypes.DEFAULT_TYPE = None) -> None:
+    """Fetch the latest rates from the provider and store the ones for the currencies we support."""
+    try:
+        rates = await rate_provider.fetch()
+    except Exception as e:
+        logger.error(f"Refreshing exchange rates from {rate_provider.name} failed, keeping the stored ones: {e}")
+        return
+    rates = {currency: rate for currency, rate in rates.items() if currency in CURRENCIES}
+    rates["USD"] = 1.0
+    save_fx_rates(rates)
+    logger.info(f"Stored {len(rates)} exchange rates from {rate_provider.name}")
+
+def schedule_fx_jobs(application: Application) -> None:
+    """Refresh exchange rates now and then every FX_REFRESH_HOURS on the application's JobQueue."""
+    if application.job_queue is None:
+        logger.warning(
+            "JobQueue is not available, exchange rates won't be refreshed. Install python-telegram-bot[job-queue]."
+        )
+        # conversions would otherwise treat every currency as dollars
+        save_fx_rates({currency: rate for currency, rate in FIXTURE_RATES.items() if currency not in get_fx_rates()})
+        return
+    application.job_queue.run_repeating(
+        refresh_fx_rates, interval=FX_REFRESH_HOURS * 3600, first=0, name="fx_rates"
+    )
+
+async def currency_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the user's home currency, or change it to the one given."""
+    user_id = update.effective_user.id
+    home_currency = get_home_currency(user_id)
+    if not context.args:
+        await update.message.reply_text(
+            f"💱 Your home currency is {home_currency}. Budgets, goals and totals are shown in it, expenses in "
+            "another currency are converted at the latest rate.\n\n"
+            f"Change it with /currency EUR. Supported: {', '.join(CURRENCIES)}\n"
+            "Add an expense in another currency like: coffee 4.50 EUR"
+        )
+        return
+
+    currency = parse_currency(context.args[0])
+    if currency is None:
+        await update.message.reply_text(f"❌ I don't know that currency. Supported: {', '.join(CURRENCIES)}")
+        return
+    if currency == home_currency:
+        await update.message.reply_text(f"Your home currency already is {currency}.")
+        return
+
+    rates = get_fx_rates()
+    if currency not in rates:
+        await update.message.reply_text(f"❌ There is no exchange rate for {currency} yet, please try again later.")
+        return
+    set_home_currency(user_id, currency)
+    one_unit = format_money(minor_per_unit(home_currency), home_currency)
+    converted = format_money(to_minor(rates.get(home_currency, 1.0) / rates[currency], currency), currency)
+    await update.message.reply_text(
+        f"✅ Your home currency is now {currency}. Your budgets and goals were converted at {one_unit} = {converted}."
+    )
+
+def get_currency_handler() -> CommandHandler:
+    """Create and return the currency command handler."""
+    return CommandHandler("currency", currency_command)
@@ -1,25 +1,57 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from database import add_goal, get_user_goals, update_goal_progress, complete_goal, delete_goal
+from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters
+from database import add_goal, get_user_goals, add_goal_contribution, complete_goal, delete_goal, get_goal_page, get_home_currency
+from currency import format_money, parse_minor
+from analytics import goal_projections
 from objects import ConversationState
+from callbacks import callback_router, encode
+from keyboards import PaginatedKeyboard
 from datetime import datetime
 
 # States for the goal conversation
 GOAL_NAME, GOAL_AMOUNT, GOAL_DEADLINE, GOAL_CATEGORY = range(4)
 
+# Callback actions of the goal buttons, see callbacks.py
+GOAL_NEW = "gn"
+GOAL_PICK_UPDATE, GOAL_PICK_COMPLETE, GOAL_PICK_DELETE = "gpu", "gpc", "gpd" # ask which goal
+GOAL_UPDATE, GOAL_COMPLETE, GOAL_DELETE = "gu", "gc", "gd" # with the goal id
+GOAL_PAGE = "gpg"
+
+# the menu buttons that ask the user to pick a goal: (action of the goal buttons, prompt, reply without goals)
+PICK_GOAL = {
+    GOAL_PICK_UPDATE: (GOAL_UPDATE, "Select a goal to update its progress:", "You don't have any active goals to update."),
+    GOAL_PICK_COMPLETE: (GOAL_COMPLETE, "Select a goal to mark as completed:", "You don't have any active goals to complete."),
+    GOAL_PICK_DELETE: (GOAL_DELETE, "Select a goal to delete:", "You don't have any active goals to delete."),
+}
+
+def _goal_label(goal) -> str:
+    _, name, target, current, currency = goal
+    progress = (current / target) * 100 if target > 0 else 0
+    return f"{name} ({format_money(current, currency)}/{format_money(target, currency)} - {progress:.1f}%)"
+
+goal_keyboard = PaginatedKeyboard(GOAL_PAGE, (GOAL_UPDATE, GOAL_COMPLETE, GOAL_DELETE), get_goal_page, _goal_label)
+
 async def goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the goal tracking conversation."""
     # Get user's active goals
-    goals = get_user_goals(update.effective_user.id)
+    user_id = update.effective_user.id
+    goals = get_user_goals(user_id)
     
     if goals:
+        projections = {p.goal_id: p for p in goal_projections(user_id)}
+        currency = get_home_currency(user_id)
         # Show existing goals
         text = "🎯 Your current financial goals:\n\n"
         for goal_id, name, target, current, deadline, category, status in goals:
             progress = (current / target) * 100 if target > 0 else 0
             text += f"• {name}\n"
-            text += f"  Target: ${target:.2f}\n"
-            text += f"  Current: ${current:.2f} ({progress:.1f}%)\n"
+            text += f"  Target: {format_money(target, currency)}\n"
+            text += f"  Current: {format_money(current, currency)} ({progress:.1f}%)\n"
+            projection = projections.get(goal_id)
+            if projection and projection.eta_days:
+                text += f"  Pace: {format_money(projection.daily_rate, currency)}/day, reached in about {projection.eta_days} days\n"
+            if projection and projection.trend is not None:
+                text += f"  Trend: {projection.trend * 100:+.0f}% vs the previous period\n"
             if deadline:
                 text += f"  Deadline: {deadline}\n"
             if category:
@@ -28,10 +60,10 @@ async def goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         
         # Add buttons for actions
         keyboard = [
-            [InlineKeyboardButton("➕ New Goal", callback_data="new_goal")],
-            [InlineKeyboardButton("📊 Update Progress", callback_data="update_progress")],
-            [InlineKeyboardButton("✅ Complete Goal", callback_data="complete_goal")],
-            [InlineKeyboardButton("❌ Delete Goal", callback_data="delete_goal")]
+            [InlineKeyboardButton("➕ New Goal", callback_data=encode(user_id, GOAL_NEW))],
+            [InlineKeyboardButton("📊 Update Progress", callback_data=encode(user_id, GOAL_PICK_UPDATE))],
+            [InlineKeyboardButton("✅ Complete Goal", callback_data=encode(user_id, GOAL_PICK_COMPLETE))],
+            [InlineKeyboardButton("❌ Delete Goal", callback_data=encode(user_id, GOAL_PICK_DELETE))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -46,132 +78,98 @@ async def goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return ConversationHandler.END
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle button callbacks for goal actions."""
+async def new_goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Start creating a goal from the menu."""
     query = update.callback_query
     await query.answer()
-    
-    if query.data == "new_goal":
-        await query.edit_message_text(
-            "🎯 Let's set a new financial goal!\n\n"
-            "What would you like to name your goal?"
-        )
-        return GOAL_NAME
-    
-    elif query.data == "update_progress":
-        goals = get_user_goals(update.effective_user.id)
-        if not goals:
-            await query.edit_message_text("You don't have any active goals to update.")
-            return ConversationHandler.END
-        
-        keyboard = []
-        for goal_id, name, target, current, _, _, _ in goals:
-            progress = (current / target) * 100 if target > 0 else 0
-            keyboard.append([InlineKeyboardButton(
-                f"{name} (${current:.2f}/${target:.2f} - {progress:.1f}%)",
-                callback_data=f"update_{goal_id}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "Select a goal to update its progress:",
-            reply_markup=reply_markup
-        )
-        return GOAL_NAME  # We'll handle the update in the next callback
-    
-    elif query.data == "complete_goal":
-        goals = get_user_goals(update.effective_user.id)
-        if not goals:
-            await query.edit_message_text("You don't have any active goals to complete.")
-            return ConversationHandler.END
-        
-        keyboard = []
-        for goal_id, name, target, current, _, _, _ in goals:
-            progress = (current / target) * 100 if target > 0 else 0
-            keyboard.append([InlineKeyboardButton(
-                f"{name} (${current:.2f}/${target:.2f} - {progress:.1f}%)",
-                callback_data=f"complete_{goal_id}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "Select a goal to mark as completed:",
-            reply_markup=reply_markup
-        )
-        return GOAL_NAME  # We'll handle the completion in the next callback
-    
-    elif query.data == "delete_goal":
-        goals = get_user_goals(update.effective_user.id)
-        if not goals:
-            await query.edit_message_text("You don't have any active goals to delete.")
+    await query.edit_message_text(
+        "🎯 Let's set a new financial goal!\n\n"
+        "What would you like to name your goal?"
+    )
+    return GOAL_NAME
+
+def _pick_goal(menu_action: str):
+    async def pick_goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Show the first page of goals for the menu button that was pressed."""
+        query = update.callback_query
+        await query.answer()
+        action, prompt, empty = PICK_GOAL[menu_action]
+        reply_markup = goal_keyboard.render(update.effective_user.id, action)
+        if reply_markup is None:
+            await query.edit_message_text(empty)
             return ConversationHandler.END
         
-        keyboard = []
-        for goal_id, name, target, current, _, _, _ in goals:
-            progress = (current / target) * 100 if target > 0 else 0
-            keyboard.append([InlineKeyboardButton(
-                f"{name} (${current:.2f}/${target:.2f} - {progress:.1f}%)",
-                callback_data=f"delete_{goal_id}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "Select a goal to delete:",
-            reply_markup=reply_markup
-        )
-        return GOAL_NAME  # We'll handle the deletion in the next callback
-    
-    elif query.data.startswith("update_"):
-        goal_id = int(query.data.split("_")[1])
-        context.user_data['update_goal_id'] = goal_id
-        await query.edit_message_text(
-            "Enter the amount to add to your goal progress:"
-        )
-        return GOAL_AMOUNT
-    
-    elif query.data.startswith("complete_"):
-        goal_id = int(query.data.split("_")[1])
-        complete_goal(goal_id)
-        await query.edit_message_text("✅ Goal marked as completed!")
+        await query.edit_message_text(prompt, reply_markup=reply_markup)
+        return GOAL_NAME  # We'll handle the picked goal in the next callback
+    return pick_goal
+
+async def goal_page(update: Update, context: ContextTypes.DEFAULT_TYPE, action_index: int, direction: int, cursor: int) -> int:
+    """Show another page of goals."""
+    if not await goal_keyboard.turn_page(update, action_index, direction, cursor):
         return ConversationHandler.END
-    
-    elif query.data.startswith("delete_"):
-        goal_id = int(query.data.split("_")[1])
-        delete_goal(goal_id)
-        await query.edit_message_text("🗑️ Goal deleted successfully!")
+    return GOAL_NAME
+
+async def pick_goal_to_update(update: Update, context: ContextTypes.DEFAULT_TYPE, goal_id: int) -> int:
+    """Ask how much to add to the picked goal."""
+    query = update.callback_query
+    await query.answer()
+    context.user_data['update_goal_id'] = goal_id
+    await query.edit_message_text(
+        "Enter the amount to add to your goal progress:"
+    )
+    return GOAL_AMOUNT
+
+async def complete_picked_goal(update: Update, context: ContextTypes.DEFAULT_TYPE, goal_id: int) -> int:
+    """Mark the picked goal as completed."""
+    query = update.callback_query
+    await query.answer()
+    if not complete_goal(update.effective_user.id, goal_id):
+        await query.edit_message_text("❌ That goal doesn't exist anymore.")
         return ConversationHandler.END
-    
+    await query.edit_message_text("✅ Goal marked as completed!")
+    return ConversationHandler.END
+
+async def delete_picked_goal(update: Update, context: ContextTypes.DEFAULT_TYPE, goal_id: int) -> int:
+    """Delete the picked goal."""
+    query = update.callback_query
+    await query.answer()
+    if not delete_goal(update.effective_user.id, goal_id):
+        await query.edit_message_text("❌ That goal doesn't exist anymore.")
+        return ConversationHandler.END
+    await query.edit_message_text("🗑️ Goal deleted successfully!")
     return ConversationHandler.END
 
 async def goal_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the goal name."""
-    if update.callback_query:
-        # Handle goal update amount
-        try:
-            amount = float(update.callback_query.message.text)
-            goal_id = context.user_data.get('update_goal_id')
-            if goal_id:
-                update_goal_progress(goal_id, amount)
-                await update.callback_query.edit_message_text(
-                    f"✅ Added ${amount:.2f} to your goal progress!"
-                )
-                return ConversationHandler.END
-        except ValueError:
-            await update.callback_query.edit_message_text(
-                "❌ Please enter a valid number."
-            )
-            return GOAL_AMOUNT
-    else:
-        context.user_data['goal_name'] = update.message.text
-        await update.message.reply_text(
-            "💰 What's your target amount? (e.g., 1000.00):"
-        )
+    context.user_data['goal_name'] = update.message.text
+    await update.message.reply_text(
+        "💰 What's your target amount? (e.g., 1000.00):"
+    )
+    return GOAL_AMOUNT
+
+async def goal_contribution(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle the amount to add to the goal picked from the Update Progress list."""
+    # goals are kept in minor units of the home currency
+    currency = get_home_currency(update.effective_user.id)
+    try:
+        amount = parse_minor(update.message.text, currency)
+    except ValueError:
+        await update.message.reply_text("❌ Please enter a valid number, like 1000 or 25.50 (without thousands separators).")
         return GOAL_AMOUNT
+    
+    goal_id = context.user_data.pop('update_goal_id')
+    if add_goal_contribution(update.effective_user.id, goal_id, amount):
+        await update.message.reply_text(f"✅ Added {format_money(amount, currency)} to your goal progress!")
+    else:
+        await update.message.reply_text("❌ That goal doesn't exist anymore.")
+    return ConversationHandler.END
 
 async def goal_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle the goal amount."""
+    if 'update_goal_id' in context.user_data:
+        return await goal_contribution(update, context)
     try:
-        amount = float(update.message.text)
+        amount = parse_minor(update.message.text, get_home_currency(update.effective_user.id))
         if amount <= 0:
             await update.message.reply_text("❌ Please enter a positive amount.")
             return GOAL_AMOUNT
@@ -183,7 +181,7 @@ async def goal_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         return GOAL_DEADLINE
     except ValueError:
-        await update.message.reply_text("❌ Please enter a valid number.")
+        await update.message.reply_text("❌ Please enter a valid number, like 1000 or 25.50 (without thousands separators).")
         return GOAL_AMOUNT
 
 async def goal_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -231,7 +229,7 @@ async def goal_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     await update.message.reply_text(
         "✅ Goal created successfully!\n\n"
         f"Name: {goal_name}\n"
-        f"Target: ${goal_amount:.2f}\n"
+        f"Target: {format_money(goal_amount, get_home_currency(update.effective_user.id))}\n"
         f"Deadline: {goal_deadline if goal_deadline else 'Not set'}\n"
         f"Category: {category if category else 'Not set'}"
     )
@@ -243,18 +241,31 @@ async def cancel_goal(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     await update.message.reply_text("❌ Goal creation cancelled.")
     return ConversationHandler.END
 
+callback_router.register(GOAL_NEW, new_goal)
+for menu_action in PICK_GOAL:
+    callback_router.register(menu_action, _pick_goal(menu_action))
+callback_router.register(GOAL_PAGE, goal_page)
+callback_router.register(GOAL_UPDATE, pick_goal_to_update)
+callback_router.register(GOAL_COMPLETE, complete_picked_goal)
+callback_router.register(GOAL_DELETE, delete_picked_goal)
+
 def get_goal_conversation_handler() -> ConversationHandler:
     """Get the goal conversation handler."""
+    menu_buttons = callback_router.handler(GOAL_NEW, *PICK_GOAL, GOAL_PAGE, GOAL_UPDATE, GOAL_COMPLETE, GOAL_DELETE)
     return ConversationHandler(
-        entry_points=[CommandHandler("goal", goal)],
+        entry_points=[
+            CommandHandler("goal", goal),
+            # the menu /goal shows for existing goals ends the conversation, so its buttons have to start it again
+            menu_buttons
+        ],
         states={
             GOAL_NAME: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, goal_name),
-                CallbackQueryHandler(button_callback)
+                menu_buttons
             ],
             GOAL_AMOUNT: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, goal_amount),
-                CallbackQueryHandler(button_callback)
+                menu_buttons
             ],
             GOAL_DEADLINE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, goal_deadline),
@@ -266,4 +277,4 @@ def get_goal_conversation_handler() -> ConversationHandler:
             ]
         },
         fallbacks=[CommandHandler("cancel", cancel_goal)]
-    ) 
\ No newline at end of file
+    )
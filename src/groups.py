@@ -0,0 +1,269 @@
+import heapq
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from telegram import Chat, InlineKeyboardButton, InlineKeyboardMarkup, Update, User
+from telegram.ext import CommandHandler, ContextTypes, MessageHandler, filters
+
+from budgetperiods import PERIODS, window_at
+from callbacks import callback_router, encode
+from currency import format_money, parse_minor, to_minor
+from database import (
+    add_group_expense, add_group_payments, delete_group_budget, get_group, get_group_balances,
+    get_group_budget_spend, get_group_members, get_home_currency, save_group, save_group_member, set_group_budget
+)
+from intents import parse_expense
+
+logger = logging.getLogger(__name__)
+
+# Shared ledgers for group chats the bot is in:
+#   /gexpense pizza 42.50 - the sender paid for the group, the amount is split evenly between the group's members
+#   /gbudget Groceries 300 weekly - a shared budget, /gbudget alone shows how each one is doing
+#   /settle - who owes whom, as the fewest payments that even everyone out; members who are owed money get a button
+#   to confirm they received their payments, nobody can mark payments to someone else as made
+# A group's ledger is in one currency, the home currency of whoever added the bot.
+# Members come from chat member updates (see chattracker.py) and from everyone who writes in the group, Telegram only
+# sends updates about other members to bots that are administrators. They're kept in the group_members table and
+# cached here per group, so splitting an expense never calls get_chat_administrators or reads the table again.
+
+MAX_CACHED_GROUPS = 1000
+DEFAULT_GROUP_PERIOD = "monthly"
+GROUP_SETTLE = "gs" # with the group's last expense id and last payment id the payments were computed from
+
+class GroupMemberCache:
+    def __init__(self, max_entries: int = MAX_CACHED_GROUPS):
+        self.max_entries = max_entries
+        self._groups: "OrderedDict[int, Dict[int, str]]" = OrderedDict() # chat id -> {user id: name}
+
+    def get(self, chat_id: int) -> Dict[int, str]:
+        """{user_id: name} of the group's current members, read from the database the first time."""
+        members = self._groups.get(chat_id)
+        if members is not None:
+            self._groups.move_to_end(chat_id)
+            return members
+        members = self._groups[chat_id] = get_group_members(chat_id)
+        while len(self._groups) > self.max_entries:
+            self._groups.popitem(last=False) # least recently used
+        return members
+
+    def joined(self, chat_id: int, user: User) -> None:
+        """Record a member, only written to the database when they're new to the group or changed their name."""
+        if user.is_bot:
+            return
+        members = self.get(chat_id)
+        if members.get(user.id) != user.full_name:
+            save_group_member(chat_id, user.id, user.full_name)
+            members[user.id] = user.full_name
+
+    def left(self, chat_id: int, user: User) -> None:
+        """Record that a member left, what they owe or are owed stays on the ledger."""
+        if self.get(chat_id).pop(user.id, None) is not None:
+            save_group_member(chat_id, user.id, user.full_name, active=False)
+
+    def forget(self, chat_id: int) -> None:
+        self._groups.pop(chat_id, None)
+
+group_members = GroupMemberCache()
+
+def settle_up(balances: Dict[int, int]) -> List[Tuple[int, int, int]]:
+    """The payments (from_user, to_user, amount) that bring every balance to zero.
+
+    Balances are what each member is owed (positive) or owes (negative) in minor units and add up to zero. Minimum
+    cash flow: the member who owes most pays the one who is owed most as much as they can, which evens out at least
+    one of them with every payment, so n members need at most n - 1 payments. Two heaps make it O(n log n).
+    """
+    creditors = [(-amount, user_id) for user_id, amount in balances.items() if amount > 0]
+    debtors = [(amount, user_id) for user_id, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    payments = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        payments.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return payments
+
+def _group_currency(chat: Chat, user: User) -> str:
+    """The group's ledger currency, registering groups the bot was added to before group ledgers existed."""
+    group = get_group(chat.id)
+    if group is None:
+        currency = get_home_currency(user.id)
+        save_group(chat.id, chat.title, currency)
+        return currency
+    return group[1]
+
+async def note_group_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Pick up members from the messages of a group, including the "joined" and "left" service messages."""
+    chat_id = update.effective_chat.id
+    message = update.effective_message
+    if message is not None:
+        for user in message.new_chat_members or ():
+            group_members.joined(chat_id, user)
+        if message.left_chat_member is not None:
+            group_members.left(chat_id, message.left_chat_member)
+            return
+    if update.effective_user is not None:
+        group_members.joined(chat_id, update.effective_user)
+
+def _budget_line(budget, currency: str) -> str:
+    category, amount, period, start_date, end_date, spent = budget
+    status = "✅" if spent <= amount else "⚠️"
+    return (
+        f"{status} {category}: {format_money(spent, currency)} of {format_money(amount, currency)} "
+        f"({spent / amount * 100:.0f}%) {period}, until {end_date}"
+    )
+
+async def group_expense_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Record an expense the sender paid for the group, split evenly between its members."""
+    chat, user = update.effective_chat, update.effective_user
+    currency = _group_currency(chat, user)
+    budgets = get_group_budget_spend(chat.id)
+    expense = parse_expense(
+        " ".join(context.args or []), [budget[0] for budget in budgets], require_known_category=False
+    )
+    if expense is None:
+        await update.message.reply_text(
+            "Tell me what you paid for the group, like /gexpense pizza 42.50 or /gexpense taxi 30 eur yesterday"
+        )
+        return
+
+    group_members.joined(chat.id, user) # the member handler only sees this message after the commands
+    members = group_members.get(chat.id)
+    expense_currency = expense.currency or currency
+    _, amount = add_group_expense(
+        chat.id, user.id, to_minor(expense.amount, expense_currency), expense.category, expense.description,
+        list(members), expense_currency, expense.date
+    )
+    text = (
+        f"🧾 {user.first_name} paid {format_money(amount, currency)} for {expense.description} "
+        f"({expense.category})"
+    )
+    if len(members) > 1:
+        share = format_money(amount / len(members), currency)
+        text += f", split between {len(members)} members: about {share} each."
+    else:
+        text += ".\nI only know you in this group so far, members are picked up as they write here."
+    for budget in get_group_budget_spend(chat.id):
+        if budget[0].casefold() == expense.category.casefold():
+            text += "\n\n" + _budget_line(budget, currency)
+    await update.message.reply_text(text)
+
+async def group_budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the group's budgets, or set one: /gbudget <category> <amount> [period], /gbudget <category> off."""
+    chat = update.effective_chat
+    currency = _group_currency(chat, update.effective_user)
+    args = list(context.args or [])
+    if not args:
+        budgets = get_group_budget_spend(chat.id)
+        if not budgets:
+            await update.message.reply_text(
+                "This group has no shared budgets yet. Set one with /gbudget Groceries 300 weekly"
+            )
+            return
+        await update.message.reply_text(
+            "👥 Group budgets:\n\n" + "\n".join(_budget_line(budget, currency) for budget in budgets)
+        )
+        return
+
+    if len(args) >= 2 and args[-1].lower() == "off":
+        category = " ".join(args[:-1])
+        if delete_group_budget(chat.id, category):
+            await update.message.reply_text(f"🗑️ Removed the {category} budget.")
+        else:
+            await update.message.reply_text(f"There is no {category} budget in this group.")
+        return
+
+    period = args.pop().lower() if args[-1].lower() in PERIODS else DEFAULT_GROUP_PERIOD
+    try:
+        amount = parse_minor(args.pop(), currency) if len(args) >= 2 else 0
+    except ValueError:
+        amount = 0
+    if amount <= 0:
+        await update.message.reply_text(
+            f"Usage: /gbudget <category> <amount> [{'|'.join(PERIODS)}], e.g. /gbudget Groceries 300 weekly"
+        )
+        return
+    category = " ".join(args)
+    today = datetime.utcnow().date()
+    set_group_budget(chat.id, category, amount, period, today.isoformat())
+    window = window_at(period, today, today)
+    await update.message.reply_text(
+        f"✅ Group budget for {category}: {format_money(amount, currency)} {period}, "
+        f"current period {window.start} to {window.end}."
+    )
+
+def _settlement_text(chat_id: int, currency: str):
+    """The balances and payments text of a group, with the payments and the ledger version they were computed from."""
+    balances, version = get_group_balances(chat_id)
+    if not balances:
+        return "🤝 Everyone in this group is even.", [], version
+    names = get_group_members(chat_id, include_inactive=True)
+    payments = settle_up(balances)
+    lines = ["💸 Balances:"]
+    for user_id, balance in sorted(balances.items(), key=lambda item: item[1], reverse=True):
+        name = names.get(user_id, str(user_id))
+        if balance > 0:
+            lines.append(f"• {name} is owed {format_money(balance, currency)}")
+        else:
+            lines.append(f"• {name} owes {format_money(-balance, currency)}")
+    lines += ["", f"To settle up ({len(payments)} payment{'s' if len(payments) != 1 else ''}):"]
+    for from_user, to_user, amount in payments:
+        lines.append(
+            f"• {names.get(from_user, str(from_user))} pays {names.get(to_user, str(to_user))} "
+            f"{format_money(amount, currency)}"
+        )
+    return "\n".join(lines), payments, version
+
+async def settle_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show who owes whom in the group and the fewest payments that settle it."""
+    chat, user = update.effective_chat, update.effective_user
+    text, payments, version = _settlement_text(chat.id, _group_currency(chat, user))
+    reply_markup = None
+    if any(to_user == user.id for _, to_user, _ in payments):
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+            "✅ I received my payments", callback_data=encode(user.id, GROUP_SETTLE, *version)
+        )]])
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def mark_settled(update: Update, context: ContextTypes.DEFAULT_TYPE, last_expense_id: int,
+                       last_payment_id: int) -> None:
+    """Record the payments of a /settle message to the member who ran it as made, unless the ledger changed since."""
+    query = update.callback_query
+    await query.answer()
+    chat_id, user = update.effective_chat.id, update.effective_user
+    balances, version = get_group_balances(chat_id)
+    # only the payee can confirm a payment, so nobody marks what they or others owe as paid
+    received = [payment for payment in settle_up(balances) if payment[1] == user.id]
+    if version != (last_expense_id, last_payment_id) or not add_group_payments(chat_id, received, version):
+        await query.edit_message_text("Something was added since these balances were worked out, run /settle again.")
+        return
+    logger.info(f"User {user.id} received {len(received)} payments in group {chat_id}")
+    names = get_group_members(chat_id, include_inactive=True)
+    currency = _group_currency(update.effective_chat, user)
+    lines = [f"✅ {user.first_name} received:"] + [
+        f"• {format_money(amount, currency)} from {names.get(from_user, str(from_user))}"
+        for from_user, _, amount in received
+    ]
+    await query.edit_message_text(f"{query.message.text}\n\n" + "\n".join(lines))
+
+callback_router.register(GROUP_SETTLE, mark_settled)
+
+def get_group_handlers():
+    """Get the group ledger commands and the settle button, they only work in group chats."""
+    return [
+        CommandHandler("gexpense", group_expense_command, filters=filters.ChatType.GROUPS),
+        CommandHandler("gbudget", group_budget_command, filters=filters.ChatType.GROUPS),
+        CommandHandler("settle", settle_command, filters=filters.ChatType.GROUPS),
+        callback_router.handler(GROUP_SETTLE),
+    ]
+
+def get_group_member_handler() -> MessageHandler:
+    """A handler that notes who writes in group chats, register it in its own handler group so it sees every message."""
+    return MessageHandler(filters.ChatType.GROUPS, note_group_member)
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_QUEUED_UPDATES = 100 # above this many waiting updates the bot is falling behind and shouldn't get more traffic
+MAX_UPDATE_WAIT = 10.0 # seconds an update may wait for a handler, see penny_webhook_processing_lag_seconds
+
+class ProbeResult(NamedTuple):
+    ok: bool
+    detail: str
+    duration_ms: float
+    checked_at: float # time.monotonic() of when the check actually ran
+
+class Probe:
+    """A dependency check whose result is cached for `ttl` seconds, so /readyz can be polled every second.
+
+    Concurrent callers share a single in-flight check instead of each hitting the dependency.
+    """
+
+    def __init__(self, name: str, check: Callable[[], Awaitable[str]], ttl: float, timeout: float = 2.0):
+        self.name = name
+        self._check = check
+        self.ttl = ttl
+        self.timeout = timeout
+        self._result: Optional[ProbeResult] = None
+        self._inflight: Optional[asyncio.Task] = None
+
+    async def run(self) -> ProbeResult:
+        now = time.monotonic()
+        if self._result is not None and now - self._result.checked_at < self.ttl:
+            return self._result
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._execute())
+        # shield so a client disconnecting from /readyz doesn't cancel the check for everyone else
+        return await asyncio.shield(self._inflight)
+
+    async def _execute(self) -> ProbeResult:
+        start = time.monotonic()
+        try:
+            detail = await asyncio.wait_for(self._check(), timeout=self.timeout)
+            ok = True
+        except asyncio.TimeoutError:
+            ok, detail = False, f"timed out after {self.timeout}s"
+        except Exception as e:
+            ok, detail = False, str(e) or e.__class__.__name__
+        end = time.monotonic()
+        self._result = ProbeResult(ok, detail, round((end - start) * 1000, 2), end)
+        if not ok:
+            logger.warning(f"Readiness probe {self.name} failed: {detail}")
+        return self._result
+
+def _sqlite_write_test() -> str:
+    # BEGIN IMMEDIATE takes the write lock without writing anything, so a locked database fails here
+    conn = database.get_connection()
+    conn.isolation_level = None
+    try:
+        conn.execute("PRAGMA busy_timeout = 1000")
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ROLLBACK")
+    except sqlite3.OperationalError as e:
+        raise RuntimeError(f"database is not writable: {e}")
+    finally:
+        conn.close()
+    return "write lock acquired"
+
+async def check_database() -> str:
+    """The SQLite database accepts writes."""
+    return await asyncio.to_thread(_sqlite_write_test)
+
+async def check_oneshot_token() -> str:
+    """We can authenticate against the 1Shot API."""
+    from oneshot import get_oneshot_client
+    token = await get_oneshot_client()._get_token()
+    if not token:
+        raise RuntimeError("1Shot API returned no bearer token")
+    return "bearer token is valid"
+
+def make_webhook_check(application, expected_url: str) -> Callable[[], Awaitable[str]]:
+    async def check_webhook() -> str:
+        """Telegram still has our webhook registered and isn't reporting delivery errors."""
+        info = await application.bot.get_webhook_info()
+        if info.url != expected_url:
+            raise RuntimeError(f"webhook is registered to '{info.url or 'nothing'}' instead of '{expected_url}'")
+        if info.last_error_message:
+            return f"registered, last delivery error: {info.last_error_message}"
+        return f"registered, {info.pending_update_count} pending updates"
+    return check_webhook
+
+def make_update_queue_check(application) -> Callable[[], Awaitable[str]]:
+    async def check_update_queue() -> str:
+        """The PTB application is running and keeping up with incoming updates."""
+        if not application.running:
+            raise RuntimeError("telegram application is not running")
+        depth = application.update_queue.qsize()
+        if depth > MAX_QUEUED_UPDATES:
+            raise RuntimeError(f"{depth} updates waiting in the update queue")
+        # a few updates can still be too many when handlers are stuck, so how long the oldest waits counts too
+        wait = metrics.oldest_update_wait()
+        if wait > MAX_UPDATE_WAIT:
+            raise RuntimeError(f"oldest update has been waiting {wait:.1f}s for a handler")
+        return f"{depth} updates queued, oldest waiting {wait:.1f}s"
+    return check_update_queue
+
+class ReadinessChecker:
+    """Runs all readiness probes concurrently and reports per-check results and timings."""
+
+    def __init__(self, probes: List[Probe]):
+        self.probes = probes
+
+    async def check(self) -> Dict:
+        results = await asyncio.gather(*(probe.run() for probe in self.probes))
+        now = time.monotonic()
+        checks = {
+            probe.name: {
+                "ok": result.ok,
+                "detail": result.detail,
+                "duration_ms": result.duration_ms,
+                "age_s": round(now - result.checked_at, 2),
+            }
+            for probe, result in zip(self.probes, results)
+        }
+        return {"ready": all(result.ok for result in results), "checks": checks}
+
+def build_readiness_checker(application, webhook_url: str) -> ReadinessChecker:
+    """Set up the probes /readyz runs; the TTLs reflect how expensive each dependency is to ask."""
+    return ReadinessChecker([
+        Probe("database", check_database, ttl=5),
+        Probe("oneshot_token", check_oneshot_token, ttl=60, timeout=5),
+        Probe("telegram_webhook", make_webhook_check(application, webhook_url), ttl=30, timeout=5),
+        Probe("update_queue", make_update_queue_check(application), ttl=1),
+    ])
@@ -1,7 +1,9 @@
 import os
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import add_user, get_user_expenses, get_user_goals, get_budget_progress
+from database import add_user, get_user_expenses, get_user_goals, get_budget_progress, get_home_currency
+from currency import format_money
+from usercontext import user_context_cache
 
 async def hello(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a greeting message with user's financial summary."""
@@ -13,6 +15,8 @@ async def hello(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         # Add user to database
         add_user(user_id, username)
+        # a chat often follows, have the AI chat context ready by then
+        user_context_cache.prewarm(user_id)
 
         # Get user's recent expenses
         expenses = get_user_expenses(user_id, limit=3)
@@ -20,8 +24,9 @@ async def hello(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         # Get user's active goals
         goals = get_user_goals(user_id)
         
-        # Get user's budget progress
+        # Get user's budget progress, in their home currency
         budget_progress = get_budget_progress(user_id)
+        home_currency = get_home_currency(user_id)
         
         # Build the message
         text = f"👋 Hi {user.first_name}! I'm Penny, your personal financial assistant!\n\n"
@@ -35,15 +40,15 @@ async def hello(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 remaining = total_budget - total_spent
                 progress = (total_spent / total_budget) * 100
                 text += "💰 Budget Summary:\n"
-                text += f"• Total Budget: ${total_budget:.2f}\n"
-                text += f"• Spent: ${total_spent:.2f} ({progress:.1f}%)\n"
-                text += f"• Remaining: ${remaining:.2f}\n\n"
+                text += f"• Total Budget: {format_money(total_budget, home_currency)}\n"
+                text += f"• Spent: {format_money(total_spent, home_currency)} ({progress:.1f}%)\n"
+                text += f"• Remaining: {format_money(remaining, home_currency)}\n\n"
         
         # Add recent expenses if available
         if expenses:
             text += "📊 Your recent expenses:\n"
-            for amount, category, description, date, payment_method in expenses:
-                text += f"• ${amount:.2f} - {category}"
+            for amount, category, description, date, payment_method, currency in expenses:
+                text += f"• {format_money(amount, currency)} - {category}"
                 if description:
                     text += f" ({description})"
                 text += f"\n"
@@ -54,7 +59,7 @@ async def hello(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             text += "🎯 Active Goals:\n"
             for _, name, target, current, _, _, _ in goals:
                 progress = (current / target) * 100 if target > 0 else 0
-                text += f"• {name}: ${current:.2f}/${target:.2f} ({progress:.1f}%)\n"
+                text += f"• {name}: {format_money(current, home_currency)}/{format_money(target, home_currency)} ({progress:.1f}%)\n"
             text += "\n"
         
         text += "I can help you with:\n"
@@ -69,7 +74,8 @@ async def hello(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         text += "• Listing transaction endpoints (/endpoints)\n"
         text += "• Transferring tokens (/tokentransfer)\n"
         text += "• Showing escrow wallet info (/myescrowinfo)\n"
-        text += "• Checking current time (/time)\n\n"
+        text += "• Checking current time (/time)\n"
+        text += "• Choosing the currency your totals are in (/currency)\n\n"
         text += "Just let me know what you need help with! 💰"
 
         await update.message.reply_text(text)
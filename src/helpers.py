@@ -2,18 +2,19 @@ from telegram import Chat, Update
 from telegram.ext import ContextTypes, ConversationHandler
 from decimal import Decimal, ROUND_DOWN
 
-from oneshot import (
-    oneshot_client,
-    BUSINESS_ID
-)
-
 from objects import ConversationState
 
 import re
 import os
 from typing import Dict, Any
 
-CALLBACK_URL = os.getenv("TUNNEL_BASE_URL") + "/1shot"
+# read lazily so importing helpers doesn't crash when TUNNEL_BASE_URL isn't set (e.g. in tests or tools)
+def get_callback_url() -> str:
+    """Returns the url 1Shot API should send transaction webhooks to."""
+    base_url = os.getenv("TUNNEL_BASE_URL")
+    if not base_url:
+        raise RuntimeError("TUNNEL_BASE_URL must be set to register 1Shot webhook callbacks")
+    return base_url + "/1shot"
 
 # Python doesn't have a built-in BigInt type, so we use a string to represent large integers
 def convert_to_wei(amount: str, decimals: int = 18) -> str:
@@ -88,7 +89,7 @@ def get_token_deployer_endpoint_creation_payload(chain_id: str, contract_address
         "name": f"1Shot Demo Sepolia Token Deployer",
         "description": f"This deploys ERC20 tokens on the Sepolia testnet.",
         "functionName": "deployToken",
-        "callbackUrl": f"{CALLBACK_URL}",
+        "callbackUrl": get_callback_url(),
         "stateMutability": "nonpayable",
         "inputs": [
             {
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# importaudit.py
+#
+# Summarizes what importing a module costs, like `python -X importtime` but readable:
+#
+#   python importaudit.py main
+#   python importaudit.py aichat --top 15
+#
+# It runs the import in a fresh interpreter so nothing is cached, then reports the total wall time,
+# the slowest modules by self and cumulative time, and the cost rolled up per top-level package.
+
+import argparse
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, NamedTuple
+
+# lines look like: "import time:       312 |        845 |   telegram._bot"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+class ImportTiming(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+def measure_imports(module: str, python: str = sys.executable) -> List[ImportTiming]:
+    """Import a module in a fresh interpreter with -X importtime and parse the timings."""
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            # importtime indents nested imports by two spaces per level
+            timings.append(ImportTiming(name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return _subtree(timings, module)
+
+def _subtree(timings: List[ImportTiming], module: str) -> List[ImportTiming]:
+    """Keep only the audited module and what it pulled in, dropping interpreter startup imports."""
+    # importtime prints children before their parent, so the subtree is the run of nested lines right before the module
+    for index in range(len(timings) - 1, -1, -1):
+        if timings[index].depth == 0 and timings[index].module == module:
+            start = index
+            while start > 0 and timings[start - 1].depth > 0:
+                start -= 1
+            return timings[start:index + 1]
+    return timings
+
+def summarize_by_package(timings: List[ImportTiming]) -> Dict[str, int]:
+    """Roll self time up into the top-level package each module belongs to."""
+    packages = defaultdict(int)
+    for timing in timings:
+        packages[timing.module.split(".")[0]] += timing.self_us
+    return dict(packages)
+
+def format_report(module: str, timings: List[ImportTiming], top: int = 10) -> str:
+    """Render a plain text summary of the import timings."""
+    total_us = sum(timing.self_us for timing in timings) or 1
+    lines = [
+        f"Import audit for '{module}'",
+        f"Total: {total_us / 1000:.1f} ms across {len(timings)} modules",
+        "",
+        f"Top {top} packages by self time:",
+    ]
+    packages = sorted(summarize_by_package(timings).items(), key=lambda item: item[1], reverse=True)
+    for name, self_us in packages[:top]:
+        lines.append(f"  {self_us / 1000:8.1f} ms  {100 * self_us / total_us:5.1f}%  {name}")
+
+    lines += ["", f"Top {top} modules by self time:"]
+    for timing in sorted(timings, key=lambda t: t.self_us, reverse=True)[:top]:
+        lines.append(f"  {timing.self_us / 1000:8.1f} ms  {timing.module}")
+
+    # direct imports of the audited module are the ones we can actually defer
+    lines += ["", f"Top {top} direct imports by cumulative time:"]
+    direct = [timing for timing in timings if timing.depth == 1]
+    for timing in sorted(direct, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        lines.append(f"  {timing.cumulative_us / 1000:8.1f} ms  {timing.module}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the import cost of a module.")
+    parser.add_argument("module", nargs="?", default="main", help="module to import, e.g. main or aichat")
+    parser.add_argument("--top", type=int, default=10, help="how many entries to show per section")
+    args = parser.parse_args()
+
+    print(format_report(args.module, measure_imports(args.module), args.top))
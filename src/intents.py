@@ -0,0 +1,275 @@
+import math
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from currency import parse_currency
+
+# A local parser for chat messages that are really commands in disguise, so they don't cost an LLM round trip:
+#   - expenses ("I spent 12 on coffee", "lunch 14.50, uber 22, groceries 63 yesterday") are recognized by rules
+#     and regexes, which also pull out the amount, a category, a description and the date of each item
+#   - questions about the user's own numbers ("how much did I spend this month", "how are my goals") go through a
+#     small naive Bayes classifier trained on the example phrases below
+# Anything the parser isn't confident about returns None and goes to the LLM as before.
+
+ADD_EXPENSE = "add_expense"
+SPENDING_SUMMARY = "spending_summary"
+BUDGET_STATUS = "budget_status"
+GOAL_STATUS = "goal_status"
+WALLET_BALANCE = "wallet_balance"
+OTHER = "other" # open-ended, for the LLM
+
+class ParsedExpense(NamedTuple):
+    amount: Decimal # as typed, turned into minor units with currency.to_minor once the currency is known
+    category: str
+    description: str
+    date: Optional[str] = None # "YYYY-MM-DD HH:MM:SS" like the expenses table, None for now
+    currency: Optional[str] = None # a code from currency.py, None for the user's home currency
+
+class Intent(NamedTuple):
+    name: str
+    confidence: float
+    expenses: Tuple[ParsedExpense, ...] = () # for ADD_EXPENSE
+
+# an amount with an optional currency symbol before or a symbol, code or name after it ("$12", "12 eur", "0.002 btc")
+CURRENCY_SYMBOL = r"[$€£¥₹₿]"
+CURRENCY_WORD = (
+    rf"{CURRENCY_SYMBOL}|usd|eur|gbp|jpy|chf|cad|aud|inr|brl|mxn|btc|eth|usdc"
+    r"|dollars?|bucks|euros?|pounds?|yen|rupees|bitcoin|ether"
+)
+# "1,200" and "1,200.50" have thousands separators, otherwise a comma is a decimal comma ("4,50")
+THOUSANDS = r"\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?"
+AMOUNT = (
+    rf"(?:(?P<symbol>{CURRENCY_SYMBOL})\s*)?(?P<amount>{THOUSANDS}|\d{{1,7}}(?:[.,]\d{{1,2}}|\.\d{{3,8}})?)"
+    rf"(?:\s*(?P<code>{CURRENCY_WORD})(?![a-z]))?"
+)
+EXPENSE_PATTERNS = [
+    # "I spent 12 on coffee", "spent $4.50 at starbucks", "paid 30 for an uber"
+    re.compile(rf"^(?:i\s+)?(?:just\s+)?(?:spent|paid|dropped)\s+{AMOUNT}\s+(?:on|for|at)\s+(?P<description>.+)$"),
+    # "I bought coffee for 4.50", "got groceries for $62"
+    re.compile(rf"^(?:i\s+)?(?:just\s+)?(?:bought|got|purchased)\s+(?P<description>.+?)\s+for\s+{AMOUNT}$"),
+    # "coffee 4.50", "$12 lunch", "12 on lunch"
+    re.compile(rf"^(?:(?:spent|paid)\s+)?(?P<description>[a-z][a-z '&-]{{1,30}}?)\s+{AMOUNT}$"),
+    re.compile(rf"^{AMOUNT}\s+(?:on\s+|for\s+)?(?P<description>[a-z][a-z '&-]{{1,30}})$"),
+]
+
+# a message starting with one of these is a question ("how much was coffee 4.50", "should i buy a laptop for 1000")
+QUESTION_WORDS = {
+    "how", "what", "whats", "when", "where", "why", "who", "which", "should", "would", "could", "can", "is", "are",
+    "was", "were", "do", "does", "did", "will", "shall", "may", "might", "am",
+}
+# a bare "coffee 4.50" names what was bought in a few words, a verb makes it a sentence ("my rent is 1200")
+MAX_BARE_DESCRIPTION_WORDS = 3
+SENTENCE_WORDS = {
+    "i", "you", "we", "it", "is", "was", "are", "were", "be", "been", "worth", "cost", "costs", "should", "would",
+    "could", "can", "will", "buy", "pay", "spend", "save", "need", "want", "owe", "think",
+}
+
+# items in a message like "lunch 14.50, uber 22; groceries 63" (a comma followed by a digit is a decimal comma)
+ITEM_SEPARATOR = re.compile(r"\s*(?:;|\n|,(?!\d)|\band\b)\s*")
+MAX_ITEMS = 20
+
+WEEKDAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+DATE_PATTERN = re.compile(
+    r"\s*\b(?:(?P<relative>today|yesterday)"
+    r"|(?P<days>\d{1,3}) days? ago"
+    r"|(?:(?P<last>last)\s+|on\s+)?(?P<weekday>" + "|".join(WEEKDAY_NAMES) + r")"
+    r"|(?:on\s+)?(?P<iso>\d{4}-\d{2}-\d{2}))\b\s*"
+)
+
+# words in a description that point to one of the default subcategories from expense.py
+CATEGORY_KEYWORDS = {
+    "Coffee": ["coffee", "latte", "cappuccino", "espresso", "starbucks", "cafe"],
+    "Restaurant": ["lunch", "dinner", "breakfast", "restaurant", "brunch", "pizza", "sushi", "burger"],
+    "Groceries": ["groceries", "grocery", "supermarket", "food shopping"],
+    "Takeout": ["takeout", "takeaway", "delivery", "doordash", "ubereats"],
+    "Rent": ["rent"],
+    "Utilities": ["electricity", "water bill", "utilities", "power bill", "heating"],
+    "Gas": ["gas", "fuel", "petrol"],
+    "Public Transit": ["bus", "train", "metro", "subway", "uber", "lyft", "taxi", "tram"],
+    "Parking": ["parking"],
+    "Clothing": ["clothes", "shoes", "shirt", "jacket", "jeans", "dress"],
+    "Electronics": ["laptop", "headphones", "charger", "electronics"],
+    "Pharmacy": ["pharmacy", "medicine", "meds"],
+    "Fitness": ["gym", "yoga", "fitness"],
+    "Movies": ["movie", "movies", "cinema"],
+    "Games": ["game", "games", "steam"],
+    "Subscriptions": ["netflix", "spotify", "subscription", "youtube premium"],
+    "Books": ["book", "books", "kindle"],
+    "Flights": ["flight", "flights", "plane ticket"],
+    "Hotels": ["hotel", "airbnb", "hostel"],
+    "Phone": ["phone bill"],
+    "Internet": ["internet", "wifi"],
+}
+DEFAULT_CATEGORY = "Other"
+
+# training phrases for the query classifier, OTHER holds questions that look similar but need a real answer
+TRAINING_PHRASES: Dict[str, List[str]] = {
+    SPENDING_SUMMARY: [
+        "how much did i spend this month", "how much have i spent", "what did i spend this week",
+        "show my spending", "my expenses this month", "total spending", "what are my expenses",
+        "how much did i spend on food", "spending summary", "where did my money go",
+    ],
+    BUDGET_STATUS: [
+        "what's my balance", "how much budget do i have left", "am i over budget", "budget status",
+        "how is my budget", "how much can i still spend", "remaining budget", "what is left in my budget",
+        "show my balance", "my balance", "how much money do i have left",
+    ],
+    GOAL_STATUS: [
+        "how are my goals", "goal progress", "how close am i to my goal", "show my goals",
+        "how are my savings goals doing", "am i on track for my goal", "my goals",
+    ],
+    WALLET_BALANCE: [
+        "what's in my wallet", "how much eth do i have", "wallet balance", "check my eth",
+        "escrow wallet funds", "how much is in my wallet", "my crypto holdings", "show my wallet",
+    ],
+    OTHER: [
+        "how can i save more money", "should i invest in crypto", "what is a budget",
+        "how do i deploy a token", "give me tips to spend less on food", "what is an erc20 token",
+        "is it better to save or pay off debt", "explain how budgeting works", "hello how are you",
+        "what can you do", "how should i plan my goals", "why is my spending so high",
+        "what's a good savings rate", "thanks", "tell me a joke", "how much did i earn",
+        "how much did i make this month", "how much should i save",
+    ],
+}
+
+MIN_CONFIDENCE = 0.8
+MAX_QUERY_WORDS = 12 # longer messages are almost always open-ended
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower().replace("'", ""))
+
+def _features(text: str) -> List[str]:
+    words = _words(text)
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+class IntentClassifier:
+    """Multinomial naive Bayes over words and word pairs, small enough to train at import time."""
+
+    def __init__(self, phrases: Dict[str, Iterable[str]]):
+        self.counts: Dict[str, Counter] = {label: Counter() for label in phrases}
+        self.priors: Dict[str, float] = {}
+        total = sum(len(list(examples)) for examples in phrases.values())
+        for label, examples in phrases.items():
+            examples = list(examples)
+            self.priors[label] = math.log(len(examples) / total)
+            for example in examples:
+                self.counts[label].update(_features(example))
+        self.totals = {label: sum(counts.values()) for label, counts in self.counts.items()}
+        self.vocabulary = set().union(*self.counts.values())
+
+    def predict(self, text: str):
+        """Return (label, probability) of the most likely label."""
+        features = [feature for feature in _features(text) if feature in self.vocabulary]
+        if not features:
+            return OTHER, 1.0
+        scores = {}
+        for label, counts in self.counts.items():
+            denominator = self.totals[label] + len(self.vocabulary)
+            scores[label] = self.priors[label] + sum(math.log((counts[f] + 1) / denominator) for f in features)
+        best = max(scores, key=scores.get)
+        # softmax over the log scores
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+classifier = IntentClassifier(TRAINING_PHRASES)
+
+def categorize(description: str, user_categories: Iterable[str] = ()) -> str:
+    """Pick a category for an expense description, preferring categories the user already uses."""
+    text = description.lower()
+    for category in user_categories:
+        if category and re.search(rf"\b{re.escape(category.lower())}\b", text):
+            return category
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(re.search(rf"\b{re.escape(keyword)}\b", text) for keyword in keywords):
+            return category
+    return DEFAULT_CATEGORY
+
+def extract_date(text: str, now: Optional[datetime] = None) -> Tuple[str, Optional[str]]:
+    """Remove a date expression ("yesterday", "3 days ago", "last friday", "2024-05-01") from an item.
+
+    Returns the remaining text and the date in the expenses table's format, None if there was no date.
+    """
+    match = DATE_PATTERN.search(text)
+    if not match:
+        return text, None
+    now = now or datetime.utcnow()
+    if match.group("relative"):
+        date = now - timedelta(days=1 if match.group("relative") == "yesterday" else 0)
+    elif match.group("days"):
+        date = now - timedelta(days=int(match.group("days")))
+    elif match.group("weekday"):
+        days_back = (now.weekday() - WEEKDAY_NAMES.index(match.group("weekday"))) % 7
+        if days_back == 0 and match.group("last"):
+            days_back = 7
+        date = now - timedelta(days=days_back)
+    else:
+        try:
+            date = datetime.strptime(match.group("iso"), "%Y-%m-%d").replace(hour=12)
+        except ValueError:
+            return text, None
+    if date > now:
+        return text, None
+    remaining = (text[:match.start()] + " " + text[match.end():]).strip()
+    return remaining, date.strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_expense(text: str, user_categories: Iterable[str] = (), require_known_category: bool = True,
+                  now: Optional[datetime] = None) -> Optional[ParsedExpense]:
+    """Parse a single expense item, None if it doesn't look like one."""
+    normalized = re.sub(r"\s+", " ", text.strip().lower()).rstrip(".!")
+    if "?" in normalized or _words(normalized)[:1] and _words(normalized)[0] in QUESTION_WORDS:
+        return None
+    normalized, date = extract_date(normalized, now)
+    for pattern in EXPENSE_PATTERNS:
+        match = pattern.match(normalized)
+        if not match:
+            continue
+        amount = match.group("amount")
+        amount = Decimal(amount.replace(",", "") if re.fullmatch(THOUSANDS, amount) else amount.replace(",", "."))
+        if amount <= 0:
+            return None
+        description = re.sub(r"^(?:an?|the|some|my)\s+", "", match.group("description").strip())
+        category = categorize(description, user_categories)
+        if pattern in (EXPENSE_PATTERNS[2], EXPENSE_PATTERNS[3]):
+            words = _words(description)
+            if len(words) > MAX_BARE_DESCRIPTION_WORDS or SENTENCE_WORDS.intersection(words):
+                return None
+            # a bare "word amount" message only counts when the word is a known category
+            if require_known_category and category == DEFAULT_CATEGORY:
+                return None
+        marker = match.group("symbol") or match.group("code")
+        return ParsedExpense(amount, category, description, date, parse_currency(marker) if marker else None)
+    return None
+
+def parse_expenses(text: str, user_categories: Iterable[str] = (), require_known_category: bool = True,
+                   now: Optional[datetime] = None) -> List[ParsedExpense]:
+    """Parse a message with one or more expenses, empty unless every item in it is an expense.
+
+    In a list of several amounts the message is clearly about expenses, so items with an unknown word are kept
+    under the default category instead of rejecting the whole message. Pass require_known_category=False when the
+    user explicitly asked to add expenses, e.g. with /expense, to do the same for a single item.
+    """
+    user_categories = list(user_categories)
+    items = [item for item in ITEM_SEPARATOR.split(text.strip()) if item]
+    if 1 < len(items) <= MAX_ITEMS:
+        expenses = [parse_expense(item, user_categories, require_known_category=False, now=now) for item in items]
+        if all(expenses):
+            return expenses
+    # not a list after all, e.g. "fish and chips 12"
+    expense = parse_expense(text, user_categories, require_known_category, now)
+    return [expense] if expense else []
+
+def parse_intent(text: str, user_categories: Iterable[str] = ()) -> Optional[Intent]:
+    """Recognize a message the bot can act on without the LLM, None if it should go to the LLM."""
+    expenses = parse_expenses(text, user_categories)
+    if expenses:
+        return Intent(ADD_EXPENSE, 1.0, tuple(expenses))
+
+    if len(_words(text)) > MAX_QUERY_WORDS:
+        return None
+    label, confidence = classifier.predict(text)
+    if label == OTHER or confidence < MIN_CONFIDENCE:
+        return None
+    return Intent(label, confidence)
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+
+from callbacks import encode
+from database import add_write_listener, get_data_version
+from metrics import KEYBOARD_CACHE_REQUESTS
+
+# Inline keyboards for picking one of a user's budgets or goals, a page at a time:
+#   - pages are read with keyset pagination on the row id (see database._page), so a tap on "Next" costs one
+#     indexed query for PAGE_SIZE + 1 rows however many rows the user has
+#   - item buttons are callbacks.encode(user, item action, row id), page buttons encode the page action with the
+#     index of the item action, the direction (NEXT after or PREVIOUS before the id) and the id
+#   - rendered pages are cached per user together with the user's data version (see database.py), a page
+#     from another version is never shown, and they're dropped right away on writes we're told about
+
+PAGE_SIZE = 8
+MAX_CACHED_USERS = 2000
+NEXT, PREVIOUS = 0, 1
+
+class PaginatedKeyboard:
+    def __init__(self, page_action: str, item_actions: Sequence[str], fetch_page: Callable,
+                 label: Callable[[Sequence], str], page_size: int = PAGE_SIZE):
+        """fetch_page(user_id, after_id=, before_id=, limit=) returns up to limit + 1 rows with the id first,
+        label turns a row into its button text. The module owning the keyboard routes page_action to turn_page."""
+        self.page_action = page_action
+        self.item_actions = tuple(item_actions)
+        self.fetch_page = fetch_page
+        self.label = label
+        self.page_size = page_size
+        # user id -> (data version, {(action, direction, cursor): page})
+        self._pages: "OrderedDict[int, Tuple[int, Dict[Tuple, Optional[InlineKeyboardMarkup]]]]" = OrderedDict()
+        add_write_listener(self.invalidate)
+
+    def render(self, user_id: int, action: str, direction: int = NEXT, cursor: int = 0) -> Optional[InlineKeyboardMarkup]:
+        """The page of buttons for an item action, None if the user has nothing to pick from."""
+        key = (action, direction, cursor)
+        version = get_data_version(user_id)
+        cached = self._pages.get(user_id)
+        if cached is None or cached[0] != version:
+            cached = self._pages[user_id] = (version, {})
+        pages = cached[1]
+        self._pages.move_to_end(user_id)
+        if key in pages:
+            KEYBOARD_CACHE_REQUESTS.labels(self.page_action, "hit").inc()
+            return pages[key]
+        KEYBOARD_CACHE_REQUESTS.labels(self.page_action, "miss").inc()
+
+        markup = pages[key] = self._build(user_id, action, direction, cursor)
+        while len(self._pages) > MAX_CACHED_USERS:
+            self._pages.popitem(last=False) # least recently used
+        return markup
+
+    async def turn_page(self, update: Update, action_index: int, direction: int, cursor: int) -> bool:
+        """Show the page a page button points to, returns False if there is nothing left to show."""
+        query = update.callback_query
+        await query.answer()
+        if action_index >= len(self.item_actions):
+            return False
+        reply_markup = self.render(update.effective_user.id, self.item_actions[action_index], direction, cursor)
+        if reply_markup is None:
+            await query.edit_message_text("There is nothing left to pick from here.")
+            return False
+        await query.edit_message_reply_markup(reply_markup)
+        return True
+
+    def invalidate(self, user_id: int) -> None:
+        self._pages.pop(user_id, None)
+
+    def _build(self, user_id: int, action: str, direction: int, cursor: int) -> Optional[InlineKeyboardMarkup]:
+        if direction == PREVIOUS:
+            rows = self.fetch_page(user_id, before_id=cursor, limit=self.page_size)
+            has_previous = len(rows) > self.page_size
+            rows = rows[-self.page_size:]
+            has_next = True
+        else:
+            rows = self.fetch_page(user_id, after_id=cursor, limit=self.page_size)
+            has_next = len(rows) > self.page_size
+            rows = rows[:self.page_size]
+            has_previous = cursor > 0
+        if not rows:
+            return None
+
+        keyboard = [[InlineKeyboardButton(self.label(row), callback_data=encode(user_id, action, row[0]))] for row in rows]
+        action_index = self.item_actions.index(action)
+        navigation = []
+        if has_previous:
+            navigation.append(InlineKeyboardButton(
+                "◀️ Previous", callback_data=encode(user_id, self.page_action, action_index, PREVIOUS, rows[0][0])
+            ))
+        if has_next:
+            navigation.append(InlineKeyboardButton(
+                "Next ▶️", callback_data=encode(user_id, self.page_action, action_index, NEXT, rows[-1][0])
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        return InlineKeyboardMarkup(keyboard)
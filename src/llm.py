@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+from importlib.util import find_spec
+from typing import AsyncIterator, Dict, List, NamedTuple
+
+from metrics import track_call
+
+logger = logging.getLogger(__name__)
+
+# One gateway for every language model call the bot makes:
+#   - a single AsyncOpenAI client, and with it a single pooled HTTP connection pool, shared by chat and reports
+#   - routes pick the model, timeout, retry count and sampling settings per use: a small fast model for chat,
+#     a larger one for reports
+#   - LLM_BACKEND=mock answers locally without network access, for tests, benchmarks and offline development
+# Callers only see LLMError, never the backend's own exception types.
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai").lower()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+MOCK_LATENCY = float(os.getenv("LLM_MOCK_LATENCY", "0.05")) # seconds per streamed chunk
+
+class Route(NamedTuple):
+    model: str
+    timeout: float # seconds for the whole request
+    max_retries: int # on connection errors, 429s and 5xx responses, with exponential backoff
+    max_tokens: int
+    temperature: float = 0.7
+    top_p: float = 0.95
+
+ROUTES: Dict[str, Route] = {
+    "chat": Route(model=os.getenv("LLM_CHAT_MODEL", "gpt-4o-mini"), timeout=20.0, max_retries=1, max_tokens=500),
+    "report": Route(model=os.getenv("LLM_REPORT_MODEL", "gpt-4o"), timeout=60.0, max_retries=3, max_tokens=1000),
+}
+
+class LLMError(Exception):
+    """A completion failed after its retries, or the backend isn't configured."""
+
+class OpenAIBackend:
+    name = "openai"
+
+    def __init__(self):
+        self._client = None
+
+    def _get_client(self):
+        # openai is a heavy import, it is only loaded and the client only built when the first completion is requested
+        if self._client is None:
+            if not OPENAI_API_KEY:
+                raise LLMError("OPENAI_API_KEY is not set")
+            import httpx
+            import openai
+            self._client = openai.AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+                ),
+            )
+        return self._client
+
+    def _request(self, route: Route, messages: List[Dict[str, str]], **kwargs):
+        client = self._get_client().with_options(timeout=route.timeout, max_retries=route.max_retries)
+        return client.chat.completions.create(
+            model=route.model,
+            messages=messages,
+            max_tokens=route.max_tokens,
+            temperature=route.temperature,
+            top_p=route.top_p,
+            **kwargs
+        )
+
+    async def complete(self, route: Route, messages: List[Dict[str, str]]) -> str:
+        import openai
+        try:
+            response = await self._request(route, messages)
+        except openai.OpenAIError as e:
+            raise LLMError(str(e)) from e
+        return response.choices[0].message.content or ""
+
+    async def stream(self, route: Route, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        import openai
+        try:
+            stream = await self._request(route, messages, stream=True)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except openai.OpenAIError as e:
+            raise LLMError(str(e)) from e
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+class MockBackend:
+    """Answers without a network call: the reply names the route and echoes the last message."""
+    name = "mock"
+
+    def __init__(self, latency: float = MOCK_LATENCY):
+        self.latency = latency
+
+    def _reply(self, route: Route, messages: List[Dict[str, str]]) -> str:
+        return f"[mock {route.model}] You said: {messages[-1]['content'][:200]}"
+
+    async def complete(self, route: Route, messages: List[Dict[str, str]]) -> str:
+        await asyncio.sleep(self.latency)
+        return self._reply(route, messages)
+
+    async def stream(self, route: Route, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        for word in self._reply(route, messages).split(" "):
+            await asyncio.sleep(self.latency)
+            yield word + " "
+
+    async def aclose(self) -> None:
+        pass
+
+class LLMGateway:
+    def __init__(self, backend, routes: Dict[str, Route] = ROUTES):
+        self.backend = backend
+        self.routes = routes
+
+    def _route(self, name: str) -> Route:
+        try:
+            return self.routes[name]
+        except KeyError:
+            raise ValueError(f"Unknown LLM route: {name}")
+
+    async def complete(self, route: str, messages: List[Dict[str, str]]) -> str:
+        """Return the full completion for `messages` using the model and limits of the given route."""
+        async with track_call(self.backend.name, route):
+            return await self.backend.complete(self._route(route), messages)
+
+    async def stream(self, route: str, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """Yield the completion's text as it is generated."""
+        async with track_call(self.backend.name, f"{route}_stream"):
+            async for delta in self.backend.stream(self._route(route), messages):
+                yield delta
+
+    async def aclose(self) -> None:
+        """Close the backend's connection pool, called on shutdown."""
+        await self.backend.aclose()
+
+def _create_backend():
+    if LLM_BACKEND == "mock":
+        return MockBackend()
+    if LLM_BACKEND != "openai":
+        logger.error(f"Unknown LLM_BACKEND '{LLM_BACKEND}', using openai")
+    return OpenAIBackend()
+
+# whether completions can work at all, checked without importing openai
+LLM_AVAILABLE = LLM_BACKEND == "mock" or (find_spec("openai") is not None and bool(OPENAI_API_KEY))
+if not LLM_AVAILABLE:
+    logger.error("OpenAI module or OPENAI_API_KEY not found. AI chat and AI reports will not be available.")
+
+llm = LLMGateway(_create_backend())
@@ -0,0 +1,146 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Logging is set up once from main.py:
+#   - records are put on a queue by the handler attached to the root logger, a QueueListener thread formats
+#     and writes them, so string formatting and stdout I/O never block the event loop
+#   - LOG_FORMAT=json (default) writes one JSON object per line, LOG_FORMAT=text keeps the classic format
+#   - LOG_SAMPLING="httpx=0.1,aichat=0.5" keeps only that fraction of DEBUG/INFO records for those loggers
+#   - secrets (bot token, 1Shot credentials, OpenAI key, bearer tokens) are redacted before anything is written
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+SECRET_ENV_VARS = ("TELEGRAM_BOT_TOKEN", "ONESHOT_API_KEY", "ONESHOT_API_SECRET", "OPENAI_API_KEY", "CALLBACK_SECRET")
+REDACTED = "[REDACTED]"
+
+SECRET_PATTERNS = [
+    re.compile(r"(?i)(bearer\s+)[A-Za-z0-9\-_\.=]+"),
+    re.compile(r"\b\d{6,12}:[A-Za-z0-9_-]{30,}\b"), # Telegram bot tokens, also embedded in api.telegram.org urls
+    re.compile(r"\bsk-[A-Za-z0-9_-]{16,}\b"), # OpenAI keys
+    re.compile(r"(?i)((?:api[_-]?key|api[_-]?secret|token|password)[\"']?\s*[:=]\s*[\"']?)[^\s\"',}]+"),
+]
+
+# attributes every LogRecord has, anything else was passed with extra={...} and goes into the JSON output
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object, including anything passed through `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+class RedactingFormatter(logging.Formatter):
+    """Wraps another formatter and scrubs secrets from its output."""
+
+    def __init__(self, inner: logging.Formatter):
+        super().__init__()
+        self.inner = inner
+        # exact values of the configured secrets catch formats the patterns don't know about
+        self.secrets = [value for value in (os.getenv(name) for name in SECRET_ENV_VARS) if value and len(value) >= 8]
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(self.inner.format(record), self.secrets)
+
+def redact(text: str, secrets=()) -> str:
+    """Replace known secret values and secret-looking substrings with a placeholder."""
+    for secret in secrets:
+        text = text.replace(secret, REDACTED)
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(lambda match: (match.group(1) if match.groups() else "") + REDACTED, text)
+    return text
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of low-severity records for high-volume loggers; warnings and errors always pass."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, Optional[float]] = {}
+
+    def _rate_for(self, name: str) -> Optional[float]:
+        if name not in self._cache:
+            # the most specific configured prefix wins, so "telegram.ext" can override "telegram"
+            matches = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + ".")]
+            self._cache[name] = self.rates[max(matches, key=len)] if matches else None
+        return self._cache[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        return rate is None or random.random() < rate
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stock QueueHandler formats the message in the calling thread so records can be pickled, which we don't
+    need for an in-process queue.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """Parse "logger=rate,logger=rate" into a dict, ignoring malformed entries."""
+    rates = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = entry.partition("=")
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            logger.warning(f"Ignoring invalid LOG_SAMPLING entry: {entry}")
+    return rates
+
+_listener: Optional[QueueListener] = None
+
+def setup_logging(level: int = logging.INFO) -> None:
+    """Route all logging through a queue to a background listener that formats, redacts and writes it."""
+    global _listener
+    if _listener is not None:
+        return
+
+    inner = JsonFormatter() if os.getenv("LOG_FORMAT", "json").lower() == "json" else logging.Formatter(TEXT_FORMAT)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(RedactingFormatter(inner))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # flush whatever is still queued when the interpreter exits
+    atexit.register(stop_logging)
+    # parsed once logging works, so a malformed entry is reported like any other warning
+    queue_handler.addFilter(SamplingFilter(parse_sampling(os.getenv("LOG_SAMPLING", ""))))
+
+def stop_logging() -> None:
+    """Stop the listener thread after it has written every queued record."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -3,15 +3,6 @@ import os
 import logging
 from http import HTTPStatus
 from contextlib import asynccontextmanager
-from checkbalance import check_balance
-from checktime import get_time
-from hello import hello
-from wallet import get_wallet_handler
-from transaction import get_transaction_handler
-from transactionendpoints import get_transaction_endpoints_handler
-from report import get_report_handler
-from escrowinfo import get_escrow_info_handler
-
 
 # useful object patterns for a Telegram bot that interacts with the 1Shot API
 from objects import (
@@ -26,29 +17,10 @@ from helpers import (
     get_token_deployer_endpoint_creation_payload
 )
 
-# this file shows how you can track what chats your bot has been added to
-from chattracker import track_chats
-
-# this file shows how you can implement a non-trivial conversation flow that deployes and ERC20 token
-from deploytoken import (
-    get_token_deployment_conversation_handler,
-    successful_token_deployment
-)
-
-# Auth against 1Shot API is done in oneshot.py where we implement a singleton pattern
-from oneshot import (
-    oneshot_client, # the 1Shot API async client that we instantiated in oneshot.py
-    BUSINESS_ID, # The organization id for your 1Shot API account
-    log_token
-)
-
-# the 1Shot Python SDK implements a helpful Pydantic dataclass model for Webhook callback payloads
-from uxly_1shot_client import WebhookPayload, verify_webhook
-
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import PlainTextResponse, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import (
     Application,
     ChatMemberHandler,
@@ -60,19 +32,19 @@ from telegram.ext import (
 )
 from telegram.constants import ParseMode
 
-import uvicorn
 from database import add_user
-from expense import get_expense_conversation_handler
-from goal import get_goal_conversation_handler
-from budget import get_budget_conversation_handler
-from tokentransfer import get_token_transfer_handler, token_transfer_success
-from aichat import get_ai_chat_handler
-
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-logging.getLogger("httpx").setLevel(logging.WARNING)
+from sender import message_scheduler, Priority, SchedulerRateLimiter
+from llm import llm
+from usercontext import user_context_cache
+import metrics
+from health import build_readiness_checker
+from logconfig import setup_logging
+
+# The feature modules (conversation flows, the 1Shot SDK, OpenAI, uvicorn) are imported where they are first used
+# instead of up here, so importing main.py stays cheap. Run `python importaudit.py main` to see what importing costs.
+
+# Enable logging, records are formatted and written off the event loop, see logconfig.py
+setup_logging()
 logger = logging.getLogger(__name__)
 
 URL = os.getenv("TUNNEL_BASE_URL") # this is the base url where Telegram will send update callbacks to
@@ -85,6 +57,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Register user in database
     user = update.effective_user
     add_user(user.id, user.username)
+    # build the AI chat context in the background now, so the user's first chat message doesn't wait for it
+    user_context_cache.prewarm(user.id)
 
     text = f"👋 Hi {user.first_name}! I'm Penny, your personal financial assistant!\n\n"
     text += "I can help you withhhh:\n"
@@ -113,10 +87,18 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "🤖 *Penny Bot Commands* 🤖\n\n"
         "Here are all the commands you can use:\n\n"
         "📊 *Finance Management*\n"
-        "• /expense - Track your expenses\n"
+        "• /expense - Track your expenses, or add several at once: /expense lunch 14.50, uber 22\n"
+        "• /expenses - Browse and search past expenses: /expenses coffee from:2024-01-01\n"
+        "• /export - Download all your data as CSV (or /export parquet)\n"
+        "• /currency - Choose the currency your totals are shown in\n"
         "• /budget - Set and manage budgets\n"
         "• /goal - Create financial goals\n"
-        "• /report - View spending reports\n\n"
+        "• /report - View spending reports\n"
+        "• /subscribe\\_report - Get a weekly report\n\n"
+        "👥 *Group Chats*\n"
+        "• /gexpense - Add an expense you paid for the group: /gexpense pizza 42.50\n"
+        "• /gbudget - Shared budgets: /gbudget Groceries 300 weekly\n"
+        "• /settle - See who owes whom and settle up\n\n"
         "💰 *Blockchain & Tokens*\n"
         "• /wallet - Check wallet balance\n"
         "• /checkbalance - Check token balances\n"
@@ -134,15 +116,18 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
 
 # This handles webhooks coming from 1Shot API
-async def webhook_update(update: WebhookPayload, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def webhook_update(update: "WebhookPayload", context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle incoming webhook updates."""
+    from deploytoken import successful_token_deployment
+    from tokentransfer import token_transfer_success
+
     # Extract the payload from the update
     event_type = update.event_name
 
     if event_type == "TransactionExecutionSuccess":
         # check for the Transaction Memo, if its not set, we don't know what to do with it
         if not update.data.transaction_execution_memo:
-            logger.error(f"TransactionMemo is null: {update.data.transaction_execution_id}")
+            logger.error("TransactionMemo is null: %s", update.data.transaction_execution_id)
             return
         
         tx_memo = TransactionMemo.model_validate_json(update.data.transaction_execution_memo)
@@ -163,23 +148,129 @@ async def webhook_update(update: WebhookPayload, context: ContextTypes.DEFAULT_T
             amount_readable = tx_memo.amount_readable if hasattr(tx_memo, 'amount_readable') and tx_memo.amount_readable else "an amount of"
             recipient_address = tx_memo.recipient_address if hasattr(tx_memo, 'recipient_address') and tx_memo.recipient_address else "the recipient"
             if chat_id:
-                await context.bot.send_message(
+                await message_scheduler.send_message(
+                    context.bot,
                     chat_id=chat_id,
                     text=f"✅ Native currency transfer successful!\nTransfer of {amount_readable} native currency to {recipient_address} confirmed.\nTransaction Hash: `{transaction_hash}`",
                     parse_mode=ParseMode.MARKDOWN
                 )
-            logger.info(f"Native currency transfer successful. Hash: {transaction_hash}, Memo: {tx_memo}")
+            logger.info("Native currency transfer successful. Hash: %s", transaction_hash, extra={"tx_type": tx_memo.tx_type.name, "user_id": tx_memo.associated_user_id})
         else:
             # implement other transaction types as needed
-            logger.error(f"Unknown transaction type: {tx_memo.tx_type}")
+            logger.error("Unknown transaction type: %s", tx_memo.tx_type)
+
+def register_handlers(application: Application) -> None:
+    """Import the feature modules and register their handlers on the application."""
+    from checkbalance import check_balance
+    from checktime import get_time
+    from hello import hello
+    from wallet import get_wallet_handler
+    from export import get_export_handler
+    from fxrates import get_currency_handler, schedule_fx_jobs
+    from transaction import get_transaction_handler
+    from transactionendpoints import get_transaction_endpoints_handler
+    from report import get_report_handler
+    from reportschedule import get_report_subscription_handlers, schedule_report_jobs
+    from budgetalerts import setup_budget_alerts
+    from escrowinfo import get_escrow_info_handler
+    # this file shows how you can track what chats your bot has been added to
+    from chattracker import track_chats, track_members
+    from groups import get_group_handlers, get_group_member_handler
+    # this file shows how you can implement a non-trivial conversation flow that deployes and ERC20 token
+    from deploytoken import get_token_deployment_conversation_handler
+    from expense import get_expense_conversation_handler, get_undo_expenses_handler
+    from expensebrowser import get_expense_browser_handlers
+    from goal import get_goal_conversation_handler
+    from budget import get_budget_conversation_handler
+    from tokentransfer import get_token_transfer_handler
+    from aichat import get_ai_chat_handler
+    # the 1Shot Python SDK implements a helpful Pydantic dataclass model for Webhook callback payloads
+    from uxly_1shot_client import WebhookPayload
+
+    # Here is where we register the functionality of our Telegram bot, starting with a ConversationHandler
+    # You can nest conversation flows inside each other for more complex applications: https://docs.python-telegram-bot.org/en/stable/examples.nestedconversationbot.html
+    entrypoint_handler = ConversationHandler(
+        entry_points=[CommandHandler("start", start)],
+        states={
+            ConversationState.START_ROUTES: [
+                CommandHandler("start", start),
+                CallbackQueryHandler(start, pattern="^start$"),
+            ],
+        },
+        fallbacks=[
+            CommandHandler("start", start),
+            CommandHandler("cancel", canceler)
+        ],
+        per_chat=True,
+        per_message=True
+    )
+
+    # handle when the user calls /start
+    application.add_handler(entrypoint_handler)
+
+    application.add_handler(CommandHandler("checkbalance", check_balance))
+    application.add_handler(CommandHandler("time", get_time))
+    application.add_handler(CommandHandler("hello", hello))
+    application.add_handler(CommandHandler("help", help_command))
+    # the undo button has to be matched before the conversation handlers, which take any callback query mid-flow
+    application.add_handler(get_undo_expenses_handler())
+    application.add_handlers(get_expense_browser_handlers())
+    application.add_handler(get_wallet_handler())
+    application.add_handler(get_export_handler())
+    application.add_handler(get_currency_handler())
+    application.add_handler(get_transaction_handler())
+    application.add_handler(get_transaction_endpoints_handler())
+    application.add_handler(get_expense_conversation_handler())
+    application.add_handler(get_goal_conversation_handler())
+    application.add_handler(get_budget_conversation_handler())
+    application.add_handler(get_token_deployment_conversation_handler())
+    application.add_handler(get_token_transfer_handler())
+    application.add_handler(get_report_handler())
+    application.add_handlers(get_report_subscription_handlers())
+    application.add_handlers(get_group_handlers())
+    application.add_handler(get_escrow_info_handler())
+    # handles updates from 1shot by selecting Telegram updates of type WebhookPayload
+    application.add_handler(TypeHandler(type=WebhookPayload, callback=webhook_update))
+
+    # track what chats the bot is in, can be useful for group-based features
+    application.add_handler(ChatMemberHandler(track_chats, ChatMemberHandler.MY_CHAT_MEMBER))
+    # and who is in the groups, for splitting shared expenses, see groups.py
+    application.add_handler(ChatMemberHandler(track_members, ChatMemberHandler.CHAT_MEMBER))
+    # in a handler group of its own so it sees group messages that a command or the AI chat also handles
+    application.add_handler(get_group_member_handler(), group=1)
+    
+    # Add AI chat handler to respond to non-command messages
+    # This should be added last so it doesn't interfere with other handlers
+    application.add_handler(get_ai_chat_handler())
+
+    # weekly reports are generated in an off-peak batch, see reportschedule.py
+    schedule_report_jobs(application)
+    # exchange rates for totals in the user's home currency, see fxrates.py
+    schedule_fx_jobs(application)
+    # budget threshold alerts are sent from wherever an expense gets recorded, see budgetalerts.py
+    setup_budget_alerts(application)
+
+    # group -1 runs before every other group, so this sees each update as soon as it leaves the update queue
+    application.add_handler(TypeHandler(type=object, callback=metrics.observe_update_lag), group=-1)
+    # time every handler callback registered above for the /metrics endpoint
+    metrics.time_handlers(application)
+
 
 # lifespane is used by FastAPI on startup and shutdown: https://fastapi.tiangolo.com/advanced/events/
 # When the server is shutting down, the code after "yield" will be executed when shutting down
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event to initialize and shutdown the Telegram bot."""
+    # Auth against 1Shot API is done in oneshot.py where we implement a singleton pattern
+    from oneshot import (
+        oneshot_client, # the 1Shot API async client that we instantiated in oneshot.py
+        BUSINESS_ID, # The organization id for your 1Shot API account
+        log_token
+    )
+
     app.application = (
-        Application.builder().token(TOKEN).updater(None).build()
+        # replies sent straight from handlers count against the same rate limits as the scheduler's messages
+        Application.builder().token(TOKEN).updater(None).rate_limiter(SchedulerRateLimiter(message_scheduler)).build()
     )
 
     # lets start by checking that we have an escrow wallet provisioned for our account on the Sepolia network
@@ -194,7 +285,7 @@ async def lifespan(app: FastAPI):
         logger.info("Escrow wallet is provisioned and has sufficient funds.")
 
     # Add this after the escrow wallet check but before the yield
-    await log_token()  # This will log the token
+    await log_token()  # This checks that we can authenticate against 1Shot API
 
     # to keep this demo self contained, we are going to check our 1Shot API account for an existing transaction endpoint for the 
     # contract at 0xA1BfEd6c6F1C3A516590edDAc7A8e359C2189A61 on the Sepolia network, if we don't have one, we'll create it automatically
@@ -219,58 +310,25 @@ async def lifespan(app: FastAPI):
     else:
         logger.info(f"Transaction endpoint already exists, skipping creation.")
         
-    # Here is where we register the functionality of our Telegram bot, starting with a ConversationHandler
-    # You can nest conversation flows inside each other for more complex applications: https://docs.python-telegram-bot.org/en/stable/examples.nestedconversationbot.html
-    entrypoint_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
-        states={
-            ConversationState.START_ROUTES: [
-                CommandHandler("start", start),
-                CallbackQueryHandler(start, pattern="^start$"),
-            ],
-        },
-        fallbacks=[
-            CommandHandler("start", start),
-            CommandHandler("cancel", canceler)
-        ],
-        per_chat=True,
-        per_message=True
-    )
-
-    # handle when the user calls /start
-    app.application.add_handler(entrypoint_handler)
-
-    app.application.add_handler(CommandHandler("checkbalance", check_balance))
-    app.application.add_handler(CommandHandler("time", get_time))
-    app.application.add_handler(CommandHandler("hello", hello))
-    app.application.add_handler(CommandHandler("help", help_command))
-    app.application.add_handler(get_wallet_handler())
-    app.application.add_handler(get_transaction_handler())
-    app.application.add_handler(get_transaction_endpoints_handler())
-    app.application.add_handler(get_expense_conversation_handler())
-    app.application.add_handler(get_goal_conversation_handler())
-    app.application.add_handler(get_budget_conversation_handler())
-    app.application.add_handler(get_token_deployment_conversation_handler())
-    app.application.add_handler(get_token_transfer_handler())
-    app.application.add_handler(get_report_handler())
-    app.application.add_handler(get_escrow_info_handler())
-    # handles updates from 1shot by selecting Telegram updates of type WebhookPayload
-    app.application.add_handler(TypeHandler(type=WebhookPayload, callback=webhook_update))
+    register_handlers(app.application)
 
-    # track what chats the bot is in, can be useful for group-based features
-    app.application.add_handler(ChatMemberHandler(track_chats, ChatMemberHandler.MY_CHAT_MEMBER))
-    
-    # Add AI chat handler to respond to non-command messages
-    # This should be added last so it doesn't interfere with other handlers
-    app.application.add_handler(get_ai_chat_handler())
+    # gauges are read when /metrics is scraped so they cost nothing on the hot path
+    metrics.UPDATE_QUEUE_DEPTH.set_function(app.application.update_queue.qsize)
+    for lane in Priority:
+        metrics.OUTBOUND_QUEUE_DEPTH.set_function(lambda lane=lane: message_scheduler.lane_depths()[lane.name.lower()], lane.name.lower())
 
     # TODO: use secret-token: https://docs.python-telegram-bot.org/en/stable/telegram.bot.html#telegram.Bot.set_webhook.params.secret_token
     await app.application.bot.set_webhook(url=f"{URL}/telegram", allowed_updates=Update.ALL_TYPES)
     await app.application.initialize()
     await app.application.start()
+    app.readiness = build_readiness_checker(app.application, f"{URL}/telegram")
 
     yield
     await app.application.stop()
+    # flush queued notifications before the bot goes away
+    await message_scheduler.stop()
+    # close the pooled connections to the model API
+    await llm.aclose()
 
 # FastAPI app
 app = FastAPI(lifespan=lifespan)
@@ -281,12 +339,16 @@ app = FastAPI(lifespan=lifespan)
 async def telegram(request: Request):
     data = await request.json()
     update = Update.de_json(data, app.application.bot)
+    metrics.mark_enqueued(update, "telegram")
     await app.application.update_queue.put(update)
     return Response(status_code=HTTPStatus.OK)
 
 # This route is for 1shot to send updates to the bot about transactions that the bot initiated
 @app.api_route("/1shot", methods=["POST"])
 async def oneshot_updates(request: Request):
+    from uxly_1shot_client import WebhookPayload, verify_webhook
+    from oneshot import oneshot_client, BUSINESS_ID
+
     try:
         body = await request.json()
         webhook_payload = WebhookPayload(**body)
@@ -318,10 +380,11 @@ async def oneshot_updates(request: Request):
 
         # we put objects of type WebhookPayload into the update queue
         # Updates will trigger the webhook_update handler via the TypeHandler registered on startup
+        metrics.mark_enqueued(webhook_payload, "oneshot")
         await app.application.update_queue.put(webhook_payload)
         return Response(status_code=HTTPStatus.OK)
     except Exception as e:
-        logger.error(f"Error processing 1Shot webhook: {e}")
+        logger.error("Error processing 1Shot webhook: %s", e)
         return Response(status_code=HTTPStatus.NOT_ACCEPTABLE)
 
 # This is a simple healthcheck endpoint to verify that the bot is running
@@ -329,5 +392,34 @@ async def oneshot_updates(request: Request):
 async def health():
     return PlainTextResponse("The bot is still running fine :)", status_code=HTTPStatus.OK)
 
+# Liveness only says the process and its event loop are responsive, orchestrators restart the container when it fails
+@app.get("/livez")
+async def livez():
+    return PlainTextResponse("ok", status_code=HTTPStatus.OK)
+
+# Readiness runs cached dependency probes (database, 1Shot auth, Telegram webhook, update queue) and returns 503 if any fail
+@app.get("/readyz")
+async def readyz():
+    readiness = getattr(app, "readiness", None)
+    if readiness is None:
+        return JSONResponse({"ready": False, "checks": {}, "detail": "bot is still starting"}, status_code=HTTPStatus.SERVICE_UNAVAILABLE)
+    result = await readiness.check()
+    return JSONResponse(result, status_code=HTTPStatus.OK if result["ready"] else HTTPStatus.SERVICE_UNAVAILABLE)
+
+# Prometheus scrape endpoint with handler latency, queue depths, webhook lag, SQLite timings and external call stats
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Reports how many outbound messages are waiting in each priority lane of the message scheduler
+@app.get("/sender")
+async def sender_status():
+    return {
+        "queue_depth": message_scheduler.queue_depth(),
+        "lanes": message_scheduler.lane_depths()
+    }
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=PORT, log_level="info")
+    import uvicorn
+    # log_config=None keeps uvicorn from installing its own handlers so its logs go through our queue as well
+    uvicorn.run("main:app", host="0.0.0.0", port=PORT, log_level="info", log_config=None)
@@ -0,0 +1,310 @@
+import functools
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A tiny Prometheus text-format registry. Most samples are recorded on the event loop, but database queries are also
+# timed in worker threads (chat context rebuilds, see usercontext.py), so every child has its own lock. Uncontended,
+# recording a sample is a dict lookup, a lock, a bisect and two additions.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+    suffix = "" # of the sample names, the HELP and TYPE lines use the same name so scrapers match them up
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock() # guards adding children, two threads must not both create one
+
+    def labels(self, *values):
+        """Returns the child metric for a label combination, creating it the first time it is seen."""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        name = self.name + self.suffix
+        lines = [f"# HELP {name} {self.documentation}", f"# TYPE {name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self.lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+class Counter(_Metric):
+    kind = "counter"
+    suffix = "_total"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self.suffix}{_format_labels(self.labelnames, values)} {child.value}"]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float], *values) -> None:
+        """Read the gauge from a callback at scrape time instead of updating it on the hot path."""
+        self._functions[tuple(str(value) for value in values)] = function
+
+    def render(self) -> List[str]:
+        for values, function in self._functions.items():
+            try:
+                self.labels(*values).set(function())
+            except Exception as e:
+                logger.error(f"Error reading gauge {self.name}: {e}")
+        return super().render()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        with child.lock: # a consistent snapshot, so _count matches the +Inf bucket
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        # counts are stored per bucket so observe() stays O(log n); Prometheus wants them cumulative
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_label = f'le="{le}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, bucket_label)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    "penny_handler_latency_seconds", "Time spent in each Telegram handler callback.", ["handler"]))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "penny_handler_errors", "Telegram handler callbacks that raised an exception.", ["handler"]))
+UPDATE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "penny_update_queue_depth", "Updates waiting in the python-telegram-bot update queue."))
+OUTBOUND_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "penny_outbound_queue_depth", "Messages waiting in the outbound message scheduler.", ["lane"]))
+UPDATE_LAG = REGISTRY.register(Histogram(
+    "penny_webhook_processing_lag_seconds", "Time between a webhook update being queued and a handler picking it up.", ["source"]))
+DB_QUERY_LATENCY = REGISTRY.register(Histogram(
+    "penny_db_query_seconds", "SQLite time per database.py function.", ["function"], buckets=QUERY_BUCKETS))
+EXTERNAL_CALL_LATENCY = REGISTRY.register(Histogram(
+    "penny_external_call_seconds", "Latency of calls to external services.", ["service", "operation"]))
+EXTERNAL_CALL_ERRORS = REGISTRY.register(Counter(
+    "penny_external_call_errors", "Calls to external services that raised an exception.", ["service", "operation"]))
+AI_FIRST_TOKEN_LATENCY = REGISTRY.register(Histogram(
+    "penny_ai_first_token_seconds", "Time from sending a streamed AI chat request to its first token."))
+AI_CACHE_REQUESTS = REGISTRY.register(Counter(
+    "penny_ai_cache_requests", "AI chat response cache lookups.", ["result"]))
+AI_CACHE_SECONDS_SAVED = REGISTRY.register(Counter(
+    "penny_ai_cache_seconds_saved", "Model generation time avoided by serving AI chat replies from the cache."))
+AI_PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "penny_ai_prompt_tokens", "Prompt size in tokens per AI call.", buckets=(100, 250, 500, 1000, 1500, 2000, 3000, 4000, 8000)))
+AI_ESTIMATED_COST = REGISTRY.register(Counter(
+    "penny_ai_estimated_cost_usd", "Estimated prompt cost of AI calls in USD."))
+USER_CONTEXT_CACHE_REQUESTS = REGISTRY.register(Counter(
+    "penny_user_context_cache_requests", "Lookups of the per-user financial snapshot used in AI chat prompts.", ["result"]))
+AI_LOCAL_INTENTS = REGISTRY.register(Counter(
+    "penny_ai_local_intents", "Chat messages answered by the local intent parser instead of the model.", ["intent"]))
+KEYBOARD_CACHE_REQUESTS = REGISTRY.register(Counter(
+    "penny_keyboard_cache_requests", "Lookups of rendered inline keyboard pages.", ["keyboard", "result"]))
+CALLBACK_QUERIES = REGISTRY.register(Counter(
+    "penny_callback_queries", "Inline button presses by action, and whether their callback data checked out.", ["action", "result"]))
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    return REGISTRY.render()
+
+# --- instrumentation helpers ---
+
+def timed_query(function):
+    """Decorator for database.py functions that records how long each call spends in SQLite."""
+    histogram = DB_QUERY_LATENCY.labels(function.__name__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+@asynccontextmanager
+async def track_call(service: str, operation: str):
+    """Time a call to an external service (OpenAI, 1Shot API) and count it as an error if it raises.
+
+    Cancellation (CancelledError, GeneratorExit from a closed stream) isn't the service failing and isn't counted.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_CALL_ERRORS.labels(service, operation).inc()
+        raise
+    finally:
+        EXTERNAL_CALL_LATENCY.labels(service, operation).observe(time.perf_counter() - start)
+
+def time_callback(callback, name: str):
+    """Wrap an async handler callback so its latency and errors are recorded under the given name."""
+    histogram = HANDLER_LATENCY.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    wrapper.__penny_timed__ = True
+    return wrapper
+
+def _leaf_handlers(handlers) -> Iterable:
+    """Walk handlers, descending into ConversationHandlers, and yield the ones that have callbacks."""
+    for handler in handlers:
+        nested = [getattr(handler, "entry_points", None), getattr(handler, "fallbacks", None)]
+        states = getattr(handler, "states", None)
+        if states:
+            nested.extend(states.values())
+        if any(nested):
+            for group in nested:
+                if group:
+                    yield from _leaf_handlers(group)
+        elif inspect.iscoroutinefunction(getattr(handler, "callback", None)):
+            yield handler
+
+def time_handlers(application) -> None:
+    """Wrap the callback of every registered handler so its latency ends up in penny_handler_latency_seconds.
+
+    Inline buttons all share CallbackRouter.dispatch, their routes are timed one by one when they're registered.
+    """
+    for group in application.handlers.values():
+        for handler in _leaf_handlers(group):
+            if not getattr(handler.callback, "__penny_timed__", False):
+                handler.callback = time_callback(handler.callback, handler.callback.__name__)
+
+# webhook updates are stamped when they enter the update queue and checked off when the first handler group sees them
+_enqueued_at: Dict[int, Tuple[str, float]] = {}
+
+def mark_enqueued(update: object, source: str) -> None:
+    """Remember when an update was put on the update queue."""
+    _enqueued_at[id(update)] = (source, time.monotonic())
+
+def oldest_update_wait() -> float:
+    """Seconds the longest waiting update has been in the queue without a handler seeing it, 0 if none is waiting."""
+    # entries are in the order updates were queued, so the first one left is the oldest
+    for _, enqueued in _enqueued_at.values():
+        return time.monotonic() - enqueued
+    return 0.0
+
+async def observe_update_lag(update: object, context) -> None:
+    """Handler for the first handler group that records how long the update waited in the queue."""
+    entry = _enqueued_at.pop(id(update), None)
+    if entry is not None:
+        source, enqueued = entry
+        UPDATE_LAG.labels(source).observe(time.monotonic() - enqueued)
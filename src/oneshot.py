@@ -1,10 +1,9 @@
 import os
 import logging
+import inspect
 
-from uxly_1shot_client import AsyncClient
+from metrics import track_call
 
-# Enable logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # its handy to set your API key and secret with environment variables so you only have to change them in one place (i.e. docker-compose.env)
@@ -15,14 +14,50 @@ BUSINESS_ID = os.getenv("ONESHOT_BUSINESS_ID")
 # import the the 1Shot API async client with your API key and secret from your 1Shot Org (https://docs.1shotapi.com/org-creation.html)  
 # its handy to instantiate it in a single location and import the singleton where you need it  
 # be sure to use the AsyncClient with asynchronous frameworks like FastAPI and python-telegram-bot       
-oneshot_client = AsyncClient(api_key=API_KEY, api_secret=API_SECRET)
+# the SDK is only imported and the client only built the first time someone actually needs it
+_oneshot_client = None
 
-# Function to log the token - can be called from an async context
+class _TimedClient:
+    """Wraps the SDK client so every API call shows up in the external call metrics as service="oneshot"."""
+
+    def __init__(self, target, prefix: str = ""):
+        self._target = target
+        self._prefix = prefix
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        operation = f"{self._prefix}{name}"
+        if inspect.iscoroutinefunction(attr):
+            async def timed(*args, **kwargs):
+                async with track_call("oneshot", operation):
+                    return await attr(*args, **kwargs)
+            return timed
+        # resource groups like client.wallets and client.transactions are wrapped too so their methods get timed
+        if not callable(attr) and type(attr).__module__.startswith("uxly_1shot_client"):
+            return _TimedClient(attr, f"{operation}.")
+        return attr
+
+def get_oneshot_client():
+    """Returns the shared 1Shot API async client, creating it on first use."""
+    global _oneshot_client
+    if _oneshot_client is None:
+        from uxly_1shot_client import AsyncClient
+        _oneshot_client = _TimedClient(AsyncClient(api_key=API_KEY, api_secret=API_SECRET))
+    return _oneshot_client
+
+# keeps `from oneshot import oneshot_client` working while still deferring client creation (PEP 562)
+def __getattr__(name: str):
+    if name == "oneshot_client":
+        return get_oneshot_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Function to check that we can get a bearer token - can be called from an async context
+# the token itself is a credential, so we only log that we got one
 async def log_token():
     try:
-        token = await oneshot_client._get_token()
-        logger.info(f"Bearer Token: {token}")
+        token = await get_oneshot_client()._get_token()
+        logger.info("Obtained 1Shot API bearer token")
         return token
     except Exception as e:
-        logger.error(f"Error getting token: {e}")
+        logger.error("Error getting token: %s", e)
         return None
\ No newline at end of file
@@ -0,0 +1,97 @@
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+from metrics import AI_PROMPT_TOKENS, AI_ESTIMATED_COST
+
+logger = logging.getLogger(__name__)
+
+# Assembles chat prompts under a fixed token budget:
+#   [system prompt] [user's financial context, once] [rolling summary of older turns] [recent turns] [new message]
+# Turns that no longer fit are folded into the summary instead of being resent in full on every call.
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "2000"))
+SUMMARY_TOKEN_BUDGET = 300
+MAX_RECENT_TURNS = 10 # messages kept verbatim even when they would fit, older ones go into the summary
+PROMPT_COST_PER_1K = float(os.getenv("AI_PROMPT_COST_PER_1K", "0.0005")) # USD, used for the cost estimate metric
+
+# tiktoken gives exact counts for OpenAI models, without it we fall back to the usual ~4 characters per token
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+MESSAGE_OVERHEAD = 4 # role and separator tokens the chat format adds around every message
+
+def count_tokens(text: str) -> int:
+    """Number of tokens a piece of text costs, exact with tiktoken installed and estimated otherwise."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD for message in messages)
+
+def _first_sentence(text: str, limit: int = 160) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 1].rstrip() + "…"
+
+class ChatMemory:
+    """Per-user conversation state kept in context.user_data: recent turns plus a rolling summary."""
+
+    def __init__(self):
+        self.summary_lines: List[str] = []
+        self.turns: List[Dict[str, str]] = []
+
+    @classmethod
+    def from_user_data(cls, user_data: dict) -> "ChatMemory":
+        memory = user_data.get('chat_memory')
+        if memory is None:
+            memory = user_data['chat_memory'] = cls()
+        return memory
+
+    def add_turn(self, role: str, content: str) -> None:
+        self.turns.append({"role": role, "content": content})
+        while len(self.turns) > MAX_RECENT_TURNS:
+            self._fold_oldest_turn()
+
+    @property
+    def summary(self) -> str:
+        return "\n".join(self.summary_lines)
+
+    def _fold_oldest_turn(self) -> None:
+        """Move the oldest turn into the summary as a one-line gist and keep the summary within its budget."""
+        turn = self.turns.pop(0)
+        speaker = "User" if turn["role"] == "user" else "Penny"
+        self.summary_lines.append(f"- {speaker}: {_first_sentence(turn['content'])}")
+        while len(self.summary_lines) > 1 and count_tokens(self.summary) > SUMMARY_TOKEN_BUDGET:
+            self.summary_lines.pop(0)
+
+class PromptBuilder:
+    def __init__(self, system_prompt: str, budget: int = PROMPT_TOKEN_BUDGET):
+        self.system_prompt = system_prompt
+        self.budget = budget
+
+    def build(self, memory: ChatMemory, user_message: str, user_context: Optional[str] = None) -> List[Dict[str, str]]:
+        """Build the messages for a chat completion, folding old turns into the summary until they fit the budget."""
+        while True:
+            messages = [{"role": "system", "content": self.system_prompt}]
+            if user_context:
+                messages.append({"role": "system", "content": user_context})
+            if memory.summary_lines:
+                messages.append({"role": "system", "content": "Summary of the earlier conversation:\n" + memory.summary})
+            messages.extend(memory.turns)
+            messages.append({"role": "user", "content": user_message})
+
+            tokens = count_message_tokens(messages)
+            if tokens <= self.budget or not memory.turns:
+                break
+            memory._fold_oldest_turn()
+
+        if tokens > self.budget:
+            logger.warning("Prompt is %s tokens even without history, budget is %s", tokens, self.budget)
+        AI_PROMPT_TOKENS.observe(tokens)
+        AI_ESTIMATED_COST.inc(tokens / 1000 * PROMPT_COST_PER_1K)
+        return messages
@@ -1,22 +1,32 @@
 import logging
+import os
+from datetime import datetime
+from typing import Optional
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler
 from telegram.constants import ParseMode
 
-from database import get_user_expenses, get_user_budgets, get_user_goals
-from aichat import OPENAI_AVAILABLE # So we can check if AI is available
+from database import get_data_version, get_cached_report, save_report, get_latest_expense_id, get_expenses_since
+from analytics import FinancialFacts, compute_facts, format_facts, render_report
+from currency import format_money
+from llm import LLM_AVAILABLE, LLMError, llm
 
 logger = logging.getLogger(__name__)
 
-# Attempt to import openai, handle if not available
-if OPENAI_AVAILABLE:
-    import openai
+# Reports are cached per user together with the data version they were built from (see database.py), every write
+# to the user's expenses, budgets or goals bumps that version. An unchanged version means the cached report is
+# still accurate and is sent right away without calling OpenAI. Reports also talk about "this month", month-to-date
+# burn rates and goal ETAs, so one is only reused on the (UTC) day it was written.
+# With REPORT_INCREMENTAL=true a stale report is updated instead of rewritten from scratch: the model gets the
+# previous report, the expenses added since and the current facts.
+INCREMENTAL_REPORTS = os.getenv("REPORT_INCREMENTAL", "false").lower() == "true"
 
 REPORT_SYSTEM_PROMPT = \
 """
-You are Penny, a financial assistant. You have been provided with the user's recent expenses,
-active budgets, and active financial goals. Your task is to generate a comprehensive
-financial report.
+You are Penny, a financial assistant. You have been provided with facts computed from the user's full expense
+history, their active budgets and their active financial goals. All totals, percentages and projections in them are
+already calculated and correct; use them as they are and don't do any arithmetic of your own. Your task is to
+generate a comprehensive financial report.
 
 The report should:
 1.  Briefly summarize overall spending.
@@ -28,90 +38,80 @@ The report should:
 Present the report in a clear, well-structured format. Use Markdown for formatting if it helps readability (e.g., bolding, bullet points).
 """
 
+REPORT_UPDATE_INSTRUCTIONS = \
+"""
+You previously wrote the financial report below for this user. Since then they added the expenses listed after it,
+and the facts that follow are up to date. Update the report so it reflects the new data, keeping the same
+structure. Don't mention that it is an update.
+"""
+
+def is_current(cached, data_version: int) -> bool:
+    """Whether a cached report (data_version, report, last_expense_id, created_at) can be sent as it is."""
+    if cached is None or cached[0] != data_version:
+        return False
+    return cached[3] is not None and cached[3][:10] == datetime.utcnow().date().isoformat()
+
+def format_expenses(expenses) -> str:
+    summary = ""
+    for expense in expenses:
+        # amount, category, description, date, payment_method, currency
+        desc = f", Description: {expense[2]}" if expense[2] else ""
+        summary += (
+            f"- Amount: {format_money(expense[0], expense[5])}, Category: {expense[1]}{desc}, "
+            f"Date: {expense[3].split(' ')[0]}\n"
+        )
+    return summary
+
 async def generate_financial_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Generates a financial report for the user using their expenses, budgets, and goals data."""
-    if not OPENAI_AVAILABLE:
+    user_id = update.effective_user.id
+
+    # read the version before the data, a write that lands while we generate makes the stored report stale again
+    data_version = get_data_version(user_id)
+    cached = get_cached_report(user_id)
+    if is_current(cached, data_version):
+        await update.message.reply_text(cached[1], parse_mode=ParseMode.MARKDOWN)
+        return
+
+    try:
+        # 1. Compute the numbers locally, see analytics.py
+        last_expense_id = get_latest_expense_id(user_id)
+        facts = compute_facts(user_id)
+    except Exception as e:
+        logger.error(f"Error computing report facts for user {user_id}: {e}")
         await update.message.reply_text(
-            "I'm sorry, but my AI capabilities for generating reports are not available right now. "
-            "Please try again later."
+            "I'm sorry, something went wrong while generating your report. Please try again later."
         )
         return
 
-    user_id = update.effective_user.id
+    if facts.is_empty:
+        await update.message.reply_text(
+            "I couldn't find any financial data (expenses, budgets, or goals) for you. "
+            "Please add some data using /expense, /budget, or /goal before requesting a report."
+        )
+        return
+
+    if not LLM_AVAILABLE:
+        # the plain report has all the numbers, it just lacks the commentary
+        await update.message.reply_text(render_report(facts), parse_mode=ParseMode.MARKDOWN)
+        return
+
     await update.message.reply_text("🔍 Generating your financial report, please wait a moment...")
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
 
     try:
-        # 1. Fetch data
-        # For expenses, let's fetch a larger limit for a more comprehensive report, e.g., last 50
-        expenses = get_user_expenses(user_id, limit=50)
-        budgets = get_user_budgets(user_id)
-        goals = get_user_goals(user_id, status='active') # Ensure we get active goals
-
-        if not expenses and not budgets and not goals:
-            await update.message.reply_text(
-                "I couldn't find any financial data (expenses, budgets, or goals) for you. "
-                "Please add some data using /expense, /budget, or /goal before requesting a report."
-            )
-            return
-
-        # 2. Format data for the AI
-        report_data_summary = "Here is your financial data:\n\n"
-
-        if expenses:
-            report_data_summary += "**Recent Expenses (last 50 or fewer):**\n"
-            for expense in expenses:
-                # amount, category, description, date, payment_method
-                desc = f", Description: {expense[2]}" if expense[2] else ""
-                report_data_summary += f"- Amount: ${expense[0]:.2f}, Category: {expense[1]}{desc}, Date: {expense[3].split(' ')[0]}\n"
-            report_data_summary += "\n"
-        else:
-            report_data_summary += "No recent expenses found.\n\n"
-
-        if budgets:
-            report_data_summary += "**Active Budgets:**\n"
-            for budget in budgets:
-                # id, category, amount, period, start_date, end_date
-                report_data_summary += f"- Category: {budget[1]}, Amount: ${budget[2]:.2f}, Period: {budget[3]}, Ends: {budget[5]}\n"
-            report_data_summary += "\n"
-        else:
-            report_data_summary += "No active budgets found.\n\n"
-
-        if goals:
-            report_data_summary += "**Active Goals:**\n"
-            for goal in goals:
-                # id, name, target_amount, current_amount, deadline, category, status
-                deadline_info = f", Deadline: {goal[4]}" if goal[4] else ""
-                report_data_summary += f"- Name: {goal[1]}, Target: ${goal[2]:.2f}, Current: ${goal[3]:.2f}{deadline_info}\n"
-            report_data_summary += "\n"
-        else:
-            report_data_summary += "No active goals found.\n"
-
-        # 3. Construct messages for OpenAI
-        messages = [
-            {"role": "system", "content": REPORT_SYSTEM_PROMPT},
-            {"role": "user", "content": report_data_summary}
-        ]
-
-        # 4. Call OpenAI API
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo", # Or a newer model if available and preferred
-            messages=messages,
-            max_tokens=1000,  # Reports might be longer
-            temperature=0.7,
-            top_p=0.95
-        )
+        ai_report = await write_ai_report(user_id, facts, cached)
 
-        ai_report = response.choices[0].message.content
-
-        # 5. Send report to user
+        # Send report to user and keep it until their data changes
         await update.message.reply_text(ai_report, parse_mode=ParseMode.MARKDOWN)
+        save_report(user_id, data_version, ai_report, last_expense_id)
 
-    except openai.error.OpenAIError as e: # More specific error handling for OpenAI
-        logger.error(f"OpenAI API error while generating report for user {user_id}: {e}")
+    except LLMError as e: # More specific error handling for the AI service
+        logger.error(f"LLM error while generating report for user {user_id}: {e}")
+        # fall back to the plain report rather than leaving the user with nothing
         await update.message.reply_text(
-            "I encountered an issue with the AI service while trying to generate your report. "
-            "Please try again in a few moments."
+            "I couldn't reach the AI service, so here is your report without the commentary:\n\n" + render_report(facts),
+            parse_mode=ParseMode.MARKDOWN
         )
     except Exception as e:
         logger.error(f"Error generating financial report for user {user_id}: {e}")
@@ -119,6 +119,57 @@ async def generate_financial_report(update: Update, context: ContextTypes.DEFAUL
             "I'm sorry, something went wrong while generating your report. Please try again later."
         )
 
+async def write_ai_report(user_id: int, facts: FinancialFacts, cached=None) -> str:
+    """Have the model write the report from the computed facts, updating the cached report in incremental mode."""
+    # 1. Format the facts for the AI
+    if INCREMENTAL_REPORTS and cached is not None and cached[2] is not None:
+        _, previous_report, previous_expense_id, _ = cached
+        new_expenses = get_expenses_since(user_id, previous_expense_id)
+        report_data_summary = f"**Previous report:**\n{previous_report}\n\n"
+        if new_expenses:
+            report_data_summary += "**Expenses added since:**\n" + format_expenses(new_expenses) + "\n"
+        else:
+            report_data_summary += "No new expenses since the previous report.\n\n"
+        report_data_summary += format_facts(facts)
+        system_prompt = REPORT_SYSTEM_PROMPT + REPORT_UPDATE_INSTRUCTIONS
+    else:
+        report_data_summary = "Here is your financial data:\n\n" + format_facts(facts)
+        system_prompt = REPORT_SYSTEM_PROMPT
+
+    # 2. Construct messages for the model
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": report_data_summary}
+    ]
+
+    # 3. Call the report route, which uses the larger model and a longer timeout, see llm.py
+    return await llm.complete("report", messages)
+
+async def build_report(user_id: int) -> Optional[str]:
+    """Produce a user's report without a chat to reply in, for scheduled delivery. None if they have no data.
+
+    Uses the same cache as /report, and falls back to the plain report if the AI one can't be written.
+    """
+    data_version = get_data_version(user_id)
+    cached = get_cached_report(user_id)
+    if is_current(cached, data_version):
+        return cached[1]
+
+    last_expense_id = get_latest_expense_id(user_id)
+    facts = compute_facts(user_id)
+    if facts.is_empty:
+        return None
+    if not LLM_AVAILABLE:
+        return render_report(facts)
+
+    try:
+        ai_report = await write_ai_report(user_id, facts, cached)
+    except LLMError as e:
+        logger.warning(f"LLM error while generating scheduled report for user {user_id}: {e}")
+        return render_report(facts)
+    save_report(user_id, data_version, ai_report, last_expense_id)
+    return ai_report
+
 def get_report_handler() -> CommandHandler:
     """Returns the CommandHandler for the /report command."""
-    return CommandHandler("report", generate_financial_report) 
\ No newline at end of file
+    return CommandHandler("report", generate_financial_report)
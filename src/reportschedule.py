@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import logging
+import os
+from typing import List, Optional
+
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.ext import Application, CommandHandler, ContextTypes, filters
+
+from database import subscribe_report, unsubscribe_report, get_due_report_subscriptions, mark_report_sent
+from report import build_report
+from sender import message_scheduler, Priority
+
+logger = logging.getLogger(__name__)
+
+# Weekly reports for subscribed users are generated off-peak by a JobQueue job instead of on demand:
+#   - the daily batch starts at REPORT_BATCH_HOUR (UTC) and works through the subscriptions due that day in
+#     chunks of REPORT_BATCH_SIZE, waiting REPORT_BATCH_INTERVAL seconds between chunks to spread the load
+#   - at most REPORT_CONCURRENCY reports are being written by OpenAI at any time
+#   - reports are stored in the report cache, so a /report afterwards is instant, and delivered through the
+#     message scheduler at bulk priority so they never delay interactive replies
+#   - they're personal, so subscribing only works in the private chat with the bot and that's where they go
+
+REPORT_BATCH_HOUR = int(os.getenv("REPORT_BATCH_HOUR", "3"))
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "20"))
+REPORT_BATCH_INTERVAL = int(os.getenv("REPORT_BATCH_INTERVAL", "60"))
+REPORT_CONCURRENCY = int(os.getenv("REPORT_CONCURRENCY", "3"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+REPORT_TITLE = "📬 Your weekly financial report\n\n"
+
+# SQLite's %w numbering, 0 is Sunday
+WEEKDAYS = ["sunday", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday"]
+
+def parse_weekday(text: str) -> Optional[int]:
+    """Turn "monday", "Mon" or "mo" into a weekday number, None if it isn't one."""
+    text = text.strip().lower()
+    if len(text) < 2:
+        return None
+    matches = [number for number, name in enumerate(WEEKDAYS) if name.startswith(text)]
+    return matches[0] if len(matches) == 1 else None
+
+def today_weekday() -> int:
+    return (datetime.datetime.now(datetime.timezone.utc).weekday() + 1) % 7
+
+async def subscribe_report_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Subscribe to a weekly report, delivered on the given day or on today's weekday."""
+    if context.args:
+        weekday = parse_weekday(context.args[0])
+        if weekday is None:
+            await update.message.reply_text(
+                "I didn't recognize that day. Try something like /subscribe_report monday"
+            )
+            return
+    else:
+        weekday = today_weekday()
+
+    subscribe_report(update.effective_user.id, update.effective_user.id, weekday)
+    await update.message.reply_text(
+        f"📬 You're subscribed! I'll send you your financial report every {WEEKDAYS[weekday].capitalize()} morning.\n"
+        "Use /unsubscribe_report to stop."
+    )
+
+async def unsubscribe_report_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop the weekly report."""
+    if unsubscribe_report(update.effective_user.id):
+        await update.message.reply_text("You won't receive weekly reports anymore. You can still use /report anytime.")
+    else:
+        await update.message.reply_text("You're not subscribed to weekly reports. Use /subscribe_report to start.")
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Split a text into messages Telegram accepts, at paragraph or line breaks where possible."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    return parts + [text]
+
+async def _deliver_report(bot, semaphore: asyncio.Semaphore, user_id: int, chat_id: int) -> None:
+    try:
+        async with semaphore:
+            report = await build_report(user_id)
+        if report is not None:
+            for part in split_message(REPORT_TITLE + report):
+                try:
+                    await message_scheduler.send_message(
+                        bot, Priority.BULK, chat_id=chat_id, text=part, parse_mode=ParseMode.MARKDOWN
+                    )
+                except BadRequest as e:
+                    # the model's Markdown doesn't always parse, or a split cut through an entity
+                    logger.warning(f"Sending scheduled report to user {user_id} as plain text: {e}")
+                    await message_scheduler.send_message(bot, Priority.BULK, chat_id=chat_id, text=part)
+    except Exception as e:
+        logger.error(f"Failed to deliver scheduled report to user {user_id}: {e}")
+    finally:
+        # failures are not retried until next week, otherwise one broken user would be picked up by every chunk
+        mark_report_sent(user_id)
+
+async def send_scheduled_reports(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Generate and deliver one chunk of due reports, then schedule the next chunk if there are more."""
+    due = get_due_report_subscriptions(limit=REPORT_BATCH_SIZE)
+    if not due:
+        return
+
+    logger.info(f"Generating {len(due)} scheduled reports")
+    semaphore = asyncio.Semaphore(REPORT_CONCURRENCY)
+    await asyncio.gather(*(_deliver_report(context.bot, semaphore, user_id, chat_id) for user_id, chat_id in due))
+
+    if len(due) == REPORT_BATCH_SIZE:
+        context.job_queue.run_once(send_scheduled_reports, REPORT_BATCH_INTERVAL, name="scheduled_reports")
+
+def schedule_report_jobs(application: Application) -> None:
+    """Register the daily report batch on the application's JobQueue."""
+    if application.job_queue is None:
+        logger.warning(
+            "JobQueue is not available, weekly reports are disabled. Install python-telegram-bot[job-queue] to enable them."
+        )
+        return
+    application.job_queue.run_daily(
+        send_scheduled_reports,
+        time=datetime.time(hour=REPORT_BATCH_HOUR, tzinfo=datetime.timezone.utc),
+        name="scheduled_reports"
+    )
+
+def get_report_subscription_handlers() -> List[CommandHandler]:
+    """Returns the handlers for /subscribe_report and /unsubscribe_report."""
+    return [
+        CommandHandler("subscribe_report", subscribe_report_command, filters=filters.ChatType.PRIVATE),
+        CommandHandler("unsubscribe_report", unsubscribe_report_command),
+    ]
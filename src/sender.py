@@ -0,0 +1,370 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Telegram Bot API limits: https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+# roughly 30 messages per second overall, 1 per second to a single private chat and 20 per minute to a group
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20.0 / 60.0
+CHAT_BURST = 3 # a chat can receive a short burst before its bucket starts throttling
+
+CLOCK_SLACK = 0.05 # seconds of bucket debt we tolerate for a message that was already parked once
+MAX_ATTEMPTS = 3 # how many times we retry a message after Telegram answers with a 429
+MAX_IDLE_BUCKETS = 1000 # prune per-chat buckets above this size so memory doesn't grow with every chat we ever talked to
+MAX_IN_FLIGHT = 30 # concurrent Bot API requests, so response latency doesn't cap throughput below GLOBAL_RATE
+# a 429 pauses only the chat it came from, unless this many different chats got one within the window
+GLOBAL_RETRY_AFTER_CHATS = 3
+GLOBAL_RETRY_AFTER_WINDOW = 5.0 # seconds
+# Bot API methods that post or edit a message and so count against the limits, see SchedulerRateLimiter
+MESSAGE_ENDPOINTS = ("send", "edit", "copy", "forward")
+SCHEDULED = "scheduled" # rate_limit_args of the scheduler's own requests, which already took their tokens
+
+# lower value goes first, so interactive replies always jump ahead of queued notifications
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+    BULK = 2
+
+class TokenBucket:
+    """A classic token bucket, refilled lazily whenever it is asked for a token."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available right now."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def pause(self, now: float, seconds: float) -> None:
+        """Hand out no token for the given number of seconds."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+class _OutboundMessage:
+    __slots__ = ("bot", "method", "kwargs", "priority", "future", "attempts", "sequence", "released")
+
+    def __init__(self, bot, method: str, kwargs: Dict[str, Any], priority: Priority, future: asyncio.Future):
+        self.bot = bot
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.sequence = None
+        self.released = False # set once the message comes back from being parked on its chat bucket
+
+    @property
+    def chat_id(self) -> int:
+        return self.kwargs["chat_id"]
+
+class MessageScheduler:
+    """Sends outbound Telegram messages through per-chat and global token buckets with priority lanes."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE):
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count() # keeps FIFO order inside a lane
+        self._lane_depths = {priority: 0 for priority in Priority}
+        # messages per chat waiting for their chat bucket, in submission order: messages that Telegram told to back
+        # off go back to their place in front of the ones parked after them. One timer per chat releases the first.
+        self._parked: Dict[Any, List[Tuple[int, _OutboundMessage]]] = {}
+        self._parked_timers: Dict[Any, asyncio.TimerHandle] = {}
+        self._paused_until = 0.0 # set when Telegram tells several chats to back off with retry_after
+        self._retry_afters = deque() # (time, chat id) of recent 429s, to tell a global flood limit from a chat's
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._deliveries: Dict[Any, asyncio.Task] = {} # latest delivery per chat, the next one waits for it
+        self._worker: Optional[asyncio.Task] = None
+
+    # --- public API ---
+    def submit(self, bot, method: str = "send_message", priority: Priority = Priority.NOTIFICATION, **kwargs) -> asyncio.Future:
+        """Queue a Bot API call (e.g. send_message, send_photo) and return a future with its result."""
+        if "chat_id" not in kwargs:
+            raise ValueError("Outbound messages need a chat_id")
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._put(_OutboundMessage(bot, method, kwargs, priority, future))
+        return future
+
+    async def send_message(self, bot, priority: Priority = Priority.NOTIFICATION, **kwargs):
+        """Send a text message through the scheduler and wait until Telegram accepted it."""
+        return await self.submit(bot, "send_message", priority, **kwargs)
+
+    async def send_photo(self, bot, priority: Priority = Priority.NOTIFICATION, **kwargs):
+        """Send a photo through the scheduler and wait until Telegram accepted it."""
+        return await self.submit(bot, "send_photo", priority, **kwargs)
+
+    async def acquire(self, chat_id: Any = None) -> None:
+        """Wait for a token of the global bucket for a request sent outside the queue, e.g. a reply to a command.
+
+        The chat's bucket is charged without waiting, so queued messages to the chat leave room for the reply.
+        """
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self._global_bucket.wait_time(now))
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        self._global_bucket.consume(now)
+        if chat_id is not None:
+            self._chat_bucket(chat_id, now).consume(now)
+
+    def retry_after(self, chat_id: Any, seconds: float) -> None:
+        """Back off after Telegram answered a request to the chat with a 429.
+
+        Only the chat is paused, unless several chats were told to back off recently, then everything is.
+        """
+        now = time.monotonic()
+        self._chat_bucket(chat_id, now).pause(now, seconds)
+        self._retry_afters.append((now, chat_id))
+        while self._retry_afters[0][0] < now - GLOBAL_RETRY_AFTER_WINDOW:
+            self._retry_afters.popleft()
+        if len({chat for _, chat in self._retry_afters}) >= GLOBAL_RETRY_AFTER_CHATS:
+            self._paused_until = max(self._paused_until, now + seconds)
+
+    def queue_depth(self) -> int:
+        """Total number of messages waiting to be sent, including ones parked on a chat bucket."""
+        return sum(self._lane_depths.values())
+
+    def lane_depths(self) -> Dict[str, int]:
+        """Number of waiting messages per priority lane."""
+        return {priority.name.lower(): depth for priority, depth in self._lane_depths.items()}
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        """Try to flush whatever is queued, then stop the worker and fail anything left over."""
+        if self._worker is None:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while self.queue_depth() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        for delivery in list(self._deliveries.values()):
+            delivery.cancel()
+        self._deliveries.clear()
+        leftovers = [message for parked in self._parked.values() for _, message in parked]
+        for timer in self._parked_timers.values():
+            timer.cancel()
+        self._parked_timers.clear()
+        self._parked.clear()
+        while self._queue is not None and not self._queue.empty():
+            leftovers.append(self._queue.get_nowait()[2])
+        for message in leftovers:
+            self._fail(message, RuntimeError("Message scheduler stopped before the message was sent"))
+        if leftovers:
+            logger.warning(f"Message scheduler stopped with {len(leftovers)} messages still pending")
+
+    # --- internals ---
+    def _ensure_worker(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    def _put(self, message: _OutboundMessage, count: bool = True) -> None:
+        if count:
+            self._lane_depths[message.priority] += 1
+        if message.sequence is None:
+            message.sequence = next(self._sequence)
+        self._queue.put_nowait((message.priority, message.sequence, message))
+
+    def _done(self, message: _OutboundMessage) -> None:
+        self._lane_depths[message.priority] -= 1
+
+    def _fail(self, message: _OutboundMessage, exc: BaseException) -> None:
+        self._done(message)
+        if not message.future.done():
+            message.future.set_exception(exc)
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_IDLE_BUCKETS:
+                self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.is_full(now)}
+            # positive chat ids are private chats, groups, channels and @usernames are throttled much harder
+            rate = PRIVATE_CHAT_RATE if isinstance(chat_id, int) and chat_id > 0 else GROUP_CHAT_RATE
+            bucket = TokenBucket(rate, CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _defer(self, message: _OutboundMessage, now: float) -> None:
+        """Park a message until its chat bucket refills without blocking other chats."""
+        message.released = False
+        heapq.heappush(self._parked.setdefault(message.chat_id, []), (message.sequence, message))
+        self._schedule_release(message.chat_id, now)
+
+    def _parked_ahead(self, message: _OutboundMessage) -> bool:
+        """Whether a message to the same chat that was submitted earlier is parked."""
+        parked = self._parked.get(message.chat_id)
+        return bool(parked) and parked[0][0] < message.sequence
+
+    def _schedule_release(self, chat_id: Any, now: float) -> None:
+        """Requeue the chat's first parked message once its bucket has a token, unless that's already planned."""
+        if chat_id not in self._parked or chat_id in self._parked_timers:
+            return
+        delay = self._chat_bucket(chat_id, now).wait_time(now)
+        self._parked_timers[chat_id] = asyncio.get_running_loop().call_later(delay, self._release, chat_id)
+
+    def _release(self, chat_id: Any) -> None:
+        del self._parked_timers[chat_id]
+        parked = self._parked[chat_id]
+        _, message = heapq.heappop(parked)
+        if not parked:
+            del self._parked[chat_id]
+        message.released = True
+        self._put(message, count=False)
+
+    async def _run(self) -> None:
+        while True:
+            priority, sequence, message = await self._queue.get()
+            if message.future.cancelled():
+                self._done(message)
+                # a cancelled message that was released from parking hands its turn to the next parked one
+                self._schedule_release(message.chat_id, time.monotonic())
+                continue
+
+            now = time.monotonic()
+            if now < self._paused_until:
+                # parked messages are released during the pause, back in the queue this one can't overtake them
+                self._put(message, count=False)
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            chat_wait = self._chat_bucket(message.chat_id, now).wait_time(now)
+            # a message that just left the parking lot was timed for its slot, so tiny clock drift doesn't park it again
+            if chat_wait > (CLOCK_SLACK if message.released else 0) or self._parked_ahead(message):
+                self._defer(message, now)
+                continue
+
+            global_wait = self._global_bucket.wait_time(now)
+            if global_wait > 0:
+                # put it back at its original position so a higher priority message can still overtake it
+                self._put(message, count=False)
+                await asyncio.sleep(global_wait)
+                continue
+
+            self._global_bucket.consume(now)
+            self._chat_buckets[message.chat_id].consume(now)
+            self._schedule_release(message.chat_id, now)
+            # deliveries run concurrently so a slow response doesn't hold up other chats, one chat's stay in order
+            await self._in_flight.acquire()
+            chat_id = message.chat_id
+            delivery = asyncio.get_running_loop().create_task(
+                self._deliver_after(self._deliveries.get(chat_id), message)
+            )
+            self._deliveries[chat_id] = delivery
+            delivery.add_done_callback(lambda task, chat_id=chat_id: self._delivered(chat_id, task))
+
+    def _delivered(self, chat_id: Any, delivery: asyncio.Task) -> None:
+        if self._deliveries.get(chat_id) is delivery:
+            del self._deliveries[chat_id]
+
+    async def _deliver_after(self, previous: Optional[asyncio.Task], message: _OutboundMessage) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            now = time.monotonic()
+            if self._chat_bucket(message.chat_id, now).paused_until > now:
+                # an earlier message to the chat was told to back off, park it in its place behind that one
+                self._defer(message, now)
+                return
+            await self._deliver(message)
+        except asyncio.CancelledError:
+            self._fail(message, RuntimeError("Message scheduler stopped before the message was sent"))
+            raise
+        finally:
+            self._in_flight.release()
+
+    async def _deliver(self, message: _OutboundMessage) -> None:
+        message.attempts += 1
+        kwargs = message.kwargs
+        if getattr(message.bot, "rate_limiter", None) is not None:
+            kwargs = dict(kwargs, rate_limit_args=SCHEDULED)
+        try:
+            result = await getattr(message.bot, message.method)(**kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            self.retry_after(message.chat_id, retry_after)
+            if message.attempts < MAX_ATTEMPTS:
+                logger.warning(f"Telegram asked us to slow down for {retry_after}s, requeueing message to chat {message.chat_id}")
+                # parked in front of the chat's later messages, including ones parked before the 429 came back
+                self._defer(message, time.monotonic())
+            else:
+                logger.error(f"Giving up on message to chat {message.chat_id} after {message.attempts} attempts")
+                self._fail(message, e)
+        except Exception as e:
+            self._fail(message, e)
+        else:
+            self._done(message)
+            if not message.future.done():
+                message.future.set_result(result)
+
+class SchedulerRateLimiter(BaseRateLimiter):
+    """Counts the bot's direct requests, like reply_text in a handler, against the scheduler's buckets.
+
+    Set it on the Application so interactive replies and queued messages share the global limit. Requests the
+    scheduler makes itself already took their tokens and pass straight through.
+    """
+
+    def __init__(self, scheduler: MessageScheduler):
+        self.scheduler = scheduler
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if rate_limit_args == SCHEDULED or not endpoint.startswith(MESSAGE_ENDPOINTS) or endpoint == "sendChatAction":
+            return await callback(*args, **kwargs)
+        chat_id = data.get("chat_id")
+        await self.scheduler.acquire(chat_id)
+        try:
+            return await callback(*args, **kwargs)
+        except RetryAfter as e:
+            if chat_id is not None:
+                retry_after = e.retry_after
+                self.scheduler.retry_after(
+                    chat_id, retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                )
+            raise
+
+# the scheduler is a singleton so every module shares the same buckets, import it where you need to send messages
+message_scheduler = MessageScheduler()
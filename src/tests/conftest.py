@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the bot's modules import each other as top-level modules from src/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
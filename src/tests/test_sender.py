@@ -0,0 +1,46 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from sender import MessageScheduler
+
+class RecordingBot:
+    """Records the texts it sends, answering the given texts' first attempt with a 429."""
+
+    rate_limiter = None
+
+    def __init__(self, retry_after_texts=()):
+        self.sent = []
+        self.retry_after_texts = set(retry_after_texts)
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(0.01)
+        if text in self.retry_after_texts:
+            self.retry_after_texts.discard(text)
+            raise RetryAfter(1)
+        self.sent.append(text)
+        return text
+
+async def _send_all(bot, texts, chat_id=1):
+    scheduler = MessageScheduler()
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(scheduler.submit(bot, chat_id=chat_id, text=text) for text in texts)), timeout=15
+        )
+    finally:
+        await scheduler.stop()
+    return scheduler
+
+def test_chat_keeps_its_order_after_retry_after():
+    # m0-m2 go out as the chat's burst, m3 and m4 are parked on its bucket when m1 gets the 429
+    bot = RecordingBot(retry_after_texts={"m1"})
+    texts = [f"m{i}" for i in range(5)]
+    scheduler = asyncio.run(_send_all(bot, texts))
+    assert bot.sent == texts
+    assert scheduler.queue_depth() == 0
+
+def test_chat_keeps_its_order_after_repeated_retry_after():
+    bot = RecordingBot(retry_after_texts={"m0", "m3"})
+    texts = [f"m{i}" for i in range(6)]
+    asyncio.run(_send_all(bot, texts))
+    assert bot.sent == texts
@@ -11,8 +11,7 @@ from telegram.ext import (
     ConversationHandler, 
     CommandHandler, 
     MessageHandler, 
-    filters, 
-    CallbackQueryHandler
+    filters
 )
 from telegram.constants import ParseMode
 
@@ -30,9 +29,15 @@ from objects import (
     TxType,
     ConversationState
 )
+from sender import message_scheduler
+from callbacks import callback_router, encode
 
 logger = logging.getLogger(__name__)
 
+# Callback actions of the confirmation buttons, see callbacks.py
+TRANSFER_CONFIRM = "tc"
+TRANSFER_CANCEL = "tx"
+
 # Define states for the token transfer conversation
 class TokenTransferState:
     SELECT_TOKEN = 20
@@ -192,8 +197,8 @@ async def enter_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         # Create confirmation keyboard
         keyboard = [
             [
-                InlineKeyboardButton("Confirm ✅", callback_data="confirm"),
-                InlineKeyboardButton("Cancel ❌", callback_data="cancel")
+                InlineKeyboardButton("Confirm ✅", callback_data=encode(update.effective_user.id, TRANSFER_CONFIRM)),
+                InlineKeyboardButton("Cancel ❌", callback_data=encode(update.effective_user.id, TRANSFER_CANCEL))
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -226,18 +231,21 @@ async def enter_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
         return TokenTransferState.ENTER_AMOUNT
 
+async def cancel_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Drop the transfer when the user presses Cancel."""
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        "Token transfer cancelled.",
+        parse_mode=ParseMode.MARKDOWN
+    )
+    return ConversationHandler.END
+
 async def confirm_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Execute the token transfer transaction."""
     query = update.callback_query
     await query.answer()
     
-    if query.data == "cancel":
-        await query.edit_message_text(
-            "Token transfer cancelled.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return ConversationHandler.END
-    
     try:
         # Get transaction parameters
         token_address = context.user_data['token_transfer']['token_address']
@@ -350,7 +358,8 @@ async def token_transfer_success(execution_id: str, memo: TransactionMemo, conte
             f"View on [Etherscan](https://sepolia.etherscan.io/tx/{execution_id})"
         )
         
-        await context.bot.send_message(
+        await message_scheduler.send_message(
+            context.bot,
             chat_id=memo.associated_user_id,
             text=success_message,
             parse_mode=ParseMode.MARKDOWN
@@ -358,12 +367,16 @@ async def token_transfer_success(execution_id: str, memo: TransactionMemo, conte
         
     except Exception as e:
         logger.error(f"Error in token_transfer_success: {e}")
-        await context.bot.send_message(
+        await message_scheduler.send_message(
+            context.bot,
             chat_id=memo.associated_user_id,
             text="❌ An error occurred while processing your token transfer notification.",
             parse_mode=ParseMode.MARKDOWN
         )
 
+callback_router.register(TRANSFER_CONFIRM, confirm_transfer)
+callback_router.register(TRANSFER_CANCEL, cancel_transfer)
+
 def get_token_transfer_handler():
     """Return the conversation handler for token transfers."""
     return ConversationHandler(
@@ -379,7 +392,7 @@ def get_token_transfer_handler():
                 MessageHandler(filters.TEXT & ~filters.COMMAND, enter_amount)
             ],
             TokenTransferState.CONFIRM_TRANSFER: [
-                CallbackQueryHandler(confirm_transfer, pattern="^(confirm|cancel)$")
+                callback_router.handler(TRANSFER_CONFIRM, TRANSFER_CANCEL)
             ]
         },
         fallbacks=[CommandHandler("cancel", canceler)],
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Set
+
+from currency import format_money
+from database import add_write_listener, get_user_expenses, get_user_budgets, get_user_goals, get_home_currency
+from metrics import USER_CONTEXT_CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# The financial snapshot that goes into AI chat prompts (recent expenses, active budgets and goals), kept formatted
+# per user so a chat message doesn't hit the database at all:
+#   - database.py tells us about every write to a user's data, which drops their entry and schedules a rebuild
+#     in a worker thread, so the next chat message usually finds it ready without the rebuild's SQLite reads
+#     holding up other updates on the event loop
+#   - /start and /hello pre-warm the entry, since a chat usually follows them. Telegram doesn't tell bots when a
+#     user is typing, so opening a conversation is the earliest signal we get.
+
+MAX_ENTRIES = 5000
+RECENT_EXPENSES = 5
+
+def format_expense_context(expenses) -> str:
+    """Describe the user's recent expenses for the model, empty if there are none."""
+    if not expenses:
+        return ""
+    lines = ["Here are the user's recent expenses for context:"]
+    for amount, category, description, date, payment_method, currency in expenses:
+        lines.append(f"- Amount: {format_money(amount, currency)}, Category: {category}, Date: {date.split(' ')[0]}")
+    return "\n".join(lines)
+
+def build_user_context(user_id: int) -> str:
+    """Read and format the user's recent expenses, active budgets and active goals."""
+    sections = []
+    expense_context = format_expense_context(get_user_expenses(user_id, limit=RECENT_EXPENSES))
+    if expense_context:
+        sections.append(expense_context)
+
+    home_currency = get_home_currency(user_id)
+    budgets = get_user_budgets(user_id)
+    if budgets:
+        sections.append("The user's active budgets:\n" + "\n".join(
+            f"- {category}: {format_money(amount, home_currency)} per {period}, until {end_date}"
+            for _, category, amount, period, _, end_date in budgets
+        ))
+
+    goals = get_user_goals(user_id, status='active')
+    if goals:
+        sections.append("The user's active goals:\n" + "\n".join(
+            f"- {name}: {format_money(current, home_currency)} saved of {format_money(target, home_currency)}"
+            + (f", deadline {deadline}" if deadline else "")
+            for _, name, target, current, deadline, _, _ in goals
+        ))
+    return "\n\n".join(sections)
+
+class UserContextCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, str]" = OrderedDict()
+        self._pending: Set[int] = set() # users with a rebuild already scheduled
+        self._stale: Set[int] = set() # users whose data changed while their rebuild was running
+
+    def get(self, user_id: int) -> str:
+        """The user's formatted context, built now if it isn't cached."""
+        context = self._entries.get(user_id)
+        if context is not None:
+            USER_CONTEXT_CACHE_REQUESTS.labels("hit").inc()
+            self._entries.move_to_end(user_id)
+            return context
+        USER_CONTEXT_CACHE_REQUESTS.labels("miss").inc()
+        return self._build(user_id)
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop the user's entry and rebuild it once the current handler yields to the event loop."""
+        self._entries.pop(user_id, None)
+        if user_id in self._pending:
+            # a rebuild that is already running may have read the data from before this write
+            self._stale.add(user_id)
+        self.prewarm(user_id)
+
+    def prewarm(self, user_id: int) -> None:
+        """Schedule building the user's entry in a worker thread, off the path of whatever handler is running now."""
+        if user_id in self._entries or user_id in self._pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # scripts and tools that write to the database without an event loop just get a cold cache
+            return
+        self._pending.add(user_id)
+        # started from the loop rather than right away, a write notifies us before its commit and the thread
+        # must not read the data from before it
+        loop.call_soon(self._warm, loop, user_id)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _warm(self, loop: asyncio.AbstractEventLoop, user_id: int) -> None:
+        if user_id in self._entries:
+            self._pending.discard(user_id)
+            return
+        build = loop.run_in_executor(None, build_user_context, user_id)
+        build.add_done_callback(lambda build: self._warmed(user_id, build))
+
+    def _warmed(self, user_id: int, build: asyncio.Future) -> None:
+        self._pending.discard(user_id)
+        if user_id in self._stale:
+            self._stale.discard(user_id)
+            self.prewarm(user_id)
+            return
+        try:
+            context = build.result()
+        except Exception as e:
+            logger.warning(f"Pre-warming chat context for user {user_id} failed: {e}")
+            return
+        if user_id not in self._entries:
+            self._store(user_id, context)
+
+    def _build(self, user_id: int) -> str:
+        return self._store(user_id, build_user_context(user_id))
+
+    def _store(self, user_id: int, context: str) -> str:
+        self._entries[user_id] = context
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False) # least recently used
+        return context
+
+user_context_cache = UserContextCache()
+add_write_listener(user_context_cache.invalidate)